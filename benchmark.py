@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import os
+import sys
+import json
+import time
+import shutil
+import resource
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+import numpy as np
+import awkward as ak
+import uproot
+import yaml
+
+import utils.tools as tools
+import utils.branches as branches
+import utils.study as study
+import utils.observables as observables
+import utils.matching as matching
+import utils.plotting as plotting
+import utils.synthetic as synthetic
+
+
+def makeJets(nEvents, prefix, meanJets=4, seed=0):
+
+    # random jagged pt/eta/phi jet collection named like the formatted nano branches
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(meanJets, nEvents)
+    nJets = counts.sum()
+
+    return ak.zip({prefix + '_pt': ak.unflatten(rng.exponential(40, nJets), counts),
+                   prefix + '_eta': ak.unflatten(rng.uniform(-3, 3, nJets), counts),
+                   prefix + '_phi': ak.unflatten(rng.uniform(-np.pi, np.pi, nJets), counts)}, depth_limit=1)
+
+
+def loopMatch(puppiJET, l1jet, DR_MAX=0.4, minpT=20.0):
+
+    # reference: the per-event loop getPUPPIJET used before the columnar matching
+    matched_l1_jet = []
+    for i in range(len(puppiJET)):
+        matched_jet = None
+        recoPt = puppiJET['recoJet_pt'][i]
+        if len(recoPt) > 0 and ak.max(recoPt) > minpT:
+            lead = slice(ak.argmax(recoPt), ak.argmax(recoPt) + 1)
+            for j in range(len(l1jet['Jet_pt'][i])):
+                dR = tools.deltaR(puppiJET['recoJet_eta'][i][lead], puppiJET['recoJet_phi'][i][lead], l1jet['Jet_eta'][i][j], l1jet['Jet_phi'][i][j])
+                if ak.any(dR < DR_MAX):
+                    matched_jet = l1jet['Jet_pt'][i][j]
+                    break
+        matched_l1_jet.append(matched_jet)
+
+    return matched_l1_jet
+
+
+def benchMatching(nEvents):
+
+    l1jet = makeJets(nEvents, 'Jet', seed=1)
+    puppiJET = makeJets(nEvents, 'recoJet', seed=2)
+
+    start = time.perf_counter()
+    loop = loopMatch(puppiJET, l1jet)
+    tLoop = time.perf_counter() - start
+
+    start = time.perf_counter()
+    matched = matching.matchObjects(matching.getObjects(puppiJET, 'recoJet'), matching.getObjects(l1jet, 'Jet'),
+                                    mode='leading', drMax=0.4, refMinPt=20.0)
+    columnar = ak.to_list(matched['pt'])
+    tColumnar = time.perf_counter() - start
+
+    if columnar != loop:
+        raise RuntimeError("Columnar matching differs from the per-event loop")
+
+    print("matching {:>9d} events: loop {:8.3f} s, columnar {:8.3f} s, speedup {:7.1f}x".format(nEvents, tLoop, tColumnar, tLoop/tColumnar))
+
+    for mode in matching.modes:
+        start = time.perf_counter()
+        matching.matchObjects(matching.getObjects(puppiJET, 'recoJet'), matching.getObjects(l1jet, 'Jet'), mode=mode)
+        print("    mode {:>8s}: {:8.3f} s".format(mode, time.perf_counter() - start))
+
+
+def loopFormat(data):
+
+    # reference: the field by field copy and delete formatBranches used before the rename map
+    for branch in ak.fields(data):
+        if branch.startswith("Jet_"):
+            data[branch.replace("Jet_", "recoJet_")] = data[branch]
+            del data[branch]
+
+    for branch in ak.fields(data):
+        if "L1" in branch:
+            data[branch.replace("L1", "").replace("MP", "").replace("Emul", "")] = data[branch]
+            del data[branch]
+
+    return data
+
+
+def benchFormat(nEvents, fieldCounts=(10, 50, 200)):
+
+    # renaming wide nano-like records: the loop grows with the number of fields, the rename map shouldn't
+    rng = np.random.default_rng(0)
+    counts = rng.poisson(4, nEvents)
+    column = ak.unflatten(rng.exponential(40, counts.sum()), counts)
+    prefixes = ['Jet_', 'L1EmulJet_', 'L1EmulEtSum_', 'Muon_', 'PuppiMET_']
+
+    for nFields in fieldCounts:
+        fields = [prefixes[i % len(prefixes)] + "var{}".format(i) for i in range(nFields)]
+
+        data = ak.zip({field: column for field in fields}, depth_limit=1)
+        start = time.perf_counter()
+        loop = loopFormat(data)
+        tLoop = time.perf_counter() - start
+
+        data = ak.zip({field: column for field in fields}, depth_limit=1)
+        start = time.perf_counter()
+        renamed = tools.formatBranches(data)
+        tRename = time.perf_counter() - start
+
+        if sorted(ak.fields(loop)) != sorted(ak.fields(renamed)):
+            raise RuntimeError("Renamed fields differ from the loop")
+
+        print("formatBranches {:>9d} events, {:>4d} fields: loop {:8.4f} s, rename {:8.4f} s, speedup {:7.1f}x".format(nEvents, nFields, tLoop, tRename, tLoop/tRename))
+
+
+def makeMuons(nEvents, meanMuons=2, seed=0):
+
+    # random puppi MET and jagged muons named like the formatted nano branches
+    rng = np.random.default_rng(seed)
+    counts = rng.poisson(meanMuons, nEvents)
+    nMuons = counts.sum()
+
+    return ak.zip({'PuppiMET_pt': rng.exponential(40, nEvents).astype(np.float32),
+                   'PuppiMET_phi': rng.uniform(-np.pi, np.pi, nEvents).astype(np.float32),
+                   'Muon_pt': ak.unflatten(rng.exponential(30, nMuons).astype(np.float32), counts),
+                   'Muon_phi': ak.unflatten(rng.uniform(-np.pi, np.pi, nMuons).astype(np.float32), counts),
+                   'Muon_isPFcand': ak.unflatten(rng.random(nMuons) < 0.9, counts)}, depth_limit=1)
+
+
+def recordMET(data):
+
+    # reference: the record based getPUPPIMET used before getMETs
+    puppiMET = data[branches.puppiMETBranches]
+    puppiMET = ak.with_field(puppiMET, puppiMET['PuppiMET_pt']*np.cos(puppiMET['PuppiMET_phi']), "PuppiMET_ptx")
+    puppiMET = ak.with_field(puppiMET, puppiMET['PuppiMET_pt']*np.sin(puppiMET['PuppiMET_phi']), "PuppiMET_pty")
+
+    muons = data[branches.muonBranches]
+    muons = muons[muons["Muon_isPFcand"] == 1]
+    del muons["Muon_isPFcand"]
+    muons = ak.with_field(muons, muons['Muon_pt']*np.cos(muons['Muon_phi']), "Muon_ptx")
+    muons = ak.with_field(muons, muons['Muon_pt']*np.sin(muons['Muon_phi']), "Muon_pty")
+
+    puppiMET_noMu = ak.copy(puppiMET)
+    puppiMET_noMu['PuppiMET_ptx'] = puppiMET['PuppiMET_ptx'] + np.sum(muons['Muon_ptx'], axis=1)
+    puppiMET_noMu['PuppiMET_pty'] = puppiMET['PuppiMET_pty'] + np.sum(muons['Muon_pty'], axis=1)
+    puppiMET_noMu['PuppiMET_pt'] = np.sqrt(puppiMET_noMu['PuppiMET_ptx']**2 + puppiMET_noMu['PuppiMET_pty']**2)
+
+    del puppiMET['PuppiMET_phi'], puppiMET['PuppiMET_ptx'], puppiMET['PuppiMET_pty']
+    del puppiMET_noMu['PuppiMET_phi'], puppiMET_noMu['PuppiMET_ptx'], puppiMET_noMu['PuppiMET_pty']
+
+    return puppiMET, puppiMET_noMu
+
+
+def benchMET(nEvents):
+
+    # PuppiMET and PuppiMETNoMu of a synthetic signal sample: records against the flat kernel
+    data = makeMuons(nEvents, seed=3)
+
+    (_, records), tRecords, _, peakRecords = measure(recordMET, data)
+    mets, tKernel, _, peakKernel = measure(tools.getMETs, data)
+    _, tRecoil, _, _ = measure(tools.getMETs, data, recoil=True)
+
+    if not np.allclose(ak.to_numpy(records['PuppiMET_pt']), mets['PuppiMETNoMu'], rtol=1e-5, atol=1e-3):
+        raise RuntimeError("PuppiMETNoMu of getMETs differs from the records")
+
+    print("METs {:>9d} events: records {:8.3f} s ({:7.1f} MB), getMETs {:8.3f} s ({:7.1f} MB), speedup {:7.1f}x, with recoil {:8.3f} s".format(
+        nEvents, tRecords, peakRecords, tKernel, peakKernel, tRecords/tKernel, tRecoil))
+
+
+def reductionJets(data, collection, variants):
+
+    # reference: one masked awkward reduction per variant, as getPUPPIJET and getL1EmulHT do
+    pt, eta, phi = data[collection + '_pt'], data[collection + '_eta'], data[collection + '_phi']
+    columns = {}
+    for variant in variants:
+        mask = (pt > variant.get('ptMin', -1)) & (abs(eta) < variant.get('etaMax', np.inf))
+        if variant['quantity'] == 'ht':
+            columns[variant['name']] = ak.sum(pt[mask], axis=1)
+        elif variant['quantity'] == 'mht':
+            columns[variant['name']] = np.hypot(ak.sum((pt*np.cos(phi))[mask], axis=1), ak.sum((pt*np.sin(phi))[mask], axis=1))
+        elif variant['quantity'] == 'jet':
+            columns[variant['name']] = ak.pad_none(ak.sort(pt[mask], axis=1, ascending=False), variant['n'], axis=1)[:, variant['n'] - 1]
+    return columns
+
+
+def benchJets(nEvents, variantCounts=(1, 4, 16)):
+
+    # jet sum variants of one collection: a reduction per variant against the single pass of getJetSums
+    data = makeJets(nEvents, 'recoJet', meanJets=6, seed=4)
+    definitions = [{'quantity': quantity, 'ptMin': ptMin, 'etaMax': etaMax, 'n': n}
+                   for ptMin in (30, 40) for etaMax in (2.4, 3.0, 5.0) for quantity, n in (('ht', 1), ('mht', 1), ('jet', 2))]
+
+    for nVariants in variantCounts:
+        variants = [dict(definition, name="variant{}".format(i)) for i, definition in enumerate(definitions[:nVariants])]
+
+        reduced, tReduce, _, _ = measure(reductionJets, data, 'recoJet', variants)
+        table, tPass, _, _ = measure(tools.getJetSums, data, 'recoJet', variants)
+
+        for name, values in reduced.items():
+            if not np.allclose(tools.toNumpy(values), table[name].to_numpy(), equal_nan=True):
+                raise RuntimeError("getJetSums differs from the reductions for " + name)
+
+        print("jet sums {:>9d} events, {:>3d} variants: reductions {:8.3f} s, one pass {:8.3f} s ({:6.3f} s per variant), speedup {:7.1f}x".format(
+            nEvents, nVariants, tReduce, tPass, tPass/nVariants, tReduce/tPass))
+
+
+# pipeline benchmarks, on synthetic nano files
+
+def measure(func, *args, **kwargs):
+
+    # (result, wall s, cpu s, peak MB allocated during the call as seen by tracemalloc,
+    # which numpy and awkward buffers report to)
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    wall, cpu = time.perf_counter(), time.process_time()
+    try:
+        result = func(*args, **kwargs)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        peak = tracemalloc.get_traced_memory()[1]/1e6
+    finally:
+        tracemalloc.stop()
+    return result, wall, cpu, peak
+
+
+def makeSamples(dataDir, nEvents, eventsPerFile=1000000):
+
+    # signal and zero bias files of nEvents events in total, made once and reused
+    nFiles = -(-nEvents//eventsPerFile)
+    samples = {}
+    for kind, seed in (('sig', 1), ('bkg', 2)):
+        directory = os.path.join(dataDir, str(nEvents), kind)
+        if not os.path.exists(os.path.join(directory, "nano_{}.root".format(nFiles - 1))):
+            print("Generating {} {} events in {}".format(nEvents, kind, directory))
+        samples[kind] = synthetic.makeSample(directory, nFiles, min(nEvents, eventsPerFile), kind, seed)
+    return samples
+
+
+def benchFunctions(samples, nEvents, workDir, nWorkers=None, branchType='emu'):
+
+    # the per-chunk tools on the whole signal sample in memory
+    branchList = tools.getBranches(['Jet'], branchType == 'emu')
+    sigFiles = samples['sig']
+    results = {}
+
+    data, *results['getArrays'] = measure(tools.getArrays, sigFiles, branchList, len(sigFiles))
+
+    raw = ak.concatenate(list(uproot.iterate([{fileName: 'Events'} for fileName in sigFiles], filter_name=branchList)))
+    _, *results['formatBranches'] = measure(tools.formatBranches, raw)
+    del raw
+
+    (_, puppiMETNoMu), *results['getPUPPIMET'] = measure(tools.getPUPPIMET, data)
+    _, *results['getMETs'] = measure(tools.getMETs, data, recoil=True)
+    _, *results['getPUPPIJET'] = measure(tools.getPUPPIJET, data)
+    _, *results['getJetSums'] = measure(tools.getJetSums, data, 'recoJet', observables.jetVariants['recoJet'])
+    _, *results['getSum'] = measure(tools.getSum, data, 'methf')
+
+    l1MET = tools.getSumPt(data, 'methf')
+    offline = ak.to_numpy(puppiMETNoMu['PuppiMET_pt'])
+    _, *results['efficiency'] = measure(plotting.efficiency, l1MET, offline, 80, 10, 400)
+
+    return results
+
+
+def benchStudy(samples, nEvents, workDir, nWorkers=None):
+
+    # the whole fixed rate flow (extraction of both samples with a cold cache,
+    # rates, thresholds solved for a second config and efficiencies), no plots.
+    # cpu and peak memory are those of this process, not of the extraction workers
+    rootDir = os.path.commonpath([samples['sig'][0], samples['bkg'][0]]) + "/"
+    definition = {
+        'name': 'Benchmark',
+        'writeDir': os.path.join(workDir, "data/"),
+        'plotDir': os.path.join(workDir, "plots/"),
+        'input': {'format': 'nano', 'rootDir': rootDir, 'fileName': "nano_*.root", 'sigName': 'sig', 'bkgName': 'bkg'},
+        'configs': [{'label': 'Emulated', 'branchType': 'emu', 'sig': 'sig/', 'bkg': 'bkg/'},
+                    {'label': 'Unpacked', 'branchType': 'unp', 'sig': 'sig/', 'bkg': 'bkg/'}],
+        'observables': {'l1': 'L1MET', 'offline': 'PuppiMETNoMu'},
+        'thresholds': [40, 80, 120],
+        'extract': {'nWorkers': nWorkers},
+    }
+    studyFile = os.path.join(workDir, "benchmark.yaml")
+    with open(studyFile, 'w') as f:
+        yaml.safe_dump(definition, f)
+
+    _, *result = measure(study.run, study.loadStudy(studyFile), until='efficiencies')
+    shutil.rmtree(definition['writeDir'])
+
+    return {'fixedRate': result}
+
+
+suites = {'functions': benchFunctions, 'fixedRate': benchStudy}
+
+
+def metadata():
+
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {'time': time.strftime("%Y-%m-%dT%H:%M:%S"), 'commit': commit, 'host': platform.node(), 'python': platform.python_version(),
+            'cpus': os.cpu_count(), 'numpy': np.__version__, 'awkward': ak.__version__, 'uproot': uproot.__version__}
+
+
+def compare(results, reference, tolerance):
+
+    # wall time ratios to an earlier run, flagging slowdowns beyond tolerance
+    previous = {(r['bench'], r['events']): r for r in reference['results']}
+    for result in results:
+        old = previous.get((result['bench'], result['events']))
+        if old is None:
+            continue
+        ratio = result['wall'] / old['wall'] if old['wall'] else float('inf')
+        flag = "  <-- slower" if ratio > 1 + tolerance else ""
+        print("{:>15s} {:>9d} events: {:6.2f}x the wall time of {}{}".format(result['bench'], result['events'], ratio, (reference['meta'].get('commit') or "")[:8], flag))
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmarks for the fixed rate efficiency tools")
+    parser.add_argument("--events", type=float, nargs="+", default=[1e4, 1e5],
+                        help="sample sizes; the 'functions' suite holds the whole signal sample in memory")
+    parser.add_argument("--suite", nargs="+", default=list(suites), choices=list(suites) + ['matching', 'format', 'met', 'jets'],
+                        help="'matching', 'format', 'met' and 'jets' compare the columnar matching, the field renaming, the MET kernel and the jet sums with the code they replaced")
+    # outside the repo by default, so runs leave nothing to commit
+    scratch = os.path.join(tempfile.gettempdir(), "L1T_fixRateEff")
+    parser.add_argument("--dataDir", default=os.path.join(scratch, "synthetic"), help="where the synthetic nano files are kept")
+    parser.add_argument("--eventsPerFile", type=float, default=1e6)
+    parser.add_argument("--nWorkers", type=int, default=None)
+    parser.add_argument("--output", default=os.path.join(scratch, "benchmark.json"))
+    parser.add_argument("--compare", default=None, help="earlier --output file to compare the wall times with")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = []
+    for nEvents in (int(n) for n in args.events):
+
+        if 'matching' in args.suite:
+            benchMatching(nEvents)
+        if 'format' in args.suite:
+            benchFormat(nEvents)
+        if 'met' in args.suite:
+            benchMET(nEvents)
+        if 'jets' in args.suite:
+            benchJets(nEvents)
+
+        suiteNames = [name for name in args.suite if name in suites]
+        if not suiteNames:
+            continue
+        samples = makeSamples(args.dataDir, nEvents, int(args.eventsPerFile))
+
+        for suite in suiteNames:
+            workDir = tempfile.mkdtemp(prefix="benchmark_")
+            try:
+                timings = suites[suite](samples, nEvents, workDir, args.nWorkers)
+            finally:
+                shutil.rmtree(workDir)
+
+            for bench, (wall, cpu, peak) in timings.items():
+                results.append({'bench': bench, 'events': nEvents, 'wall': wall, 'cpu': cpu, 'peakMB': peak, 'eventsPerSecond': nEvents/wall if wall else None})
+                print("{:>15s} {:>9d} events: {:8.3f} s wall, {:8.3f} s cpu, {:9.1f} MB peak, {:10.0f} events/s".format(bench, nEvents, wall, cpu, peak, nEvents/wall if wall else 0))
+
+    report = {'meta': dict(metadata(), maxRssMB=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1e3, argv=sys.argv[1:]), 'results': results}
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print("Results written to " + args.output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f), args.tolerance)
@@ -1,168 +1,18 @@
-import glob
-import pandas as pd
-import numpy as np
-import awkward as ak
+#!/usr/bin/env python
+# coding: utf-8
 
-import utils.tools as tools
-import utils.plotting as plotting
+# Fixed rate L1 HT efficiencies. The configs, inputs, thresholds and the
+# other settings are in studies/jetHt.toml; this runs that study through
+# utils.study, the same as `python runStudy.py studies/jetHt.toml`, and takes
+# the same options, e.g.
+#   python jetHt.py --force efficiencies --report data_py/JET_report.json
 
-from collections import OrderedDict, defaultdict
-import uproot
+import os
 
-import mplhep as cms
-import matplotlib.pyplot as plt
+import runStudy
 
-cms.style.use("CMS")
-plt.rcParams["figure.figsize"] = (7,7)
+studyFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "studies", "jetHt.toml")
 
-nComp = 3
 
-l1Labels = ['Default', 'BaselineZS', 'ConservativeZS']
-branchTypes = ['emu', 'emu', 'emu'] # unp or emu
-
-rootDir = "/eos/cms/store/group/dpg_trigger/comm_trigger/L1Trigger/ddharmen/JECs2025/"
-zmumu="zmumu/RAW_RECO/"
-zerobias="zerobias/RAW/"
-
-finalpath="0003/"
-
-sigPaths  = ["default/Muon0/jetMET24I/250228_195726/", "baseline/Muon0/jetMET24I/250228_195617/", "conservative/Muon0/jetMET24I/250228_195652/"]
-bkgPaths  = ["default/ZeroBias/jetMET24I/250301_183717/", "baseline/ZeroBias/jetMET24I/250301_183552/", "conservative/ZeroBias/jetMET24I/250301_183634/"]
-
-
-
-inputFormat = 'nano'     # nanoAOD
-#inputFormat = 'hdf5'     # pandas dataframes
-
-sigName = "zmu"
-bkgName = "zb"
-
-writeDir = "./data_py/"
-
-# fileName = "/eos/home-d/ddharmen/JEC/CMSSW_14_1_4_patch1/src/JETMET/zerobias_perf_raw_test/default/nano*.root"
-fileName = "nano_399*.root"
-# fileName = "nano_99.root"
-
-sigFiles = [glob.glob(rootDir + zmumu + path + finalpath + fileName) for path in sigPaths]
-bkgFiles = [glob.glob(rootDir + zerobias + path + finalpath + fileName) for path in bkgPaths]
-
-
-if len(l1Labels) != nComp or len(branchTypes) != nComp or len(sigFiles) != nComp or len(bkgFiles) != nComp:
-    raise TypeError("Number of inputs datasets is not consistent")
-
-
-awkSigFiles = [writeDir + "/" + sigName + label + ".parq" for label in l1Labels]
-awkBkgFiles = [writeDir + "/" + bkgName + label + ".parq" for label in l1Labels]
-
-sig_hdf5s = [writeDir + "/" + sigName + label + ".hdf5" for label in l1Labels]
-bkg_hdf5s = [writeDir + "/" + bkgName + label + ".hdf5" for label in l1Labels]
-
-# L1 thresholds (GeV)
-l1JetThresholds = [30, 120, 180]
-l1METThresholds = [50, 90]
-# arrays containing our signal and background data
-# for the different sets of input files
-sigs = []
-bkgs = []
-
-sig_dfs = []
-bkg_dfs = []
-
-print("Signal files:", sigFiles)
-print("Background files:", bkgFiles)
-
-if inputFormat == 'nano':
-    
-    for sigFile, awkSigFile, branchType in  zip(sigFiles, awkSigFiles, branchTypes):
-        sigs.append(tools.getArrays(sigFile, tools.getBranches(['Jet'], branchType=='emu', False), len(sigFile), awkSigFile))
-                       
-    for bkgFile, awkBkgFile, branchType in zip(bkgFiles, awkBkgFiles, branchTypes):
-        bkgs.append(tools.getArrays(bkgFile, tools.getBranches(['Jet'], branchType=='emu', False), len(bkgFile), awkBkgFile))
-
-
-if inputFormat == 'parquet':
-
-    for awkSigFile in awkSigFiles:
-        sigs.append(ak.from_parquet(awkSigFile))
-
-    for awkBkgFile in awkBkgFiles:
-        bkgs.append(ak.from_parquet(awkBkgFile))
-
-if inputFormat in ['nano', 'parquet']:
-
-    for sig, sig_hdf5, l1Label in zip(sigs, sig_hdf5s, l1Labels):
-        # get the puppiMETs
-        puppiMET, puppiMETNoMu = tools.getPUPPIJET(sig)
-        # puppiJET, puppiJETNoMu = tools.getPUPPIJET(sig)
-        # get the l1METs
-        # l1MET_df = pd.DataFrame(ak.to_list(ak.flatten(tools.getSum(sig, 'methf')['EtSum_pt'])), columns=[l1Label])
-        l1MET_df = pd.DataFrame(ak.to_list(tools.getL1EmulHT(sig)), columns=[l1Label])
-        puppiMET_df = pd.DataFrame(ak.to_list(puppiMET['recoJet_ht']), columns=['PuppiMET'])
-        puppiMETNoMu_df = pd.DataFrame(ak.to_list(puppiMETNoMu['recoJet_ht']), columns=['PuppiMETNoMu'])
-        # save to dataframe
-        pd.concat([l1MET_df, puppiMET_df, puppiMETNoMu_df], axis=1).to_hdf(sig_hdf5, l1Label, mode='w')
-        
-    for bkg, bkg_hdf5, l1Label in zip(bkgs, bkg_hdf5s, l1Labels):
-        
-        l1MET_df = pd.DataFrame(ak.to_list(tools.getL1EmulHT(bkg)), columns=[l1Label])
-        l1MET_df.to_hdf(bkg_hdf5, l1Label, mode='w')
-        
-    
-for sig_hdf5, l1Label in zip(sig_hdf5s, l1Labels):
-    sig_dfs.append(pd.read_hdf(sig_hdf5, l1Label))
-    
-for bkg_hdf5, l1Label in zip(bkg_hdf5s, l1Labels):
-    bkg_dfs.append(pd.read_hdf(bkg_hdf5, l1Label))
-
-
-# plot the JET resolution
-for sig_df, l1Label in zip(sig_dfs, l1Labels):
-    plt.hist((sig_df[l1Label] - sig_df['PuppiMETNoMu']), bins = 80, range = [-100,100], label = l1Label + " Diff")
-
-plt.legend()
-
-plt.savefig("JethT_resolution.pdf", format="pdf")
-
-# make fixed rate MET efficiencies
-
-# rate plots must be in bins of GeV
-ptRange = [0,200]
-bins = ptRange[1]
-
-l1METRates = []
-l1JetThresholdsArr = [l1JetThresholds]
-
-# get rate hist for "default" objects
-rateScale = 40000000*(2452/3564)/len(bkg_dfs[0])
-rateHist = plt.hist(bkg_dfs[0], bins=bins, range=ptRange, histtype = 'step', label=l1Labels[0], cumulative=-1, log=True, weights=np.full(len(bkg_dfs[0]), rateScale))
-
-for l1JetThreshold in l1JetThresholds:
-    # get rates for the default thresholds
-    l1METRate = rateHist[0][l1JetThreshold]
-    l1METRates.append(l1METRate)
-
-for i in range(1, nComp):
-    # get thresholds for the fixed rates
-    rateScale = 40000000*(2452/3564)/len(bkg_dfs[i])
-    rateHist = plt.hist(bkg_dfs[i], bins=bins, range=ptRange, histtype = 'step', label=l1Labels[i], cumulative=-1, log=True, weights=np.full(len(bkg_dfs[i]), rateScale))
-    thresholds = []
-    for l1JetThreshold in l1JetThresholds:
-        # get threshold for this rate
-        thresholds.append(plotting.getThreshForRate(rateHist[0], bins, l1METRates[l1JetThresholds.index(l1JetThreshold)]))
-        print(plotting.getThreshForRate(rateHist[0], bins, l1METRates[l1JetThresholds.index(l1JetThreshold)]))
-    l1JetThresholdsArr.append(thresholds)
-
-plt.legend()
-plt.savefig("JethT_threshold.pdf", format="pdf")
-# print(l1JetThresholdsArr)
-
-
-# plot the MET efficiency
-for sig_df, l1Label, l1JetThresholds in zip(sig_dfs, l1Labels, l1JetThresholdsArr):
-    for l1JetThreshold in l1JetThresholds:
-        eff_data, xvals,err = plotting.efficiency(sig_df[l1Label], sig_df['PuppiMETNoMu'], l1JetThreshold, 10, 400)
-        plt.scatter(xvals, eff_data, label=l1Label + " > " + str(l1JetThreshold))
-
-plt.axhline(0.95, linestyle='--', color='black')
-plt.legend(fontsize=10)
-plt.savefig("JethT_eff.pdf", format="pdf")
+if __name__ == '__main__':
+    runStudy.main(studyFile=studyFile)
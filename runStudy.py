@@ -0,0 +1,34 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+import argparse
+
+import utils.study as study
+import utils.profiling as profiling
+
+import mplhep as cms
+import matplotlib.pyplot as plt
+cms.style.use("CMS")
+plt.rcParams["figure.figsize"] = (10,7)
+
+
+def main(argv=None, studyFile=None):
+
+    # studyFile makes the study file argument optional, for the scripts running one study
+    parser = argparse.ArgumentParser(description="Run a fixed rate efficiency study from a study file, skipping unchanged stages")
+    parser.add_argument('studyFile', nargs='?' if studyFile else None, default=studyFile, help="study definition, .yaml or .toml (see studies/)")
+    parser.add_argument('--force', nargs='+', default=[], choices=list(study.stages), help="rerun these stages and the ones after them")
+    parser.add_argument('--until', choices=list(study.stages), help="stop after this stage")
+    parser.add_argument('--report', help="write the run report (time, memory, events and bytes read per stage) to this JSON file")
+    parser.add_argument('--profile', help="run this stage ('extract' or 'extract:<label>/<sample>') under a profiler")
+    parser.add_argument('--profiler', default='cProfile', choices=['cProfile', 'pyinstrument'])
+    args = parser.parse_args(argv)
+
+    definition = study.loadStudy(args.studyFile)
+    report = profiling.RunReport(definition['name'], args.profile, args.profiler).start()
+    study.run(definition, args.force, args.until)
+    report.finish(args.report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,45 @@
+import os
+
+import pandas as pd
+
+import utils.cache as cache
+import utils.synthetic as synthetic
+
+
+calls = []
+
+
+def countEvents(data, keep=True):
+    calls.append(len(data))
+    return pd.DataFrame({'nEvents': [len(data)]}) if keep else None
+
+
+def _extract(fileNames, cacheDir, keep=True):
+    return list(cache.extractFiles(fileNames, ['nL1Jet'], countEvents, (keep,), str(cacheDir), nWorkers=1))
+
+
+def test_hitSkipsExtraction(tmp_path):
+    fileNames = synthetic.makeSample(str(tmp_path / "nano"), 2, 100, 'bkg')
+    del calls[:]
+    first = _extract(fileNames, tmp_path / "cache")
+    extracted = len(calls)
+    assert extracted > 0
+
+    second = _extract(fileNames, tmp_path / "cache")
+    assert len(calls) == extracted
+    assert [df['nEvents'].sum() for df in second] == [df['nEvents'].sum() for df in first]
+
+    # a newer file is a new key, only that one is read again
+    os.utime(fileNames[0], (os.path.getatime(fileNames[0]), os.path.getmtime(fileNames[0]) + 10))
+    _extract(fileNames, tmp_path / "cache")
+    assert len(calls) > extracted
+
+
+def test_emptyFileCached(tmp_path):
+    # files with nothing derived are remembered rather than read again every run
+    fileNames = synthetic.makeSample(str(tmp_path / "nano"), 1, 100, 'bkg')
+    del calls[:]
+    assert _extract(fileNames, tmp_path / "cache", keep=False) == []
+    extracted = len(calls)
+    assert _extract(fileNames, tmp_path / "cache", keep=False) == []
+    assert len(calls) == extracted
@@ -0,0 +1,21 @@
+import numpy as np
+
+import utils.hists as hists
+import utils.rates as rateEngine
+
+
+def test_sortedRatesMerge():
+    # counts per hardware step, merged across jobs, give the thresholds of the sorted values
+    values = np.random.default_rng(2).exponential(25, 100000)
+    values[::40] = np.nan
+    first, second = hists.SortedRates(), hists.SortedRates()
+    first.fill(values[:30000])
+    second.fill(values[30000:])
+    merged = sum([first, second])
+
+    targets = [5e6, 1e6, 3e5, 10.]
+    expected = rateEngine.exactThreshForRate(np.sort(values[~np.isnan(values)]), len(values), targets)
+    for result, reference in zip(merged.solve(targets), expected):
+        assert np.allclose(result, reference)
+    assert merged.nEvents == len(values)
+    assert len(merged.counts) <= np.nanmax(values)/0.5 + 1
@@ -0,0 +1,34 @@
+import utils.lazy as lazy
+
+
+class Tracked:
+
+    # stand-in for LazyEvents: every read counts its branch in the open tracking blocks
+    def __init__(self):
+        self._tracking = []
+
+    def __getitem__(self, name):
+        lazy.touch(self, [name])
+        return name
+
+
+def test_nestedTrack():
+    data = Tracked()
+    with lazy.track(data) as outer:
+        data['a']
+        with lazy.track(data) as inner:
+            data['a']
+        # outer and inner are equal sets here, the inner block must still close itself
+        with lazy.track(data) as other:
+            data['b']
+        data['c']
+    assert outer == {'a', 'b', 'c'}
+    assert inner == {'a'}
+    assert other == {'b'}
+    assert data._tracking == []
+
+
+def test_trackPlainArrays():
+    with lazy.track([1, 2]) as used:
+        pass
+    assert used == set()
@@ -0,0 +1,33 @@
+import os
+
+import utils.lazy as lazy
+import utils.study as study
+import utils.planning as planning
+import utils.synthetic as synthetic
+import utils.observables as observables
+
+
+studyFile = os.path.join(os.path.dirname(__file__), "..", "studies", "met.yaml")
+
+
+def test_metStudyPlan():
+    # a MET-only study reads just the emulated sums for the background, no jets
+    definition = study.loadStudy(studyFile)
+    config = [config for config in definition['configs'] if config['branchType'] == 'emu'][0]
+    names, branchList = study._plan(definition, config, [], 'bkg')
+    assert names == ['L1MET']
+    assert sorted(branchList) == ['L1EmulEtSum_bx', 'L1EmulEtSum_etSumType', 'L1EmulEtSum_pt']
+
+    names, branchList = study._plan(definition, config, [], 'sig')
+    assert not any('Jet' in branch for branch in branchList)
+
+
+def test_jetVariantUsage(tmp_path):
+    # each jet variant counts only the branches its own cuts use
+    fileName = synthetic.makeSample(str(tmp_path), 1, 200, 'bkg')[0]
+    names = ['L1HT', 'L1Jet1', 'L1MHT30er2p4']
+    branchList = planning.plan([fileName], 'bkg', names, useEmu=True)[1]
+    for data in lazy.iterEvents(fileName, branchList):
+        usage = observables.makeTable(data, names, False).attrs['branches']
+        assert usage['L1HT'] == usage['L1Jet1'] == ['L1EmulJet_pt']
+        assert usage['L1MHT30er2p4'] == ['L1EmulJet_eta', 'L1EmulJet_phi', 'L1EmulJet_pt']
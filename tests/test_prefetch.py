@@ -0,0 +1,20 @@
+import utils.tools as tools
+import utils.prefetch as prefetch
+import utils.synthetic as synthetic
+
+
+def test_noRequestsWhileDecoding(tmp_path, monkeypatch):
+    # every byte the decoding needs (baskets and their key headers) comes from the vector read
+    fileNames = synthetic.makeSample(str(tmp_path), 2, 200, 'bkg')
+    branches = ['nL1Jet', 'L1Jet_pt', 'L1Jet_eta', 'L1EtSum_pt', 'L1EtSum_etSumType']
+    requests = []
+    request = prefetch.PrefetchSource._request
+    monkeypatch.setattr(prefetch.PrefetchSource, '_request', lambda self: requests.append(self) or request(self))
+
+    nEvents = 0
+    for fileName, tree in prefetch.iterTrees(fileNames, branches, latency=1e-3):
+        source = tree.file.source
+        nBefore = requests.count(source)
+        nEvents += sum(len(chunk) for chunk in tools.iterTree(tree, branches))
+        assert requests.count(source) == nBefore
+    assert nEvents == 400
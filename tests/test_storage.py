@@ -0,0 +1,18 @@
+import os
+
+import utils.storage as storage
+
+
+def test_sameNameInputs(tmp_path):
+    # inputs of the same name in different directories keep their own parts
+    first, second = "/data/0003/nano_1.root", "/data/0004/nano_1.root"
+    assert storage.partPath(str(tmp_path), 'Default', 'zb', first, 0) != storage.partPath(str(tmp_path), 'Default', 'zb', second, 0)
+
+    path = storage.partPath(str(tmp_path), 'Default', 'zb', first, 0)
+    os.makedirs(os.path.dirname(path))
+    open(path, 'w').close()
+    assert storage.hasFile(str(tmp_path), 'Default', 'zb', first)
+    assert not storage.hasFile(str(tmp_path), 'Default', 'zb', second)
+
+    storage.clearSample(str(tmp_path), 'Default', 'zb', second)
+    assert storage.hasFile(str(tmp_path), 'Default', 'zb', first)
@@ -0,0 +1,44 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import utils.tools as tools
+import utils.summary as summary
+
+
+def test_columnStoreRewrite(tmp_path):
+    path = str(tmp_path / "zbDefault.cols")
+    for n in (5, 3):
+        with summary.openStore(path, 'w') as store:
+            store.append('Default', pd.DataFrame({'L1MET': np.arange(n, dtype=np.uint16)}))
+    columns = summary.ColumnStore(path).columns('Default')
+    assert list(columns['L1MET']) == [0, 1, 2]
+
+
+def test_columnStoreRefusesOtherDirectories(tmp_path):
+    # a directory that isn't a store is never wiped
+    other = tmp_path / "analysis"
+    (other / "notes").mkdir(parents=True)
+    (other / "notes" / "todo.txt").write_text("keep")
+    with pytest.raises(ValueError):
+        summary.ColumnStore(str(other), 'w')
+    assert os.path.exists(other / "notes" / "todo.txt")
+
+
+@pytest.mark.parametrize("fileName", ["zbDefault.cols", "zbDefault.hdf5"])
+def test_offStepFallback(tmp_path, fileName):
+    # a chunk off the hardware steps turns the whole column into float32 rather than failing
+    summary.encodings['TestHw'] = 'hw'
+    chunks = [np.array([1.0, 2.5, np.nan]), np.array([3.25, 4.0]), np.array([5.5])]
+    path = str(tmp_path / fileName)
+    try:
+        with summary.openStore(path, 'w') as store:
+            for values in chunks:
+                summary.append(store, 'Default', summary.encode(pd.DataFrame({'TestHw': values})))
+        stored = pd.concat(tools.iterHdf(path, 'Default'))['TestHw'].to_numpy()
+    finally:
+        del summary.encodings['TestHw']
+    assert stored.dtype == np.float32
+    np.testing.assert_array_equal(stored, np.concatenate(chunks))
@@ -0,0 +1,30 @@
+import numpy as np
+from scipy.special import erf
+
+import utils.turnons as turnons
+
+
+def _curve(x, n, plateau, mu, width, rng):
+    return rng.binomial(n, plateau/2*(1 + erf((x - mu)/(np.sqrt(2)*width))))
+
+
+def test_pointErrorsPerCurve():
+    # a small-scale curve fitted alone or next to a large-scale one gets the same 50% point error
+    x = np.arange(5, 400, 10.)
+    n = np.full(len(x), 2000)
+    rng = np.random.default_rng(3)
+    nums = np.array([_curve(x, n, 0.95, 30, 5, rng), _curve(x, n, 0.9, 300, 40, rng)])
+    p, covariance, _, _, _ = turnons.fit(x, nums, n)
+    alone = turnons.points(p[:1], covariance[:1], 0.5)[1]
+    together = turnons.points(p, covariance, 0.5)[1][:1]
+    assert np.allclose(alone, together, rtol=1e-4)
+
+
+def test_plateauAtBound():
+    # a fully efficient plateau ends on the bound: held fixed, with no plateau error
+    x = np.arange(5, 400, 10.)
+    n = np.full(len(x), 2000)
+    nums = np.where(x > 100, n, _curve(x, n, 1., 80, 15, np.random.default_rng(4)))
+    p, covariance, _, _, _ = turnons.fit(x, nums, n)
+    assert turnons.atBound(p).all()
+    assert covariance[0, 0, 0] == 0 and np.all(np.isfinite(covariance[0, 1:, 1:])) and covariance[0, 1, 1] > 0
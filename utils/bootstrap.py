@@ -0,0 +1,243 @@
+import numpy as np
+import pandas as pd
+
+import utils.hists as hists
+import utils.rates as rateEngine
+import utils.tools as tools
+
+
+# Poisson bootstrap of the fixed rate flow: every event gets a Poisson(1) weight
+# per replica, drawn per block of events from a generator seeded by (seed,
+# stream, block), so an event keeps its weights however the sample is chunked
+# and in every config filled in the same event order (the same zero bias events
+# emulated differently stay correlated). Row 0 of the replica axis is the
+# nominal sample (all weights 1), rows 1..replicas the bootstrap replicas.
+blockSize = 100000
+
+
+# Poisson(1) CDF up to where float32 uniforms can no longer reach the tail
+_poissonCdf = np.cumsum(np.exp(-1.)/np.cumprod(np.r_[1., np.arange(1, 12)])).astype(np.float32)
+
+
+def poissonWeights(replicas, block, seed=0, stream=0):
+
+    # (replicas + 1 x blockSize) weights of one block of events, by inverting the
+    # CDF with one float32 uniform each (~3x faster than Generator.poisson)
+    uniforms = np.random.default_rng([seed, stream, block]).random((replicas + 1, blockSize), dtype=np.float32)
+    weights = np.zeros(uniforms.shape, dtype=np.uint8)
+    for step in _poissonCdf:
+        weights += uniforms >= step
+    weights[0] = 1
+    return weights
+
+
+def _blocks(start, nValues, replicas, seed, stream):
+
+    # (slice of the chunk, weights) per block the chunk of events start..start + nValues overlaps,
+    # so at most (replicas + 1) x blockSize weights are held at once
+    for block in range(start//blockSize, (start + nValues - 1)//blockSize + 1 if nValues else start//blockSize):
+        lo, hi = max(start, block*blockSize), min(start + nValues, (block + 1)*blockSize)
+        yield slice(lo - start, hi - start), poissonWeights(replicas, block, seed, stream)[:, lo - block*blockSize:hi - block*blockSize]
+
+
+def _weightedCounts(weights, index, nCells):
+
+    # (replicas + 1 x nCells) sums of the event weights per cell, from the events sorted by cell
+    order = np.argsort(index, kind='stable')
+    cells, starts = np.unique(index[order], return_index=True)
+    counts = np.zeros((len(weights), nCells), dtype=np.int64)
+    if len(cells):
+        counts[:, cells] = np.add.reduceat(weights[:, order], starts, axis=1, dtype=np.int64)
+    return counts
+
+
+class BootstrapRates(hists.Accumulator):
+
+    """
+    Weighted background counts on the L1 hardware steps for every replica
+    ((replicas + 1) x bins, bin k holding [k*granularity, (k+1)*granularity)),
+    so the rates and fixed rate thresholds of rates.exactThreshForRate come
+    out per replica. As in SortedRates the bins grow with the largest value
+    seen, so no value is clipped. Events are numbered in fill order, or from
+    start when given (e.g. for a job filling from a later file).
+    """
+
+    _binning = ('replicas', 'granularity', 'seed', 'stream')
+    _counts = ('counts', 'weights', 'nEvents')
+
+    def __init__(self, replicas=200, granularity=0.5, seed=0, stream=0):
+        self.replicas = replicas
+        self.granularity = granularity
+        self.seed = seed
+        self.stream = stream
+        self.counts = np.zeros((replicas + 1, 0), dtype=np.int64)
+        self.weights = np.zeros(replicas + 1, dtype=np.int64)
+        self.nEvents = 0
+
+    @property
+    def nBins(self):
+        return self.counts.shape[1]
+
+    def _add(self, counts):
+        if counts.shape[1] > self.nBins:
+            self.counts = np.concatenate([self.counts, np.zeros((self.replicas + 1, counts.shape[1] - self.nBins), dtype=np.int64)], axis=1)
+        self.counts[:, :counts.shape[1]] += counts
+
+    def fill(self, values, start=None):
+        values = hists._values(values)
+        start = self.nEvents if start is None else start
+        for part, weights in _blocks(start, len(values), self.replicas, self.seed, self.stream):
+            chunk = values[part]
+            valid = ~np.isnan(chunk)
+            steps = np.floor(np.maximum(chunk[valid], 0)/self.granularity).astype(np.int64)
+            self._add(_weightedCounts(weights[:, valid], steps, steps.max(initial=-1) + 1))
+            self.weights += weights.sum(axis=1, dtype=np.int64)
+        self.nEvents += len(values)
+
+    def __iadd__(self, other):
+        self._check(other)
+        self._add(other.counts)
+        self.weights += other.weights
+        self.nEvents += other.nEvents
+        return self
+
+    def _survival(self):
+        # (replicas + 1 x bins + 1) weighted events at or above each grid threshold
+        survival = np.zeros((self.replicas + 1, self.nBins + 1), dtype=np.int64)
+        survival[:, :-1] = np.cumsum(self.counts[:, ::-1], axis=1)[:, ::-1]
+        return survival
+
+    def ratesAt(self, thresholds):
+        # (replicas + 1 x thresholds) rates at or above each threshold (rounded up to the grid)
+        steps = np.clip(np.ceil(np.asarray(thresholds, dtype=np.float64)/self.granularity - 1e-9).astype(np.int64), 0, self.nBins)
+        return self._survival()[:, steps] * (rateEngine.bunchRate/self.weights)[:, None]
+
+    def solve(self, targetRates):
+
+        # lowest grid thresholds whose rate doesn't exceed the target rates of each
+        # replica ((replicas + 1) x targets, or targets for all), and the rates they give
+        survival = self._survival()
+        scale = rateEngine.bunchRate/self.weights
+        targets = np.broadcast_to(np.asarray(targetRates, dtype=np.float64), (self.replicas + 1, np.shape(targetRates)[-1]))
+        maxCounts = np.floor(targets/scale[:, None]*(1 + 1e-12))
+        steps = (survival[:, :, None] > maxCounts[:, None, :]).sum(axis=1)
+        return steps*self.granularity, np.take_along_axis(survival, steps, axis=1)*scale[:, None]
+
+
+class BootstrapTurnOns(hists.Accumulator):
+
+    """
+    Weighted signal counts in (offline bin x L1 step) for every replica, the
+    L1 steps (k-1)*granularity < L1 <= k*granularity up to l1Max (missing
+    values in step 0, everything above in the last), so the efficiency of any
+    grid threshold below l1Max (L1 > threshold) comes out per replica.
+    """
+
+    _binning = ('replicas', 'granularity', 'nSteps', 'binwidth', 'xmax', 'edges', 'seed', 'stream')
+    _counts = ('counts', 'nEvents')
+
+    def __init__(self, replicas=200, granularity=0.5, l1Max=400., binwidth=10, xmax=400, seed=0, stream=1):
+        self.replicas = replicas
+        self.granularity = granularity
+        self.nSteps = int(np.ceil(l1Max/granularity)) + 2
+        self.binwidth = binwidth
+        self.xmax = xmax
+        self.edges = np.linspace(0, xmax, int(xmax/binwidth) + 1)
+        self.seed = seed
+        self.stream = stream
+        self.counts = np.zeros((replicas + 1, len(self.edges) - 1, self.nSteps), dtype=np.int64)
+        self.nEvents = 0
+
+    def fill(self, online, offline, start=None):
+        online, offline = hists._values(online), hists._values(offline)
+        start = self.nEvents if start is None else start
+        nOffline = len(self.edges) - 1
+        for part, weights in _blocks(start, len(online), self.replicas, self.seed, self.stream):
+            offBin = np.searchsorted(self.edges, offline[part], side='right') - 1
+            # the last offline edge belongs to the last bin, as in np.histogram
+            offBin[offline[part] == self.edges[-1]] = nOffline - 1
+            inRange = (offBin >= 0) & (offBin < nOffline)
+            step = np.ceil(np.nan_to_num(online[part], nan=0.)/self.granularity)
+            step = np.clip(step, 0, self.nSteps - 1).astype(np.int64)
+            index = offBin[inRange]*self.nSteps + step[inRange]
+            self.counts += _weightedCounts(weights[:, inRange], index, nOffline*self.nSteps).reshape(self.counts.shape)
+        self.nEvents += len(online)
+
+    def efficiencies(self, thresholds):
+
+        # ((replicas + 1) x thresholds x offline bins) efficiencies for thresholds per
+        # replica ((replicas + 1) x thresholds, or thresholds for all)
+        thresholds = np.broadcast_to(np.asarray(thresholds, dtype=np.float64), (self.replicas + 1, np.shape(thresholds)[-1]))
+        if np.nanmax(thresholds, initial=0) >= (self.nSteps - 2)*self.granularity:
+            raise ValueError("Thresholds at or above the L1 range of the BootstrapTurnOns ({:g})".format((self.nSteps - 2)*self.granularity))
+        passing = np.cumsum(self.counts[:, :, ::-1], axis=2)[:, :, ::-1]
+        first = np.floor(np.nan_to_num(thresholds)/self.granularity + 1e-9).astype(np.int64) + 1
+        nums = np.take_along_axis(passing, np.broadcast_to(first[:, None, :], passing.shape[:2] + first.shape[1:]), axis=2)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            effs = nums/passing[:, :, :1]
+        effs[np.isnan(thresholds)[:, None, :].repeat(effs.shape[1], axis=1)] = np.nan
+        return effs.transpose(0, 2, 1)
+
+
+def bands(values, cl=0.68):
+    # nominal (row 0) and the central cl interval of the replicas (rows 1..)
+    alpha = 100*(1 - cl)/2
+    return values[0], np.nanpercentile(values[1:], alpha, axis=0, method='nearest'), np.nanpercentile(values[1:], 100 - alpha, axis=0, method='nearest')
+
+
+def fixedRateBands(rateBoots, turnOnBoots, labels, thresholds, cl=0.68):
+
+    """
+    The fixed rate flow for every replica at once: the rates of thresholds on
+    the first (default) config, the thresholds giving them on every config and
+    the efficiencies at those. Returns a table of the nominal values and cl
+    bands of the thresholds and rates per (label, threshold index), and per
+    label the nominal, low and high ((thresholds x offline bins)) efficiencies.
+    """
+
+    targets = rateBoots[0].ratesAt(thresholds)
+    rows, effBands = [], {}
+    for i, (rateBoot, turnOnBoot, label) in enumerate(zip(rateBoots, turnOnBoots, labels)):
+        if i == 0:
+            replicaThresholds = np.broadcast_to(np.asarray(thresholds, dtype=np.float64), targets.shape)
+            replicaRates = targets
+        else:
+            replicaThresholds, replicaRates = rateBoot.solve(targets)
+        threshold, thresholdLo, thresholdHi = bands(replicaThresholds, cl)
+        rate, rateLo, rateHi = bands(replicaRates, cl)
+        for j in range(len(thresholds)):
+            rows.append({'label': label, 'seed': thresholds[j], 'threshold': threshold[j], 'thresholdLo': thresholdLo[j], 'thresholdHi': thresholdHi[j],
+                         'rate': rate[j], 'rateLo': rateLo[j], 'rateHi': rateHi[j]})
+        effBands[label] = bands(turnOnBoot.efficiencies(replicaThresholds), cl)
+
+    return pd.DataFrame(rows), effBands
+
+
+def fixedRateBootstrap(bkgHdf5s, sigHdf5s, labels, l1Obs, offlineObs, thresholds, replicas=200, granularity=0.5,
+                       binwidth=10, xmax=400, l1Max=None, chunkSize=1000000, seed=0, cl=0.68):
+
+    """
+    Bootstrap bands of the fixed rate thresholds, rates and efficiencies of a
+    study from its hdf5 (or column store) intermediates, streamed chunk by chunk
+    with at most (replicas + 1) x blockSize weights in memory, e.g.
+
+        table, effBands = bootstrap.fixedRateBootstrap(bkg_hdf5s, sig_hdf5s, l1Labels, 'L1MET', 'PuppiMETNoMu', l1METThresholds)
+
+    The background and signal samples get independent replicas, every config
+    the same ones. l1Max bounds the L1 range of the efficiencies (4x the
+    largest threshold by default).
+    """
+
+    l1Max = l1Max or 4*max(thresholds)
+    rateBoots, turnOnBoots = [], []
+    for bkgHdf5, sigHdf5, label in zip(bkgHdf5s, sigHdf5s, labels):
+        rateBoot = BootstrapRates(replicas, granularity, seed=seed, stream=0)
+        for df in tools.iterHdf(bkgHdf5, label, chunkSize):
+            rateBoot.fill(df[l1Obs])
+        turnOnBoot = BootstrapTurnOns(replicas, granularity, l1Max, binwidth, xmax, seed=seed, stream=1)
+        for df in tools.iterHdf(sigHdf5, label, chunkSize):
+            turnOnBoot.fill(df[l1Obs], df[offlineObs])
+        rateBoots.append(rateBoot)
+        turnOnBoots.append(turnOnBoot)
+
+    return fixedRateBands(rateBoots, turnOnBoots, labels, thresholds, cl)
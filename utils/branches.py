@@ -3,7 +3,15 @@ objectBranches = ['pt', 'eta', 'phi', 'bx']
 puppiMETBranches = ['PuppiMET_pt', 'PuppiMET_phi']
 muonBranches = ['Muon_' + var for var in ['pt', 'phi', 'isPFcand']]
 puppiJetBranches = ['Jet_' + var for var in ['pt', 'eta','phi']]
+# L1 object collections, named <l1Type><collection>_<var> in the nano files
+l1Objects = ['Jet', 'EG', 'Tau', 'Mu']
 # L1EmulJetBranches = ['L1EmulJet_' + var for var in ['pt', 'eta','phi']]
 
 # github.com/cms-sw/cmssw/blob/master/DataFormats/L1Trigger/interface/EtSum.h
-sums = {'methf': 8}
\ No newline at end of file
+sums = {'ett': 0, 'htt': 1, 'met': 2, 'mht': 3, 'etx': 4, 'ety': 5, 'htx': 6, 'hty': 7,
+        'methf': 8, 'etxhf': 9, 'etyhf': 10, 'minbiashfp0': 11, 'minbiashfm0': 12, 'minbiashfp1': 13, 'minbiashfm1': 14,
+        'etthf': 15, 'ettem': 16, 'htthf': 17, 'htxhf': 18, 'htyhf': 19, 'mhthf': 20, 'towercount': 21,
+        'centrality': 22, 'asymet': 23, 'asymht': 24, 'asymethf': 25, 'asymhthf': 26}
+
+# regular (event x etSumType) table of the bx = 0 sums, see tools.indexSums
+sumTableBranch = 'EtSum_bx0'
@@ -0,0 +1,158 @@
+import os
+import json
+import glob
+import inspect
+import hashlib
+
+import fsspec
+import pandas as pd
+
+import utils.executor as executor
+import utils.storage as storage
+import utils.summary as summary
+
+
+def _fileStat(fileName):
+
+    # size and modification time, locally or through fsspec for remote urls
+    try:
+        stat = os.stat(fileName)
+        return stat.st_size, stat.st_mtime
+    except OSError:
+        fs, path = fsspec.core.url_to_fs(fileName)
+        info = fs.info(path)
+        return info.get('size'), str(info.get('mtime', info.get('modify_time')))
+
+
+def _modules(module, seen):
+
+    # the module and, recursively, the modules of the same package it imports
+    seen[module.__name__] = module
+    for value in vars(module).values():
+        if inspect.ismodule(value) and value.__name__.startswith(str(module.__package__) + '.') and value.__name__ not in seen:
+            _modules(value, seen)
+    return seen
+
+
+def _sourceHash(derive):
+
+    # source of the defining module and its helpers (getSum, ...) so edits to any of them invalidate
+    sha = hashlib.sha1()
+    for name, module in sorted(_modules(inspect.getmodule(derive), {}).items()):
+        try:
+            sha.update(inspect.getsource(module).encode())
+        except (OSError, TypeError):
+            sha.update(name.encode())
+    return sha.hexdigest()
+
+
+def cacheKey(fileName, branches, derive, deriveArgs=()):
+
+    """
+    Content address of one file's extracted quantities: the file path, size and
+    mtime, the branch list and the derivation (name, arguments and source).
+    """
+
+    size, mtime = _fileStat(fileName)
+    key = [os.path.abspath(fileName) if '://' not in fileName else fileName, size, mtime,
+           sorted(branches), derive.__module__ + '.' + derive.__qualname__, _sourceHash(derive), repr(deriveArgs)]
+
+    return hashlib.sha1(json.dumps(key, default=str).encode()).hexdigest()
+
+
+def _path(cacheDir, key):
+
+    return os.path.join(cacheDir, key + ".parquet")
+
+
+def _emptyPath(cacheDir, key):
+
+    # marker of a file with no events, so it isn't re-extracted on every run
+    return os.path.join(cacheDir, key + ".empty")
+
+
+def _cached(cacheDir, key, fileName, archive):
+
+    # an empty file has nothing in the parquet store either
+    if os.path.exists(_emptyPath(cacheDir, key)):
+        return True
+    return os.path.exists(_path(cacheDir, key)) and not (archive and not storage.hasFile(*archive, fileName))
+
+
+def load(cacheDir, key):
+
+    # None for a missing entry or a file with no events
+    if os.path.exists(_emptyPath(cacheDir, key)):
+        os.utime(_emptyPath(cacheDir, key))
+        return None
+
+    path = _path(cacheDir, key)
+    if not os.path.exists(path):
+        return None
+
+    # touch on a hit so eviction is least recently used
+    os.utime(path)
+    return summary.decode(pd.read_parquet(path))
+
+
+def store(cacheDir, key, df):
+
+    os.makedirs(cacheDir, exist_ok=True)
+    if df is None:
+        open(_emptyPath(cacheDir, key), 'w').close()
+        return
+
+    path = _path(cacheDir, key)
+    # compact columns (utils.summary), zstd compressed
+    summary.encode(df).to_parquet(path + ".tmp", compression='zstd')
+    os.replace(path + ".tmp", path)
+
+
+def evict(cacheDir, maxBytes):
+
+    # drop least recently used entries until the cache fits in maxBytes
+    entries = [(os.path.getmtime(path), os.path.getsize(path), path) for path in glob.glob(os.path.join(cacheDir, "*.parquet")) + glob.glob(os.path.join(cacheDir, "*.empty"))]
+    total = sum(size for _, size, _ in entries)
+
+    for _, size, path in sorted(entries):
+        if total <= maxBytes:
+            break
+        os.remove(path)
+        total -= size
+
+
+def extractFiles(inputFiles, branches, derive, deriveArgs=(), cacheDir="./cache/", maxBytes=None, nWorkers=None, step_size="100 MB", archive=None, lazyRead=False, prefetch=None):
+
+    """
+    Cached executor.extractFiles: files whose key is already in cacheDir are
+    loaded, only the new or changed ones are read and derived (in parallel).
+    Yields one dataframe per file, in file order. With archive=(baseDir, label, sample)
+    the formatted arrays are also kept in the parquet store, and files missing
+    from it are re-extracted even if their quantities are cached. lazyRead
+    reads only the branches the derivation uses (see executor.extractFile),
+    the cached quantities are the same either way, as with prefetch (read-ahead
+    of remote files, see executor.mapExtract).
+    """
+
+    keys = {fileName: cacheKey(fileName, branches, derive, deriveArgs) for fileName in inputFiles}
+    misses = [fileName for fileName in inputFiles if not _cached(cacheDir, keys[fileName], fileName, archive)]
+
+    print("Cache: {} of {} files cached, extracting {}".format(len(inputFiles) - len(misses), len(inputFiles), len(misses)))
+
+    missed = set(misses)
+    extracted = executor.mapExtract(misses, branches, derive, deriveArgs, nWorkers, step_size, archive, lazyRead, prefetch)
+    nextFile, nextDf = next(extracted, (None, None))
+
+    for fileName in inputFiles:
+        if fileName not in missed:
+            df = load(cacheDir, keys[fileName])
+            if df is not None:
+                yield df
+        elif fileName == nextFile:
+            store(cacheDir, keys[fileName], nextDf)
+            if nextDf is not None:
+                yield nextDf
+            nextFile, nextDf = next(extracted, (None, None))
+
+    if maxBytes is not None:
+        evict(cacheDir, maxBytes)
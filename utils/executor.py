@@ -0,0 +1,180 @@
+import os
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import utils.tools as tools
+import utils.storage as storage
+import utils.lazy as lazy
+import utils.prefetch as prefetching
+import utils.profiling as profiling
+
+
+def _context():
+
+    # fork where available: the scripts run at module level, so spawned
+    # workers would re-execute the whole study on import
+    if 'fork' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('fork')
+    return None
+
+
+def _call(func, fileName, args):
+
+    # run in the worker, returning the error rather than raising so one bad file
+    # doesn't take down the pool
+    try:
+        return func(fileName, *args), None
+    except Exception:
+        return None, traceback.format_exc()
+
+
+def _results(func, inputFiles, args, nWorkers):
+
+    if nWorkers == 1:
+        for fileName in inputFiles:
+            yield fileName, _call(func, fileName, args)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(nWorkers, max(len(inputFiles), 1)), mp_context=_context()) as pool:
+        futures = [(fileName, pool.submit(_call, func, fileName, args)) for fileName in inputFiles]
+        for fileName, future in futures:
+            yield fileName, future.result()
+
+
+def mapFiles(func, inputFiles, args=(), nWorkers=None):
+
+    """
+    Run func(fileName, *args) for every file on a process pool. Results are
+    yielded as (fileName, result) in the order of inputFiles, whatever order
+    the workers finish in. Files that fail are reported and skipped.
+    """
+
+    for fileName, (result, error) in _results(func, inputFiles, args, nWorkers or os.cpu_count()):
+        if error:
+            print("Failed to process " + fileName + "\n" + error)
+            continue
+        yield fileName, result
+
+
+def _derive(chunks, fileName, derive, deriveArgs, archive):
+
+    # reduce every formatted chunk of one file to a compact dataframe
+    if archive:
+        storage.clearSample(*archive, fileName)
+
+    dfs = []
+    for chunk, data in enumerate(chunks):
+        if archive:
+            storage.writeChunk(data, storage.partPath(*archive, fileName, chunk))
+        df = derive(data, *deriveArgs)
+        if df is not None:
+            dfs.append(df)
+
+    # None when no events were read or nothing passed
+    if not dfs:
+        return None
+    df = pd.concat(dfs, ignore_index=True)
+    df.attrs = dfs[0].attrs
+    return df
+
+
+def _attach(df, record):
+
+    # counters of the read and cpu/memory of the worker (profiling.collect), sent
+    # back with the dataframe (attrs['profile']) for the profiling stages of the parent
+    if df is not None:
+        df.attrs['profile'] = record
+    return df
+
+
+def _merged(df):
+
+    # the worker counters go to the stages open in this process, not to the cache
+    if df is not None:
+        profiling.merge(df.attrs.pop('profile', None))
+    return df
+
+
+def _checkArchive(archive, lazyRead):
+    if archive and lazyRead:
+        raise ValueError("The parquet store needs every branch, it can't be filled with lazyRead")
+
+
+def extractFile(fileName, branches, derive, deriveArgs=(), step_size="100 MB", archive=None, lazyRead=False):
+
+    # read one file in chunks and reduce every chunk to a compact dataframe,
+    # optionally keeping the formatted chunks in the parquet store archive=(baseDir, label, sample).
+    # With lazyRead only the branches the derivation uses are read (utils.lazy),
+    # which can't be combined with keeping the whole formatted chunks
+    _checkArchive(archive, lazyRead)
+    with profiling.collect() as record:
+        chunks = lazy.iterEvents(fileName, branches, step_size) if lazyRead else tools.iterArrays([fileName], branches, 1, step_size)
+        df = _derive(chunks, fileName, derive, deriveArgs, archive)
+
+    return _attach(df, record)
+
+
+def extractGroup(fileNames, branches, derive, deriveArgs=(), step_size="100 MB", archive=None, lazyRead=False, prefetch=None):
+
+    # extractFile for a run of files read in order with read-ahead (utils.prefetch),
+    # returning (fileName, dataframe) for the files that could be read
+    _checkArchive(archive, lazyRead)
+
+    results = []
+    for fileName, tree in prefetching.iterTrees(fileNames, branches, **(prefetch or {})):
+        chunks = lazy.iterTreeEvents(tree, branches, step_size) if lazyRead else tools.iterTree(tree, branches, step_size)
+        try:
+            with profiling.collect() as record:
+                df = _derive(chunks, fileName, derive, deriveArgs, archive)
+            results.append((fileName, _attach(df, record)))
+        except Exception:
+            print("Failed to process " + fileName + "\n" + traceback.format_exc())
+    return results
+
+
+def _groups(inputFiles, nGroups):
+
+    # contiguous runs of files, one per worker, so each worker reads ahead in file order
+    size = max(-(-len(inputFiles) // max(nGroups, 1)), 1)
+    return [inputFiles[i:i + size] for i in range(0, len(inputFiles), size)]
+
+
+def mapExtract(inputFiles, branches, derive, deriveArgs=(), nWorkers=None, step_size="100 MB", archive=None, lazyRead=False, prefetch=None):
+
+    """
+    (fileName, dataframe) of extractFile for every file that could be read, in
+    file order, one file per worker. With prefetch (options of
+    prefetch.iterTrees, e.g. {'ahead': 2, 'maxBytes': 2e9}) each worker takes
+    a contiguous run of files and reads ahead through it instead.
+    """
+
+    if prefetch is None:
+        for fileName, df in mapFiles(extractFile, inputFiles, (branches, derive, deriveArgs, step_size, archive, lazyRead), nWorkers):
+            yield fileName, _merged(df)
+        return
+
+    nWorkers = nWorkers or os.cpu_count()
+    for group, (results, error) in _results(extractGroup, _groups(list(inputFiles), nWorkers), (branches, derive, deriveArgs, step_size, archive, lazyRead, prefetch), nWorkers):
+        if error:
+            print("Failed to process " + ", ".join(group) + "\n" + error)
+            continue
+        for fileName, df in results:
+            yield fileName, _merged(df)
+
+
+def extractFiles(inputFiles, branches, derive, deriveArgs=(), nWorkers=None, step_size="100 MB", archive=None, lazyRead=False, prefetch=None):
+
+    """
+    Fan the nano -> quantity extraction out over files, e.g.
+
+        extractFiles(sigFile, branches, observables.makeTable, (None, True))
+
+    yields one dataframe per file, in file order.
+    """
+
+    for fileName, df in mapExtract(inputFiles, branches, derive, deriveArgs, nWorkers, step_size, archive, lazyRead, prefetch):
+        if df is not None:
+            yield df
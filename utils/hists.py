@@ -0,0 +1,318 @@
+import copy
+from functools import reduce
+
+import numpy as np
+import awkward as ak
+
+import utils.plotting as plotting
+import utils.rates as rateEngine
+
+
+def _values(values):
+
+    # flat numpy view of a chunk column (awkward, pandas or numpy)
+    if isinstance(values, ak.Array):
+        values = ak.to_numpy(values)
+    return np.asarray(values, dtype=np.float64)
+
+
+class Accumulator:
+
+    """
+    Raw counts that add up across chunks, files and jobs: a + b, sum([...])
+    and a += b merge two accumulators with the same binning, in any order.
+    _binning names the attributes that must match, _counts those that are added.
+    """
+
+    _binning = ()
+    _counts = ()
+
+    def _check(self, other):
+        if type(other) is not type(self) or any(not np.array_equal(getattr(self, name), getattr(other, name)) for name in self._binning):
+            raise ValueError("Can't merge {} with {}: different binning".format(type(self).__name__, type(other).__name__))
+
+    def __iadd__(self, other):
+        self._check(other)
+        for name in self._counts:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+        return self
+
+    def __add__(self, other):
+        return copy.deepcopy(self).__iadd__(other)
+
+    def __radd__(self, other):
+        # so that sum() starts from 0
+        if isinstance(other, int) and other == 0:
+            return copy.deepcopy(self)
+        return other.__add__(self)
+
+    @classmethod
+    def _fromArrays(cls, arrays):
+        acc = cls.__new__(cls)
+        for name, value in arrays.items():
+            value = value.item() if value.ndim == 0 else value
+            setattr(acc, name, value.tolist() if name == 'thresholds' else value)
+        return acc
+
+
+class Hist(Accumulator):
+
+    """ 1D histogram filled one chunk at a time """
+
+    _binning = ('edges',)
+    _counts = ('counts', 'nEvents')
+
+    def __init__(self, bins, range):
+        self.edges = np.linspace(range[0], range[1], bins + 1)
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.nEvents = 0
+
+    def fill(self, values):
+        values = _values(values)
+        self.counts += np.histogram(values, bins=self.edges)[0]
+        self.nEvents += len(values)
+
+
+class RateHist(Hist):
+
+    """ Histogram of the background L1 quantity for fixed rate thresholds """
+
+    _counts = Hist._counts + ('overflow',)
+
+    def __init__(self, bins, range):
+        super().__init__(bins, range)
+        self.overflow = 0
+
+    def fill(self, values):
+        values = _values(values)
+        super().fill(values)
+        # events above the range still pass every threshold
+        self.overflow += np.count_nonzero(values > self.edges[-1])
+
+    def rates(self):
+        # cumulative from the right, scaled by the number of events seen
+        return rateEngine.cumulativeRates(self.counts, self.nEvents, self.overflow)
+
+    def ratesAt(self, thresholds):
+        return rateEngine.ratesAt(self.rates(), self.edges, thresholds)
+
+    def threshForRate(self, targetRates, interpolate=False):
+        return rateEngine.threshForRate(self.rates(), self.edges, targetRates, interpolate)
+
+
+class SortedRates(Accumulator):
+
+    """
+    Background counts per L1 hardware step (bin k holds the values in
+    [start + k*granularity, start + (k+1)*granularity)), for exact rates and
+    fixed rate thresholds on that grid without a fixed range: the bins grow
+    with the largest value seen, so memory follows the L1 range, not the
+    number of events. Thresholds off the grid round up to it, as in
+    rates.exactThreshForRate. Missing values (and values below start) count
+    as events that never pass.
+    """
+
+    _binning = ('granularity', 'start')
+    _counts = ('counts', 'nEvents')
+
+    def __init__(self, granularity=0.5, start=0.):
+        self.granularity = granularity
+        self.start = start
+        self.counts = np.zeros(0, dtype=np.int64)
+        self.nEvents = 0
+
+    def _grow(self, nBins):
+        if nBins > len(self.counts):
+            self.counts = np.concatenate([self.counts, np.zeros(nBins - len(self.counts), dtype=np.int64)])
+
+    def fill(self, values):
+        values = _values(values)
+        self.nEvents += len(values)
+        valid = values[~np.isnan(values) & (values >= self.start)]
+        steps = np.floor((valid - self.start)/self.granularity).astype(np.int64)
+        counts = np.bincount(steps)
+        self._grow(len(counts))
+        self.counts[:len(counts)] += counts
+
+    def __iadd__(self, other):
+        self._check(other)
+        self._grow(len(other.counts))
+        self.counts[:len(other.counts)] += other.counts
+        self.nEvents += other.nEvents
+        return self
+
+    def _survival(self, thresholds):
+        # events at or above each threshold, from the first step at or above it
+        survival = np.append(np.cumsum(self.counts[::-1])[::-1], 0)
+        steps = np.ceil((np.asarray(thresholds, dtype=np.float64) - self.start)/self.granularity - 1e-9).astype(np.int64)
+        return survival[np.clip(steps, 0, len(self.counts))]
+
+    def ratesAt(self, thresholds):
+        # rate of events at or above each threshold
+        return self._survival(thresholds) * (rateEngine.bunchRate/self.nEvents)
+
+    def rateErrors(self, thresholds):
+        return np.sqrt(self._survival(thresholds)) * (rateEngine.bunchRate/self.nEvents)
+
+    def solve(self, targetRates):
+
+        # thresholds, achieved rates and their uncertainties: the lowest grid
+        # step whose survival doesn't exceed the events each target rate allows
+        survival = np.append(np.cumsum(self.counts[::-1])[::-1], 0)
+        scale = rateEngine.bunchRate/self.nEvents
+        maxCounts = np.floor(np.asarray(targetRates, dtype=np.float64)/scale*(1 + 1e-12))
+        steps = np.searchsorted(-survival, -maxCounts, side='left')
+        counts = survival[steps]
+        return self.start + steps*self.granularity, counts*scale, np.sqrt(counts)*scale
+
+    def threshForRate(self, targetRates):
+        return self.solve(targetRates)[0]
+
+
+class ResHist(Hist):
+
+    """ Histogram of online - offline """
+
+    def fill(self, online, offline):
+        super().fill(_values(online) - _values(offline))
+
+
+class EffHist(Accumulator):
+
+    """ Efficiency numerators per L1 threshold and the shared denominator """
+
+    _binning = ('thresholds', 'binwidth', 'xmax', 'edges')
+    _counts = ('nums', 'denom')
+
+    def __init__(self, thresholds, binwidth, xmax):
+        self.thresholds = list(thresholds)
+        self.binwidth = binwidth
+        self.xmax = xmax
+        self.edges = np.linspace(0, xmax, int(xmax/binwidth) + 1)
+        self.denom = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.nums = np.zeros((len(self.thresholds), len(self.edges) - 1), dtype=np.int64)
+
+    def fill(self, online, offline):
+        nums, denom = plotting.passCounts(_values(online), _values(offline), self.thresholds, self.edges)
+        self.nums += nums
+        self.denom += denom
+
+    def efficiencies(self, errorType='bayes'):
+        # (threshold x bin) efficiencies and errors for all thresholds
+        return plotting.effFromCounts(self.nums, self.denom, self.binwidth, self.xmax, errorType)
+
+    def efficiency(self, threshold):
+        # same outputs as plotting.efficiency for one of the thresholds
+        effs, xvals, errors = self.efficiencies()
+        i = self.thresholds.index(threshold)
+        return effs[i], xvals, errors[i]
+
+
+class TurnOnHist(Accumulator):
+
+    """
+    Signal counts in (offline bin x L1 bin), so the efficiency of any L1
+    threshold can be had after merging, once the fixed rate thresholds are
+    known. L1 bins are (edge_i, edge_i+1], plus one bin below the first edge
+    (and for missing values) and one above the last, so thresholds on the
+    L1 edges (as from rates.threshForRate on the same grid) are exact.
+    """
+
+    _binning = ('l1Edges', 'binwidth', 'xmax', 'edges')
+    _counts = ('counts',)
+
+    def __init__(self, l1Bins, l1Range, binwidth, xmax):
+        self.l1Edges = np.linspace(l1Range[0], l1Range[1], l1Bins + 1)
+        self.binwidth = binwidth
+        self.xmax = xmax
+        self.edges = np.linspace(0, xmax, int(xmax/binwidth) + 1)
+        self.counts = np.zeros((len(self.edges) - 1, len(self.l1Edges) + 1), dtype=np.int64)
+
+    def fill(self, online, offline):
+        online, offline = _values(online), _values(offline)
+        l1Bin = np.where(np.isnan(online), 0, np.searchsorted(self.l1Edges, online, side='left'))
+        self.counts += np.histogram2d(offline, l1Bin, bins=[self.edges, np.arange(len(self.l1Edges) + 2) - 0.5])[0].astype(np.int64)
+
+    def effHist(self, thresholds):
+
+        # EffHist of the given thresholds (L1 > threshold), thresholds off the
+        # L1 edges are rounded up to the next edge
+        if np.any(np.asarray(thresholds, dtype=np.float64) > self.l1Edges[-1]):
+            raise ValueError("Thresholds above the L1 range of the TurnOnHist ({:g}): {}".format(self.l1Edges[-1], list(thresholds)))
+        effHist = EffHist(thresholds, self.binwidth, self.xmax)
+
+        # events above each L1 bin edge, from the right
+        passing = np.cumsum(self.counts[:, ::-1], axis=1)[:, ::-1]
+        first = np.searchsorted(self.l1Edges, np.asarray(thresholds, dtype=np.float64), side='left') + 1
+
+        effHist.nums = passing[:, first].T.copy()
+        effHist.denom = self.counts.sum(axis=1)
+        return effHist
+
+
+def fixedRateEfficiencies(rateHists, turnOnHists, thresholds):
+
+    """
+    Final step after merging: the thresholds of every config giving the rates
+    of `thresholds` on the first (default) config, and the EffHist of each
+    config at its thresholds. Returns (list of threshold lists, list of EffHist).
+    rateHists can be RateHists or SortedRates; for the latter, TurnOnHists
+    binned at the same granularity keep the efficiencies exact.
+    """
+
+    refRates = rateHists[0].ratesAt(thresholds)
+    thresholdsArr = [list(thresholds)]
+    for rateHist in rateHists[1:]:
+        thresholdsArr.append(np.asarray(rateHist.threshForRate(refRates)).tolist())
+
+    return thresholdsArr, [turnOn.effHist(t) for turnOn, t in zip(turnOnHists, thresholdsArr)]
+
+
+# accumulator classes by name, for load
+_kinds = {cls.__name__: cls for cls in (Hist, RateHist, SortedRates, ResHist, EffHist, TurnOnHist)}
+
+
+def save(path, accumulators):
+
+    """
+    Write named accumulators, e.g. {'rate_Default': rateHist, ...}, to one
+    compressed .npz, the output of one job. The merge step is then
+
+        merged = hists.mergeFiles(glob.glob("jobs/*.npz"))
+        thresholdsArr, effHists = hists.fixedRateEfficiencies(
+            [merged['rate_' + label] for label in l1Labels],
+            [merged['turnOn_' + label] for label in l1Labels], l1METThresholds)
+    """
+
+    arrays = {}
+    for name, acc in accumulators.items():
+        arrays[name + '/kind'] = np.array(type(acc).__name__)
+        for field in acc._binning + acc._counts:
+            arrays[name + '/' + field] = np.asarray(getattr(acc, field))
+    np.savez_compressed(path, **arrays)
+
+
+def load(path):
+
+    with np.load(path) as f:
+        names = [key[:-len('/kind')] for key in f.files if key.endswith('/kind')]
+        return {name: _kinds[str(f[name + '/kind'])]._fromArrays({key.split('/', 1)[1]: f[key] for key in f.files
+                                                                    if key.startswith(name + '/') and key != name + '/kind'})
+                for name in names}
+
+
+def merge(accumulators):
+
+    # sum of accumulators, or of dicts of named accumulators (e.g. from load)
+    accumulators = list(accumulators)
+    if accumulators and isinstance(accumulators[0], dict):
+        if any(acc.keys() != accumulators[0].keys() for acc in accumulators):
+            raise ValueError("Can't merge outputs with different accumulators")
+        return {name: merge(acc[name] for acc in accumulators) for name in accumulators[0]}
+    return reduce(lambda a, b: a + b, accumulators)
+
+
+def mergeFiles(paths):
+
+    # merge the saved outputs of several jobs
+    return merge(load(path) for path in paths)
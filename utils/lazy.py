@@ -0,0 +1,125 @@
+from contextlib import contextmanager
+
+import awkward as ak
+import uproot
+
+import utils.branches as branches
+import utils.tools as tools
+import utils.profiling as profiling
+
+
+class LazyEvents:
+
+    """
+    Formatted view of a range of entries of a TTree, standing in for the
+    array of tools.iterArrays: a branch is only read from the file the first
+    time a derivation asks for it (by its formatted name), and the sum table
+    is only built if a sum is used. Supports data['name'], data[['a', 'b']],
+    data.fields and len(data).
+    """
+
+    def __init__(self, tree, branchNames, entry_start, entry_stop):
+        self.tree = tree
+        self.entry_start = entry_start
+        self.entry_stop = entry_stop
+        # like filter_name, requested branches missing from the tree are skipped
+        keys = set(tree.keys())
+        self.names = {tools.formatName(branch): branch for branch in branchNames if branch in keys}
+        self.columns = {}
+        self._tracking = []
+
+    @property
+    def fields(self):
+        fields = list(self.names)
+        if set(branches.sumBranches) <= set(fields):
+            fields.append(branches.sumTableBranch)
+        return fields
+
+    @property
+    def read(self):
+        # branches read from the file so far
+        return sorted(self.names[name] for name in self.columns if name in self.names)
+
+    def __len__(self):
+        return self.entry_stop - self.entry_start
+
+    def _column(self, name):
+
+        if name not in self.columns:
+            if name == branches.sumTableBranch:
+                self.columns[name] = tools.indexSums(self[branches.sumBranches])[name]
+            elif name in self.names:
+                self.columns[name] = self.tree[self.names[name]].array(entry_start=self.entry_start, entry_stop=self.entry_stop, library='ak')
+                profiling.count(bytes=profiling.basketBytes(self.tree, [self.names[name]], self.entry_start, self.entry_stop))
+            else:
+                raise KeyError(name)
+
+        touch(self, self._sources(name))
+        return self.columns[name]
+
+    def _sources(self, name):
+        if name == branches.sumTableBranch:
+            return [self.names[branch] for branch in branches.sumBranches]
+        return [self.names[name]]
+
+    def __getitem__(self, key):
+
+        if isinstance(key, str):
+            return self._column(key)
+        # record of several fields, like selecting fields of a record array
+        return ak.zip({name: self._column(name) for name in key}, depth_limit=1)
+
+
+def iterEvents(fileName, branchNames, step_size="100 MB", treeName='Events'):
+
+    # lazy counterpart of tools.iterArrays for one file, in chunks of about step_size
+    with uproot.open(fileName) as f:
+        yield from iterTreeEvents(f[treeName], branchNames, step_size)
+
+
+def iterTreeEvents(tree, branchNames, step_size="100 MB"):
+
+    present = [branch for branch in branchNames if branch in tree.keys()]
+    step = tree.num_entries_for(step_size, filter_name=present) if present else tree.num_entries
+    profiling.count(files=1)
+    for start in range(0, tree.num_entries, max(step, 1)):
+        profiling.count(events=min(start + step, tree.num_entries) - start)
+        yield LazyEvents(tree, branchNames, start, min(start + step, tree.num_entries))
+
+
+@contextmanager
+def track(data, alone=False):
+
+    """
+    Collect the branches read (or reused) by the code in the block, e.g.
+
+        with lazy.track(data) as used:
+            value = func(data)
+
+    Blocks nest; plain arrays give an empty set. With alone=True the reads
+    in the block aren't counted by the enclosing blocks (for intermediates
+    that pass on what they read themselves, see observables._memo).
+    """
+
+    used = set()
+    tracking = getattr(data, '_tracking', None)
+    if tracking is None:
+        yield used
+        return
+    outer = tracking[:] if alone else []
+    if alone:
+        del tracking[:]
+    tracking.append(used)
+    try:
+        yield used
+    finally:
+        # by identity: list.remove compares sets by value, and nested blocks can hold equal ones
+        del tracking[next(i for i in range(len(tracking) - 1, -1, -1) if tracking[i] is used)]
+        tracking[:0] = outer
+
+
+def touch(data, used):
+
+    # count branches as used by every open tracking block, e.g. for memoised intermediates
+    for tracked in getattr(data, '_tracking', ()):
+        tracked.update(used)
@@ -0,0 +1,132 @@
+import numpy as np
+import awkward as ak
+
+import utils.tools as tools
+
+
+# matching modes supported by matchObjects
+modes = ['leading', 'all', 'closest', 'unique']
+
+
+def getObjects(data, name, variables=['pt', 'eta', 'phi']):
+
+    # zip the flat "<name>_<var>" branches into one jagged object collection
+    return ak.zip({var: data[name + "_" + var] for var in variables})
+
+
+def deltaRMatrix(ref, cand):
+
+    # (event x nRef x nCand) deltaR between every ref and candidate object
+    refs, cands = ak.unzip(ak.cartesian([ref[['eta', 'phi']], cand[['eta', 'phi']]], axis=1, nested=True))
+    return tools.deltaR(refs['eta'], refs['phi'], cands['eta'], cands['phi'])
+
+
+def _pick(dR, idx):
+
+    # deltaR of the candidate idx chosen for each ref object (event x ref)
+    return ak.min(ak.where(ak.local_index(dR, axis=2) == idx[:, :, np.newaxis], dR, np.inf), axis=2)
+
+
+def _result(cand, idx, dR):
+
+    idx = ak.mask(idx, ak.fill_none(dR < np.inf, False))
+    return ak.zip({'idx': idx, 'dR': ak.mask(dR, ~ak.is_none(idx, axis=1)), 'pt': cand['pt'][idx]})
+
+
+def _matchLeading(ref, cand, drMax):
+
+    # leading ref object only, matched to the first candidate within drMax
+    # (in collection order, i.e. what the original per-event loop did)
+    lead = ref[ak.argsort(ref['pt'], axis=1, ascending=False, stable=True)][:, :1]
+    dR = deltaRMatrix(lead, cand)
+    idx = ak.firsts(ak.local_index(dR, axis=2)[dR < drMax], axis=2)
+
+    return ak.firsts(_result(cand, idx, ak.fill_none(_pick(dR, idx), np.inf)), axis=1)
+
+
+def _matchAll(ref, cand, drMax):
+
+    # every candidate within drMax of each ref object, nearest first
+    dR = deltaRMatrix(ref, cand)
+    order = ak.argsort(dR, axis=2)
+    idx = order[dR[order] < drMax]
+
+    candPt = ak.unzip(ak.cartesian([ref['pt'], cand['pt']], axis=1, nested=True))[1]
+
+    return ak.zip({'idx': idx, 'dR': dR[idx], 'pt': candPt[idx]})
+
+
+def _matchClosest(ref, cand, drMax):
+
+    # closest candidate to each ref object, candidates may be shared
+    dR = deltaRMatrix(ref, cand)
+    idx = ak.argmin(dR, axis=2)
+    best = ak.fill_none(ak.min(dR, axis=2), np.inf)
+
+    return _result(cand, idx, ak.where(best < drMax, best, np.inf))
+
+
+def _matchUnique(ref, cand, drMax):
+
+    # greedy one-to-one matching in increasing deltaR: every round assigns
+    # all mutually-closest (ref, cand) pairs among the unassigned objects,
+    # which reproduces the sequential greedy result for distinct deltaRs
+    dR = deltaRMatrix(ref, cand)
+    dR = ak.where(dR < drMax, dR, np.inf)
+    dRT = deltaRMatrix(cand, ref)
+    dRT = ak.where(dRT < drMax, dRT, np.inf)
+
+    refIdx = ak.local_index(ref['pt'], axis=1)
+    candIdx = ak.local_index(cand['pt'], axis=1)
+    matched = ak.full_like(refIdx, -1)
+    refFree = ak.ones_like(refIdx, dtype=bool)
+    candFree = ak.ones_like(candIdx, dtype=bool)
+
+    while True:
+        avail = ak.where(refFree & candFree[:, np.newaxis], dR, np.inf)
+        availT = ak.where(candFree & refFree[:, np.newaxis], dRT, np.inf)
+        bestDR = ak.fill_none(ak.min(avail, axis=2), np.inf)
+        bestCand = ak.fill_none(ak.argmin(avail, axis=2), -1)
+        bestRef = ak.argmin(availT, axis=2)
+
+        # ref r takes cand c if r is also the closest ref to c
+        mutual = (bestDR < np.inf) & ak.fill_none(bestRef[ak.mask(bestCand, bestCand >= 0)] == refIdx, False)
+        if not ak.any(mutual):
+            break
+
+        matched = ak.where(mutual, bestCand, matched)
+        refFree = refFree & ~mutual
+        candFree = candFree & ~ak.fill_none(mutual[bestRef] & (bestCand[bestRef] == candIdx), False)
+
+    idx = ak.mask(matched, matched >= 0)
+    return _result(cand, idx, ak.fill_none(_pick(dR, idx), np.inf))
+
+
+def matchObjects(ref, cand, mode='closest', drMax=0.4, refMinPt=None):
+
+    """
+    Columnar deltaR matching of jagged ref objects (e.g. offline jets) to jagged
+    candidates (e.g. L1 jets). Both are records with pt, eta and phi fields.
+
+    mode:
+        leading - leading ref object only, first candidate within drMax (one entry per event)
+        all     - every candidate within drMax of each ref object (event x ref x var)
+        closest - closest candidate within drMax of each ref object (event x ref)
+        unique  - greedy one-to-one matching in increasing deltaR (event x ref)
+
+    Returns a record of matched candidate index, dR and pt, None where unmatched.
+    """
+
+    if mode not in modes:
+        raise ValueError("Unknown matching mode: " + str(mode))
+
+    if refMinPt is not None and mode != 'leading':
+        ref = ref[ref['pt'] > refMinPt]
+
+    result = {'leading': _matchLeading, 'all': _matchAll, 'closest': _matchClosest, 'unique': _matchUnique}[mode](ref, cand, drMax)
+
+    if refMinPt is not None and mode == 'leading':
+        leadPt = ak.max(ref['pt'], axis=1)
+        result = ak.mask(result, ak.fill_none(leadPt > refMinPt, False))
+
+    return result
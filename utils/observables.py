@@ -0,0 +1,141 @@
+import pandas as pd
+
+import utils.tools as tools
+import utils.branches as branches
+import utils.lazy as lazy
+import utils.summary as summary
+
+
+# per-event observables computed together from one read of a file, in table order
+# name -> (function(data, memo), needs offline branches, formatted branches it reads)
+observables = {}
+
+# branches are given by their formatted names (tools.formatName): Jet_* are the
+# L1 jets and recoJet_* the offline ones
+recoJetBranches = ['reco' + var for var in branches.puppiJetBranches]
+
+
+def register(name, offline=False, reads=(), encoding=None):
+
+    # decorator adding an observable to the table; encoding is how it's stored
+    # (summary.encodings): 'hw' for L1 values, 'float32' by default for offline ones
+    def add(func):
+        observables[name] = (func, offline, list(reads))
+        summary.encodings[name] = encoding or ('float32' if offline else 'hw')
+        return func
+    return add
+
+
+def _memo(memo, key, func, data, reads=None):
+
+    # intermediates shared between observables are computed once per chunk,
+    # the branches they read still count for every observable using them
+    # (only those among reads, the formatted branches it needs, if given)
+    if key not in memo:
+        with lazy.track(data, alone=True) as used:
+            memo[key] = func(data), used
+    value, used = memo[key]
+    if reads is not None:
+        names = getattr(data, 'names', {})
+        used = used & {names.get(branch, branch) for branch in reads}
+    lazy.touch(data, used)
+    return value
+
+
+def _mets(data):
+    # the METs with the recoil, one pass for all of them
+    return tools.getMETs(data, recoil=True)
+
+
+# HT, MHT, jet multiplicity and n-th leading jet variants of the L1 (Jet) and offline
+# (recoJet) jets, each collection's computed together in one pass (tools.getJetSums)
+jetVariants = {
+    'Jet': [
+        {'name': 'L1HT', 'quantity': 'ht'},
+        {'name': 'L1Jet1', 'quantity': 'jet', 'n': 1},
+        {'name': 'L1HT30er2p4', 'quantity': 'ht', 'ptMin': 30, 'etaMax': 2.4},
+        {'name': 'L1MHT30er2p4', 'quantity': 'mht', 'ptMin': 30, 'etaMax': 2.4},
+    ],
+    'recoJet': [
+        {'name': 'PuppiHT', 'quantity': 'ht'},
+        {'name': 'PuppiJet1', 'quantity': 'jet', 'n': 1},
+        {'name': 'PuppiHT30er2p4', 'quantity': 'ht', 'ptMin': 30, 'etaMax': 2.4},
+        {'name': 'PuppiHT40er2p4', 'quantity': 'ht', 'ptMin': 40, 'etaMax': 2.4},
+        {'name': 'PuppiHT30er3p0', 'quantity': 'ht', 'ptMin': 30, 'etaMax': 3.0},
+        {'name': 'PuppiHT30er5p0', 'quantity': 'ht', 'ptMin': 30, 'etaMax': 5.0},
+        {'name': 'PuppiMHT30er2p4', 'quantity': 'mht', 'ptMin': 30, 'etaMax': 2.4},
+        {'name': 'PuppiJet2', 'quantity': 'jet', 'n': 2},
+        {'name': 'PuppiJet4', 'quantity': 'jet', 'n': 4},
+    ],
+}
+
+
+def registerJetVariants(collection, variants, offline=False):
+
+    # one observable per variant, reading only the branches its own cuts need; the
+    # variants of the collection in the table are computed together in one pass.
+    # L1 pt sums and jets stay on the hardware steps, MHT and counts don't
+    def jetSums(data, memo, variant):
+        requested = [other for other in variants if 'names' not in memo or other['name'] in memo['names']]
+        sums = _memo(memo, collection, lambda data: tools.getJetSums(data, collection, requested), data, tools.jetReads(collection, [variant]))
+        return sums[variant['name']].to_numpy()
+
+    for variant in variants:
+        encoding = 'float32' if offline or variant['quantity'] in ('mht', 'njets') else 'hw'
+        register(variant['name'], offline, tools.jetReads(collection, [variant]), encoding)(
+            lambda data, memo, variant=variant: jetSums(data, memo, variant))
+
+
+@register('L1MET', reads=branches.sumBranches)
+def l1MET(data, memo):
+    return tools.getSumPt(data, 'methf')
+
+registerJetVariants('Jet', jetVariants['Jet'])
+
+@register('PuppiMET', offline=True, reads=branches.puppiMETBranches + branches.muonBranches)
+def puppiMET(data, memo):
+    return _memo(memo, 'puppiMET', _mets, data)['PuppiMET']
+
+@register('PuppiMETNoMu', offline=True, reads=branches.puppiMETBranches + branches.muonBranches)
+def puppiMETNoMu(data, memo):
+    return _memo(memo, 'puppiMET', _mets, data)['PuppiMETNoMu']
+
+@register('RecoilPara', offline=True, reads=branches.puppiMETBranches + branches.muonBranches)
+def recoilPara(data, memo):
+    return _memo(memo, 'puppiMET', _mets, data)['RecoilPara']
+
+@register('RecoilPerp', offline=True, reads=branches.puppiMETBranches + branches.muonBranches)
+def recoilPerp(data, memo):
+    return _memo(memo, 'puppiMET', _mets, data)['RecoilPerp']
+
+registerJetVariants('recoJet', jetVariants['recoJet'], offline=True)
+
+@register('L1Jet1Matched', offline=True, reads=recoJetBranches + branches.puppiJetBranches, encoding='hw')
+def l1Jet1Matched(data, memo):
+    return _memo(memo, 'puppiJET', tools.getPUPPIJET, data)['matched_l1_jet']
+
+
+def makeTable(data, names=None, offline=True):
+
+    """
+    One dataframe with every registered observable (or the given names) for a
+    chunk of formatted data. Offline observables are skipped with offline=False,
+    e.g. for zero bias samples. For lazy events (utils.lazy) the branches each
+    observable used are kept in df.attrs['branches'].
+    """
+
+    names = [name for name in names or observables if offline or not observables[name][1]]
+    # the observables in the table, so intermediates shared by several compute just those
+    memo = {'names': set(names)}
+    columns = {}
+    usage = {}
+    for name in names:
+        func, _, _ = observables[name]
+        with lazy.track(data) as used:
+            columns[name] = tools.toNumpy(func(data, memo))
+        usage[name] = sorted(used)
+
+    df = pd.DataFrame(columns)
+    if isinstance(data, lazy.LazyEvents):
+        df.attrs['branches'] = usage
+    return df
@@ -0,0 +1,73 @@
+import os
+
+import uproot
+
+import utils.tools as tools
+import utils.observables as observables
+
+
+# sample role -> whether its files have the offline (reco) branches,
+# zero bias background files are RAW only
+roles = {'sig': True, 'bkg': False}
+
+# tree keys per dataset (directory), so each dataset is opened once per process
+_keys = {}
+
+
+def observableBranches(names=None, offline=True, useEmu=False, useMP=False):
+
+    # nano branches read by each observable (all registered ones by default),
+    # offline observables left out with offline=False
+    plan = {}
+    for name in names or observables.observables:
+        _, isOffline, reads = observables.observables[name]
+        if isOffline and not offline:
+            continue
+        plan[name] = [tools.rawName(branch, useEmu, useMP) for branch in reads]
+    return plan
+
+
+def treeKeys(fileList, treeName='Events'):
+
+    # branch names of the dataset, from the first of its files that opens
+    dataset = (os.path.dirname(fileList[0]) if '://' not in fileList[0] else fileList[0].rsplit('/', 1)[0], treeName)
+    if dataset not in _keys:
+        for fileName in fileList:
+            try:
+                with uproot.open(fileName) as f:
+                    _keys[dataset] = set(f[treeName].keys())
+                break
+            except (OSError, KeyError, ValueError) as error:
+                print("Can't read the branches of {}: {}".format(fileName, error))
+        else:
+            return None
+    return _keys[dataset]
+
+
+def plan(fileList, role, names=None, useEmu=False, useMP=False, treeName='Events'):
+
+    """
+    Minimal reading plan for one dataset in a given role ('sig' or 'bkg'):
+    the observables to derive and the union of the nano branches they read.
+    The branches are checked once against the tree of the dataset and
+    observables whose branches are missing are dropped (and reported), e.g.
+
+        names, branchList = planning.plan(bkgFile, 'bkg', None, useEmu=True)
+        cache.extractFiles(bkgFile, branchList, observables.makeTable, (names, False), ...)
+    """
+
+    branchPlan = observableBranches(names, roles[role], useEmu, useMP)
+
+    keys = treeKeys(fileList, treeName) if fileList else None
+    if keys is not None:
+        for name, reads in list(branchPlan.items()):
+            missing = [branch for branch in reads if branch not in keys]
+            if missing:
+                print("Skipping {} for {}: missing {}".format(name, os.path.dirname(fileList[0]), missing))
+                del branchPlan[name]
+
+    branchList = []
+    for reads in branchPlan.values():
+        branchList += [branch for branch in reads if branch not in branchList]
+
+    return list(branchPlan), branchList
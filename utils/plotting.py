@@ -1,27 +1,135 @@
 import numpy as np
-import awkward as ak
-import math
+from itertools import cycle
+import matplotlib.pyplot as plt
+
+import utils.rates as rateEngine
 
 def efficiency(data_on, data_off, threshold, binwidth, xmax):
     
-    num = ak.zip({'on': data_on})
-    num['off'] = data_off
-    num = num[num['on'] > threshold]
-
-    numHist = np.histogram(num['off'], bins=int(xmax/binwidth), range=(0,xmax))[0]
-    denomHist  = np.histogram(data_off, bins=int(xmax/binwidth), range=(0,xmax))[0]
-    effs = numHist/denomHist
-    errors = [math.sqrt((((k + 1) * (k + 2)) / ((n + 2) * (n + 3))) - (((k + 1) * (k + 1)) / ((n + 2) * (n + 2))))
-        for (k, n) in zip(numHist, denomHist)]
+    effs, xvals, errors = efficiencies(data_on, data_off, [threshold], binwidth, xmax)
+
+    return effs[0], xvals, errors[0]
+
+def efficiencies(data_on, data_off, thresholds, binwidth, xmax, errorType='bayes'):
+
+    """
+    Efficiency curves for many L1 thresholds at once. Returns a
+    (threshold x bin) efficiency matrix, the bin centres and the errors:
+    (threshold x bin) for 'bayes', (threshold x 2 x bin) down/up for 'clopper-pearson'.
+    """
+
+    edges = np.linspace(0, xmax, int(xmax/binwidth) + 1)
+    numHists, denomHist = passCounts(data_on, data_off, thresholds, edges)
+
+    return effFromCounts(numHists, denomHist, binwidth, xmax, errorType)
+
+def passCounts(data_on, data_off, thresholds, edges):
+
+    # numerators for every threshold from one 2D histogram: each event is binned
+    # in offline value and in the number of (sorted) thresholds it passes
+    on = np.asarray(data_on, dtype=np.float64)
+    off = np.asarray(data_off, dtype=np.float64)
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    order = np.argsort(thresholds)
+
+    nPassed = np.searchsorted(thresholds[order], on, side='left')
+    nPassed[np.isnan(on)] = 0
+    counts = np.histogram2d(off, nPassed, bins=[edges, np.arange(len(thresholds) + 2) - 0.5])[0].astype(np.int64)
+
+    # events passing sorted threshold j are those passing more than j thresholds
+    passed = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1][:, 1:]
+    numHists = np.empty((len(thresholds), len(edges) - 1), dtype=np.int64)
+    numHists[order] = passed.T
+
+    return numHists, counts.sum(axis=1)
+
+def effFromCounts(numHist, denomHist, binwidth, xmax, errorType='bayes'):
+
+    k = np.asarray(numHist, dtype=np.float64)
+    n = np.asarray(denomHist, dtype=np.float64)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        effs = k/n
+    if errorType == 'bayes':
+        errors = np.sqrt((((k + 1) * (k + 2)) / ((n + 2) * (n + 3))) - (((k + 1) * (k + 1)) / ((n + 2) * (n + 2))))
+    elif errorType == 'clopper-pearson':
+        errors = clopperPearson(k, n, effs)
+    else:
+        raise ValueError("Unknown efficiency error type: " + str(errorType))
     xvals = [x+(binwidth/2) for x in range(0,xmax,binwidth)]
 
     return effs, xvals, errors
 
+def clopperPearson(k, n, effs, cl=0.683):
+
+    from scipy.stats import beta
+
+    # exact binomial interval, as (down, up) distances from the efficiency
+    k, n = np.broadcast_arrays(k, n)
+    alpha = (1 - cl)/2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        lo = np.where(k > 0, beta.ppf(alpha, k, n - k + 1), 0.)
+        hi = np.where(k < n, beta.ppf(1 - alpha, k + 1, n - k), 1.)
+
+    return np.stack([effs - lo, hi - effs], axis=-2)
+
 def getThreshForRate(rates, bins, target_rate):
     
-    finalThresh = 0
-    for rate, thresh in zip(rates, range(bins)):
-            if rate < target_rate:
-                finalThresh = thresh
-                break
-    return finalThresh
+    # rates in 1 GeV bins starting from 0
+    return int(rateEngine.threshForRate(rates, np.arange(bins + 1), target_rate))
+
+def plotHists(histList, labels, xlabel, path, ylabel='Events', log=False, fill=False):
+
+    # stairs of filled hists.Hist objects, one per label
+    for hist, label in zip(histList, labels):
+        plt.stairs(hist.counts, hist.edges, fill=fill, label=label)
+
+    if log:
+        plt.yscale('log')
+    plt.legend(fontsize=14)
+    plt.xlabel(xlabel)
+    plt.ylabel(ylabel)
+    plt.tight_layout()
+    plt.savefig(path, format="pdf")
+    plt.clf()
+
+def plotRates(rateHists, labels, xlabel, path):
+
+    for rateHist, label in zip(rateHists, labels):
+        plt.stairs(rateHist.rates(), rateHist.edges, label=label)
+
+    plt.yscale('log')
+    plt.legend(fontsize=14)
+    plt.xlabel(xlabel)
+    plt.ylabel('Rate [Hz]')
+    plt.tight_layout()
+    plt.savefig(path, format="pdf")
+    plt.clf()
+
+def plotEfficiencies(effHists, labels, xlabel, path, errorType='bayes', fits=None, bands=None):
+
+    # one series per (label, threshold), at the thresholds each EffHist was filled with,
+    # with the fitted turn-on of each (a turnons.fitEffHists table) and the bootstrap
+    # band of each (label -> (nominal, low, high) of bootstrap.fixedRateBands) if given
+    marks = cycle(('o', 's', '^', 'v', 'D', '*', '+', 'x'))
+    cols = cycle(('tab:blue','tab:orange','tab:green','tab:red','tab:purple', 'tab:pink', 'tab:cyan', 'tab:brown', 'tab:olive'))
+    if fits is not None:
+        import utils.turnons as turnons
+        fitRows = {(row['label'], row['threshold']): row for _, row in fits.iterrows() if row['converged']}
+    for effHist, label in zip(effHists, labels):
+        effs, xvals, errs = effHist.efficiencies(errorType)
+        for i, (threshold, eff_data) in enumerate(zip(effHist.thresholds, effs)):
+            color = next(cols)
+            plt.scatter(xvals, eff_data, label=label + " > {:g}".format(threshold), marker=next(marks), color=color)
+            if bands is not None and label in bands:
+                plt.fill_between(xvals, bands[label][1][i], bands[label][2][i], color=color, alpha=0.2, linewidth=0)
+            if fits is not None and (label, threshold) in fitRows:
+                x = np.linspace(effHist.edges[0], effHist.edges[-1], 400)
+                plt.plot(x, turnons.curve(fitRows[(label, threshold)], x), color=color)
+
+    plt.axhline(0.95, linestyle='--', color='black')
+    plt.legend(fontsize=14)
+    plt.xlabel(xlabel)
+    plt.ylabel('Efficiency')
+    plt.tight_layout()
+    plt.savefig(path, format="pdf")
+    plt.clf()
@@ -0,0 +1,217 @@
+import time
+import queue
+import bisect
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import uproot
+from uproot.source.chunk import Chunk
+from uproot.source.futures import TrivialFuture
+from uproot.source.fsspec import FSSpecSource
+
+
+class PrefetchSource(FSSpecSource):
+
+    """
+    fsspec source (local files, root:// through fsspec-xrootd, ...) that can
+    fetch the baskets of a file ahead of time in one vector read (cat_ranges)
+    and then serves those byte ranges, and any range inside one of them (the
+    basket key headers uproot reads to size the steps), from memory. Ranges
+    that weren't prefetched are read from the file as usual.
+    """
+
+    # seconds added to every request, for the local stand-in of a remote site
+    latency = 0
+
+    def __init__(self, file_path, **options):
+        super().__init__(file_path, **options)
+        self._prefetched = {}
+        self._starts = []
+
+    def _request(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def prefetch(self, ranges):
+
+        # one request for all the ranges, kept until the file is closed
+        ranges = [tuple(r) for r in ranges if tuple(r) not in self._prefetched]
+        if not ranges:
+            return 0
+        self._request()
+        for chunk in FSSpecSource.chunks(self, ranges, queue.Queue()):
+            chunk.wait()
+            self._prefetched[(chunk.start, chunk.stop)] = chunk.raw_data
+        self._starts = sorted(self._prefetched)
+        return sum(stop - start for start, stop in ranges)
+
+    def _cached(self, start, stop):
+        data = self._prefetched.get((start, stop))
+        if data is None:
+            # the prefetched range starting last at or before start, if it covers stop
+            i = bisect.bisect_right(self._starts, (start, float('inf'))) - 1
+            if i < 0 or self._starts[i][1] < stop:
+                return None
+            first, _ = self._starts[i]
+            data = self._prefetched[self._starts[i]][start - first:stop - first]
+        return Chunk(self, start, stop, TrivialFuture(data))
+
+    def chunk(self, start, stop):
+        cached = self._cached(start, stop)
+        if cached is not None:
+            return cached
+        self._request()
+        return super().chunk(start, stop)
+
+    def chunks(self, ranges, notifications):
+
+        # prefetched ranges are served (and notified) at once, the rest in one request
+        chunks = [self._cached(start, stop) for start, stop in ranges]
+        for chunk in chunks:
+            if chunk is not None:
+                notifications.put(chunk)
+
+        missing = [r for r, chunk in zip(ranges, chunks) if chunk is None]
+        if missing:
+            self._request()
+            fetched = iter(super().chunks(missing, notifications))
+            chunks = [chunk if chunk is not None else next(fetched) for chunk in chunks]
+        return chunks
+
+    def __exit__(self, exception_type, exception_value, traceback):
+        self._prefetched = {}
+        self._starts = []
+        super().__exit__(exception_type, exception_value, traceback)
+
+
+def latencySource(latency):
+
+    # PrefetchSource paying latency seconds per request, to stand in for a
+    # remote site with a local directory
+    return type('LatencySource', (PrefetchSource,), {'latency': latency})
+
+
+def basketRanges(tree, branchList):
+
+    # byte ranges of the baskets of the requested branches present in the tree
+    ranges = []
+    for name in branchList:
+        if name not in tree.keys():
+            continue
+        branch = tree[name]
+        # (.., basket number, (start, stop) or an embedded basket already in memory)
+        for item in branch.entries_to_ranges_or_baskets(0, branch.num_entries):
+            if isinstance(item[-1], tuple):
+                ranges.append(tuple(int(i) for i in item[-1]))
+    return ranges
+
+
+class _Budget:
+
+    """ Bytes in flight, granted to files in order so a later file can't starve an earlier one """
+
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.inFlight = 0
+        self.turn = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, ticket, nBytes):
+        with self.condition:
+            # a file bigger than the cap still goes alone
+            self.condition.wait_for(lambda: ticket == self.turn and (self.inFlight == 0 or self.maxBytes is None or self.inFlight + nBytes <= self.maxBytes))
+            self.inFlight += nBytes
+            self.turn += 1
+            self.condition.notify_all()
+
+    def release(self, nBytes):
+        with self.condition:
+            self.inFlight -= nBytes
+            self.condition.notify_all()
+
+
+def _fetch(fileName, ticket, branchList, treeName, handler, budget):
+
+    f = None
+    nBytes = None
+    try:
+        f = uproot.open(fileName, handler=handler)
+        tree = f[treeName]
+        ranges = basketRanges(tree, branchList)
+        nBytes = sum(stop - start for start, stop in ranges)
+        budget.acquire(ticket, nBytes)
+        f.file.source.prefetch(ranges)
+        return f, tree, nBytes
+    except BaseException:
+        # give up this file's turn (and bytes) so the files after it go on
+        if nBytes is None:
+            budget.acquire(ticket, 0)
+        else:
+            budget.release(nBytes)
+        if f is not None:
+            f.close()
+        raise
+
+
+def _release(future, budget):
+
+    # close a prefetched file nobody will read and free its bytes
+    try:
+        f, _, nBytes = future.result()
+    except Exception:
+        return
+    f.close()
+    budget.release(nBytes)
+
+
+def iterTrees(fileList, branchList, ahead=2, maxBytes=2e9, treeName='Events', latency=None):
+
+    """
+    Open the files in order, yielding (fileName, tree) with the baskets of
+    branchList already in memory. While a file is being decoded the next
+    `ahead` files are opened and their baskets fetched in the background,
+    each in one vector read, with at most maxBytes of baskets held at once.
+    The file stays open (one handle) from the prefetch to the end of its
+    decoding, and the fsspec filesystem (connection) is shared by all files.
+    Files that can't be read are reported and skipped.
+
+    latency (seconds per request) swaps in latencySource, to try this out on
+    local files as if they were remote.
+    """
+
+    handler = latencySource(latency) if latency else PrefetchSource
+    budget = _Budget(maxBytes)
+    files = iter(enumerate(fileList))
+    pending = deque()
+
+    with ThreadPoolExecutor(max_workers=ahead + 1) as pool:
+
+        def submit():
+            ticket, fileName = next(files, (None, None))
+            if fileName is not None:
+                pending.append((fileName, pool.submit(_fetch, fileName, ticket, branchList, treeName, handler, budget)))
+
+        try:
+            for _ in range(ahead + 1):
+                submit()
+
+            while pending:
+                fileName, future = pending.popleft()
+                try:
+                    f, tree, nBytes = future.result()
+                except Exception as error:
+                    print("Failed to prefetch {}: {}".format(fileName, error))
+                    submit()
+                    continue
+
+                submit()
+                try:
+                    yield fileName, tree
+                finally:
+                    f.close()
+                    budget.release(nBytes)
+        finally:
+            # stopped early: the files already being fetched get their turn, then are closed
+            while pending:
+                _release(pending.popleft()[1], budget)
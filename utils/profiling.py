@@ -0,0 +1,253 @@
+import os
+import io
+import json
+import time
+import pstats
+import resource
+import platform
+import cProfile
+from contextlib import contextmanager
+
+
+# counters the tools add to every open stage
+counters = ('events', 'bytes', 'files')
+
+# records of the stages currently open (innermost last), in this process
+_open = []
+
+# report the module level stage() records into, set by RunReport.start
+_active = None
+
+
+def _peakRss():
+
+    # peak resident memory (MB) since the last reset, the lifetime peak where /proc isn't there
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1])/1e3
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1e3
+
+
+def _resetPeak():
+    try:
+        with open("/proc/self/clear_refs", 'w') as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def _notePeak():
+
+    # the peak so far belongs to every open stage
+    peak = _peakRss()
+    for record in _open:
+        record['peakRssMB'] = max(record['peakRssMB'], peak)
+
+
+def _newRecord(name=None, label=None, parent=None):
+    return dict({'stage': name, 'label': label, 'parent': parent, 'calls': 0, 'wall': 0., 'cpu': 0., 'workerCpu': 0.,
+                 'peakRssMB': 0., 'workerPeakRssMB': 0.}, **{key: 0 for key in counters})
+
+
+def count(**counts):
+
+    # add events/bytes/files to every open stage; no-op outside of stages
+    for record in _open:
+        for key, value in counts.items():
+            record[key] += value
+
+
+def basketBytes(tree, branchList, entry_start=0, entry_stop=None):
+
+    # compressed bytes of the branches of tree read for a range of entries
+    # (pro rata of the branch sizes), as read from disk or the network
+    entry_stop = tree.num_entries if entry_stop is None else entry_stop
+    if not tree.num_entries:
+        return 0
+    keys = set(tree.keys())
+    size = sum(getattr(tree[name], 'compressed_bytes', 0) for name in branchList if name in keys)
+    return int(size*(entry_stop - entry_start)/tree.num_entries)
+
+
+@contextmanager
+def collect():
+
+    """
+    Counters, cpu time and peak memory of the block on their own, e.g. the
+    extraction of one file in a worker, to be sent back and merged into the
+    open stages of the parent with merge(). Stages open around the block
+    don't count it themselves, so it's only counted once when the worker is
+    the parent process itself.
+    """
+
+    global _open
+    record = _newRecord()
+    _notePeak()
+    outer, _open = _open, [record]
+    _resetPeak()
+    cpu = time.process_time()
+    try:
+        yield record
+    finally:
+        record['workerCpu'] = time.process_time() - cpu
+        record['workerPeakRssMB'] = _peakRss()
+        _open = outer
+
+
+def merge(record):
+
+    # add a collect() record (from a worker) to the open stages
+    if not record:
+        return
+    for target in _open:
+        for key in counters + ('workerCpu',):
+            target[key] += record[key]
+        target['workerPeakRssMB'] = max(target['workerPeakRssMB'], record['workerPeakRssMB'])
+
+
+class RunReport:
+
+    """
+    Wall and cpu time, peak RSS, events, bytes read and files per stage and
+    label of a run, e.g.
+
+        report = profiling.RunReport("MET", profile='extract').start()
+        with profiling.stage('extract', label):
+            ...
+        report.finish("data/MET_report.json")
+
+    Stages nest (the parent is kept) and a stage entered again with the same
+    name and label adds to the same record. The tools count the events,
+    bytes and files they read into the open stages, and extraction workers
+    send theirs back (workerCpu, workerPeakRssMB). profile names a stage
+    ('stage' or 'stage:label') to run under cProfile, or under pyinstrument
+    with profiler='pyinstrument'; only the main process is profiled, so
+    use one worker to see inside the extraction.
+    """
+
+    def __init__(self, name, profile=None, profiler='cProfile', profileDir="./profiles/"):
+        self.name = name
+        self.profile = profile
+        self.profiler = profiler
+        self.profileDir = profileDir
+        self.records = {}
+        self.profiles = []
+        self.started = None
+
+    def start(self):
+        global _active
+        _active = self
+        self.started = time.time()
+        self._wall = time.perf_counter()
+        return self
+
+    def _profiled(self, name, label):
+        return self.profile in (name, "{}:{}".format(name, label))
+
+    def _startProfiler(self):
+        if self.profiler == 'pyinstrument':
+            try:
+                import pyinstrument
+            except ImportError:
+                print("pyinstrument isn't installed, profiling with cProfile")
+            else:
+                profiler = pyinstrument.Profiler()
+                profiler.start()
+                return profiler
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def _stopProfiler(self, profiler, name, label):
+
+        os.makedirs(self.profileDir, exist_ok=True)
+        stem = os.path.join(self.profileDir, "_".join(str(part).replace("/", "-") for part in (self.name, name, label) if part is not None))
+        if isinstance(profiler, cProfile.Profile):
+            profiler.disable()
+            profiler.dump_stats(stem + ".prof")
+            stream = io.StringIO()
+            pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(20)
+            print(stream.getvalue())
+            self.profiles.append(stem + ".prof")
+        else:
+            profiler.stop()
+            with open(stem + ".html", 'w') as f:
+                f.write(profiler.output_html())
+            print(profiler.output_text())
+            self.profiles.append(stem + ".html")
+
+    @contextmanager
+    def stage(self, name, label=None):
+
+        parent = _open[-1]['stage'] if _open else None
+        record = self.records.setdefault((name, label), _newRecord(name, label, parent))
+        _notePeak()
+        _resetPeak()
+        _open.append(record)
+        profiler = self._startProfiler() if self._profiled(name, label) else None
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record['calls'] += 1
+            record['wall'] += time.perf_counter() - wall
+            record['cpu'] += time.process_time() - cpu
+            _notePeak()
+            _open.remove(record)
+            if profiler is not None:
+                self._stopProfiler(profiler, name, label)
+
+    def report(self):
+
+        stages = []
+        for record in self.records.values():
+            record = dict(record)
+            record['eventsPerSecond'] = record['events']/record['wall'] if record['wall'] else None
+            stages.append(record)
+        return {'name': self.name, 'started': time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)) if self.started else None,
+                'wall': time.perf_counter() - self._wall if self.started else None, 'cpu': time.process_time(),
+                'peakRssMB': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss/1e3, 'host': platform.node(), 'cpus': os.cpu_count(),
+                'profiles': self.profiles, 'stages': stages}
+
+    def summary(self):
+
+        report = self.report()
+        print("Run report {}: {:.1f} s".format(self.name, report['wall'] or 0))
+        print("{:<30s} {:>9s} {:>9s} {:>9s} {:>9s} {:>11s} {:>11s} {:>9s} {:>6s}".format(
+            "stage", "wall s", "cpu s", "worker s", "peak MB", "events", "events/s", "MB read", "files"))
+        for record in report['stages']:
+            name = record['stage'] + (" " + str(record['label']) if record['label'] is not None else "")
+            if record['parent']:
+                name = "  " + name
+            print("{:<30s} {:>9.2f} {:>9.2f} {:>9.2f} {:>9.0f} {:>11d} {:>11.0f} {:>9.1f} {:>6d}".format(
+                name[:30], record['wall'], record['cpu'], record['workerCpu'], max(record['peakRssMB'], record['workerPeakRssMB']),
+                record['events'], record['eventsPerSecond'] or 0, record['bytes']/1e6, record['files']))
+
+    def finish(self, path=None):
+
+        # JSON report (if a path is given) and console summary; stops collecting
+        global _active
+        if _active is self:
+            _active = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            with open(path, 'w') as f:
+                json.dump(self.report(), f, indent=1)
+        self.summary()
+        if path:
+            print("Run report written to " + path)
+
+
+@contextmanager
+def stage(name, label=None):
+
+    # a stage of the active report, if there is one
+    if _active is None:
+        yield None
+        return
+    with _active.stage(name, label) as record:
+        yield record
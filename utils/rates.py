@@ -0,0 +1,111 @@
+import numpy as np
+
+
+# LHC bunch crossing rate scaled by the fraction of filled bunches
+bunchRate = 40000000*(2452/3564)
+
+
+def cumulativeRates(counts, nEvents, overflow=0):
+
+    # rate for a threshold at each lower bin edge: counts at or above the bin
+    # (and the events above the last edge), scaled from the number of zero bias
+    # events to the bunch crossing rate
+    return (np.cumsum(np.asarray(counts)[::-1])[::-1] + overflow) * (bunchRate/nEvents)
+
+
+def rateCurve(values, bins=200, range=(0, 200)):
+
+    """
+    Rate vs threshold for a background sample without going through plt.hist.
+    Equivalent to plt.hist(values, bins, range, cumulative=-1, weights=rateScale).
+    Returns the rates and the bin edges (thresholds).
+    """
+
+    values = np.asarray(values)
+    counts, edges = np.histogram(values, bins=bins, range=range)
+
+    return cumulativeRates(counts, len(values), np.count_nonzero(values > edges[-1])), edges
+
+
+def ratesAt(rates, edges, thresholds):
+
+    # rate of the bin each threshold falls in
+    idx = np.searchsorted(edges, thresholds, side='right') - 1
+
+    return np.asarray(rates)[np.clip(idx, 0, len(rates) - 1)]
+
+
+def threshForRate(rates, edges, targetRates, interpolate=False):
+
+    """
+    Lowest threshold (bin edge) whose rate is below each target rate, for any
+    number of targets at once. Rates must be non-increasing, as from
+    cumulativeRates. Targets that are never reached give the first edge.
+
+    With interpolate=True the threshold is placed between the last edge above
+    and the first edge below the target, linearly in log(rate).
+    """
+
+    rates = np.asarray(rates, dtype=np.float64)
+    edges = np.asarray(edges)
+    targets = np.asarray(targetRates, dtype=np.float64)
+
+    # first bin with rate < target, on the (non-decreasing) negated rates
+    idx = np.searchsorted(-rates, -targets, side='right')
+    found = idx < len(rates)
+    idx = np.where(found, idx, 0)
+    thresholds = np.where(found, edges[idx], edges[0])
+
+    if interpolate:
+        above = np.maximum(idx - 1, 0)
+        hi, lo = rates[above], rates[idx]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            frac = np.where((lo > 0) & (hi > 0), np.log(hi/targets)/np.log(hi/lo), (hi - targets)/(hi - lo))
+        frac = np.where(np.isfinite(frac), np.clip(frac, 0, 1), 1)
+        interp = edges[above] + frac*(edges[idx] - edges[above])
+        thresholds = np.where(found & (idx > 0), interp, thresholds)
+
+    return thresholds
+
+
+def fixedRateThresholds(refRates, refEdges, refThresholds, rates, edges, interpolate=False):
+
+    # thresholds giving the same rates as refThresholds do on the reference curve
+    return threshForRate(rates, edges, ratesAt(refRates, refEdges, refThresholds), interpolate)
+
+
+def survivalCounts(sortedValues, thresholds):
+
+    # events at or above each threshold, by bisection of the sorted values
+    return len(sortedValues) - np.searchsorted(sortedValues, thresholds, side='left')
+
+
+def exactThreshForRate(sortedValues, nEvents, targetRates, granularity=0.5, start=0.):
+
+    """
+    Lowest threshold on the grid start + k*granularity (the L1 hardware steps)
+    whose rate does not exceed each target rate, from the sorted background
+    values (missing values removed) of nEvents events: the empirical survival
+    function, so there is no binning and no overflow. A target rate taken from
+    the same sample gives back the same threshold.
+
+    Returns the thresholds, the rates they give and the statistical (Poisson)
+    uncertainty of those rates.
+    """
+
+    values = np.asarray(sortedValues, dtype=np.float64)
+    targets = np.asarray(targetRates, dtype=np.float64)
+    scale = bunchRate/nEvents
+
+    # most events allowed above the threshold, then how many must fall below it
+    maxCounts = np.floor(targets/scale*(1 + 1e-12))
+    nBelow = np.clip(len(values) - maxCounts, 0, len(values)).astype(np.int64)
+
+    # first grid step above the nBelow-th smallest value
+    last = values[np.maximum(nBelow - 1, 0)] if len(values) else np.zeros(len(nBelow))
+    thresholds = np.where(nBelow > 0, start + (np.floor((last - start)/granularity) + 1)*granularity, start)
+    thresholds = np.maximum(thresholds, start)
+
+    counts = survivalCounts(values, thresholds)
+
+    return thresholds, counts*scale, np.sqrt(counts)*scale
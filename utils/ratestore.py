@@ -0,0 +1,179 @@
+import os
+import json
+
+import numpy as np
+
+import utils.hists as hists
+import utils.rates as rateEngine
+
+
+class RateStore:
+
+    """
+    Persistent background counts on the L1 hardware steps, one row per
+    (config, observable, bx filter), in one memory-mapped int64 matrix
+    (<path>/counts.bin) with its index (<path>/index.json). Bin k holds the
+    values in [k*granularity, (k+1)*granularity), so the rate at any threshold
+    on the grid is exact (values needn't be on the grid) and the fixed rate
+    thresholds are the ones SortedRates would give, for any number of configs,
+    without going back to the events. A new config adds a row, filling an
+    existing key adds to it (clear() first to refill), e.g.
+
+        store = RateStore(writeDir + "rateStore/")
+        store.clear('BaselineZS')
+        for df in tools.iterHdf(bkg_hdf5, 'BaselineZS'):
+            store.fill('BaselineZS', 'L1MET', df['L1MET'])
+        table = store.thresholdTable('L1MET', l1Labels, [50, 90])
+
+    bx names the bunch crossing selection the values were made with (the
+    observables of utils.observables use the bx = 0 sums), so differently
+    selected counts can sit side by side. One writer at a time.
+    """
+
+    def __init__(self, path, granularity=0.5, maxValue=32768.):
+        self.path = path
+        self._counts = None
+        index = os.path.join(path, "index.json")
+        if os.path.exists(index):
+            with open(index) as f:
+                self.index = json.load(f)
+            if self.index['granularity'] != granularity:
+                raise ValueError("Rate store {} has a granularity of {} GeV, not {}".format(path, self.index['granularity'], granularity))
+        else:
+            os.makedirs(path, exist_ok=True)
+            self.index = {'granularity': granularity, 'nBins': int(np.ceil(maxValue/granularity)) + 1, 'rows': []}
+            open(os.path.join(path, "counts.bin"), 'wb').close()
+            self._write()
+
+    @property
+    def granularity(self):
+        return self.index['granularity']
+
+    @property
+    def nBins(self):
+        return self.index['nBins']
+
+    def _write(self):
+        index = os.path.join(self.path, "index.json")
+        with open(index + ".tmp", 'w') as f:
+            json.dump(self.index, f)
+        os.replace(index + ".tmp", index)
+
+    def _matrix(self):
+
+        # (rows x bins) counts, mapped again when rows were added
+        rows = len(self.index['rows'])
+        if self._counts is None or self._counts.shape[0] != rows:
+            self._counts = np.memmap(os.path.join(self.path, "counts.bin"), dtype=np.int64, mode='r+', shape=(rows, self.nBins)) if rows else np.zeros((0, self.nBins), dtype=np.int64)
+        return self._counts
+
+    def _row(self, config, observable, bx, create=False):
+
+        for i, row in enumerate(self.index['rows']):
+            if (row['config'], row['observable'], row['bx']) == (config, observable, bx):
+                return i
+        if not create:
+            raise KeyError("No counts for {} {} ({}) in {}".format(config, observable, bx, self.path))
+
+        # a new row of zeros at the end of the matrix
+        self._counts = None
+        with open(os.path.join(self.path, "counts.bin"), 'ab') as f:
+            f.write(np.zeros(self.nBins, dtype=np.int64).tobytes())
+        self.index['rows'].append({'config': config, 'observable': observable, 'bx': bx, 'nEvents': 0})
+        self._write()
+        return len(self.index['rows']) - 1
+
+    def keys(self):
+        return [(row['config'], row['observable'], row['bx']) for row in self.index['rows']]
+
+    def __contains__(self, key):
+        return tuple(key) in self.keys()
+
+    def fill(self, config, observable, values, bx='bx0'):
+
+        # add a chunk of background values; missing values count as events that never pass
+        values = hists._values(values)
+        i = self._row(config, observable, bx, create=True)
+        valid = values[~np.isnan(values)]
+        steps = np.clip(np.floor(np.maximum(valid, 0)/self.granularity), 0, self.nBins - 1).astype(np.int64)
+        counts = self._matrix()
+        counts[i] += np.bincount(steps, minlength=self.nBins)
+        counts.flush()
+        self.index['rows'][i]['nEvents'] += len(values)
+        self._write()
+
+    def clear(self, config, observable=None, bx=None):
+
+        # zero the counts of a key (every observable and bx filter of config by default), to fill it again
+        rows = [i for i, row in enumerate(self.index['rows'])
+                if row['config'] == config and observable in (None, row['observable']) and bx in (None, row['bx'])]
+        if not rows:
+            return
+        counts = self._matrix()
+        for i in rows:
+            counts[i] = 0
+            self.index['rows'][i]['nEvents'] = 0
+        counts.flush()
+        self._write()
+
+    def counts(self, config, observable, bx='bx0'):
+        # read-only view of the mapped counts of one key
+        row = self._matrix()[self._row(config, observable, bx)]
+        return row.view(np.ndarray)
+
+    def nEvents(self, config, observable, bx='bx0'):
+        return self.index['rows'][self._row(config, observable, bx)]['nEvents']
+
+    def _survival(self, config, observable, bx):
+        # events at or above each grid threshold k*granularity
+        return np.cumsum(self.counts(config, observable, bx)[::-1])[::-1]
+
+    def _steps(self, thresholds):
+        # first bin at or above each threshold (thresholds off the grid round up, like SortedRates)
+        steps = np.ceil(np.asarray(thresholds, dtype=np.float64)/self.granularity - 1e-9).astype(np.int64)
+        return np.clip(steps, 0, self.nBins)
+
+    def ratesAt(self, config, observable, thresholds, bx='bx0'):
+        survival = np.append(self._survival(config, observable, bx), 0)
+        return survival[self._steps(thresholds)] * (rateEngine.bunchRate/self.nEvents(config, observable, bx))
+
+    def rateErrors(self, config, observable, thresholds, bx='bx0'):
+        survival = np.append(self._survival(config, observable, bx), 0)
+        return np.sqrt(survival[self._steps(thresholds)]) * (rateEngine.bunchRate/self.nEvents(config, observable, bx))
+
+    def solve(self, config, observable, targetRates, bx='bx0'):
+
+        """
+        Lowest grid threshold whose rate does not exceed each target rate (as
+        rates.exactThreshForRate), with the rates it gives and their errors.
+        """
+
+        survival = np.append(self._survival(config, observable, bx), 0)
+        scale = rateEngine.bunchRate/self.nEvents(config, observable, bx)
+        maxCounts = np.floor(np.asarray(targetRates, dtype=np.float64)/scale*(1 + 1e-12))
+
+        # survival is non-increasing: first step with at most maxCounts events left
+        steps = np.searchsorted(-survival, -maxCounts, side='left')
+        counts = survival[steps]
+        return steps*self.granularity, counts*scale, np.sqrt(counts)*scale
+
+    def thresholdTable(self, observable, configs, seedThresholds, bx='bx0'):
+
+        """
+        Fixed rate thresholds of every config for the rates of seedThresholds
+        on the first (reference) config, as (configs x seeds) arrays of the
+        thresholds, the rates they give and their errors, plus the target rates.
+        """
+
+        targets = self.ratesAt(configs[0], observable, seedThresholds, bx)
+        table = {'configs': list(configs), 'seeds': list(seedThresholds), 'targets': targets,
+                 'thresholds': np.zeros((len(configs), len(seedThresholds))), 'rates': np.zeros((len(configs), len(seedThresholds))),
+                 'errors': np.zeros((len(configs), len(seedThresholds)))}
+        for i, config in enumerate(configs):
+            if i == 0:
+                table['thresholds'][i] = seedThresholds
+                table['rates'][i] = targets
+                table['errors'][i] = self.rateErrors(config, observable, seedThresholds, bx)
+            else:
+                table['thresholds'][i], table['rates'][i], table['errors'][i] = self.solve(config, observable, targets, bx)
+        return table
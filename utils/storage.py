@@ -0,0 +1,102 @@
+import os
+import glob
+import hashlib
+
+import awkward as ak
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+import utils.profiling as profiling
+
+
+def samplePath(baseDir, label, sample):
+
+    # hive style partitions: <baseDir>/label=<label>/sample=<sample>/
+    return os.path.join(baseDir, "label=" + label, "sample=" + sample)
+
+
+def _stem(fileName):
+
+    # file name plus a short hash of the full path, so inputs of the same name
+    # in different directories of a sample keep their own parts
+    path = fileName if "://" in fileName else os.path.abspath(fileName)
+    return "{}_{}".format(os.path.splitext(os.path.basename(fileName))[0], hashlib.sha1(path.encode()).hexdigest()[:10])
+
+
+def partPath(baseDir, label, sample, fileName, chunk):
+
+    stem = _stem(fileName)
+    return os.path.join(samplePath(baseDir, label, sample), "{}-{:04d}.parquet".format(stem, chunk))
+
+
+def writeChunk(array, path, row_group_size=100000):
+
+    # plain arrow types (no awkward extension metadata) so any parquet reader
+    # and pyarrow's filter pushdown can use the files
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    ak.to_parquet(array, path + ".tmp", extensionarray=False, row_group_size=row_group_size)
+    os.replace(path + ".tmp", path)
+
+
+def clearSample(baseDir, label, sample, fileName=None):
+
+    # remove the parts of one input file (or of the whole sample) before rewriting them
+    stem = glob.escape(_stem(fileName)) + "-" if fileName else ""
+    for path in glob.glob(os.path.join(samplePath(baseDir, label, sample), stem + "*.parquet")):
+        os.remove(path)
+    if fileName:
+        # parts written before the path hash, keyed on the file name alone
+        legacy = glob.escape(os.path.splitext(os.path.basename(fileName))[0]) + "-[0-9][0-9][0-9][0-9].parquet"
+        for path in glob.glob(os.path.join(samplePath(baseDir, label, sample), legacy)):
+            os.remove(path)
+
+
+def hasFile(baseDir, label, sample, fileName):
+
+    return len(glob.glob(os.path.join(samplePath(baseDir, label, sample), glob.escape(_stem(fileName)) + "-*.parquet"))) > 0
+
+
+def _dataset(baseDir, label, sample):
+
+    return ds.dataset(samplePath(baseDir, label, sample), format="parquet")
+
+
+def _filter(filters):
+
+    # pyarrow expression, or DNF tuples like [('PuppiMET_pt', '>', 50)]
+    if filters is None or isinstance(filters, ds.Expression):
+        return filters
+    return pq.filters_to_expression(filters)
+
+
+def _columns(dataset, columns):
+
+    # like uproot's filter_name, branches that were never stored are skipped
+    if columns is None:
+        return None
+    return [column for column in columns if column in dataset.schema.names]
+
+
+def readArrays(baseDir, label, sample, columns=None, filters=None):
+
+    """
+    Load the stored formatted arrays of one label and sample. Only the requested
+    columns are read, and row groups are skipped using the parquet statistics
+    when filters are given on flat (per event) columns, e.g.
+
+        readArrays(awkDir, 'Default', 'zmu', filters=[('PuppiMET_pt', '>', 50)])
+    """
+
+    dataset = _dataset(baseDir, label, sample)
+    table = dataset.to_table(columns=_columns(dataset, columns), filter=_filter(filters))
+    return ak.from_arrow(table)
+
+
+def iterArrays(baseDir, label, sample, columns=None, filters=None, batch_size=1000000):
+
+    # same as readArrays, in batches of at most batch_size events
+    dataset = _dataset(baseDir, label, sample)
+    for batch in dataset.to_batches(columns=_columns(dataset, columns), filter=_filter(filters), batch_size=batch_size):
+        if batch.num_rows:
+            profiling.count(events=batch.num_rows, bytes=batch.nbytes)
+            yield ak.from_arrow(batch)
@@ -0,0 +1,408 @@
+import os
+import glob
+import json
+import pickle
+import inspect
+import hashlib
+
+import utils.tools as tools
+import utils.hists as hists
+import utils.cache as cache
+import utils.storage as storage
+import utils.plotting as plotting
+import utils.observables as observables
+import utils.planning as planning
+import utils.ratestore as ratestore
+import utils.turnons as turnons
+import utils.bootstrap as bootstrap
+import utils.profiling as profiling
+import utils.summary as summary
+
+
+# settings of a study file that are optional, with the values the scripts use
+defaults = {
+    'writeDir': "./data/",
+    'plotDir': "./plots/",
+    'input': {'format': 'nano', 'rootDir': "", 'fileName': "*.root", 'sigName': "sig", 'bkgName': "bkg", 'offlineCut': None},
+    'rates': {'bins': 200, 'range': [0, 200], 'granularity': 0.5},
+    'efficiency': {'binwidth': 10, 'xmax': 400, 'errorType': 'bayes', 'fit': 'erf'},
+    'distribution': {'bins': 100, 'range': [0, 200]},
+    'resolution': {'bins': 80, 'range': [-100, 100]},
+    'bootstrap': {'replicas': 0, 'seed': 0, 'cl': 0.68},
+    'extract': {'stepSize': "100 MB", 'chunkSize': 1000000, 'nWorkers': None, 'cacheSize': 20e9, 'lazy': False, 'prefetch': None,
+                'store': 'hdf5', 'compression': None},
+    'plots': {'name': None, 'l1Label': None, 'offlineLabel': None, 'resLabel': None, 'distributions': []},
+}
+
+
+def _merge(values, default):
+
+    # nested dicts are merged, anything else in the file replaces the default
+    if isinstance(default, dict) and isinstance(values, dict):
+        return {key: _merge(values.get(key), default.get(key)) if key in default else values[key]
+                for key in list(default) + [key for key in values if key not in default]}
+    return default if values is None else values
+
+
+def _parse(fileName):
+
+    with open(fileName, 'rb') as f:
+        if fileName.endswith('.toml'):
+            try:
+                import tomllib
+            except ImportError:
+                import tomli as tomllib
+            return tomllib.load(f)
+        import yaml
+        return yaml.safe_load(f)
+
+
+def loadStudy(fileName):
+
+    """
+    Read a study definition (.yaml/.yml or .toml), fill in the defaults and
+    check it. See studies/ for examples. The first entry of 'configs' is the
+    "default" one whose thresholds fix the rates.
+    """
+
+    study = _merge(_parse(fileName), defaults)
+
+    for key in ('name', 'configs', 'observables', 'thresholds'):
+        if not study.get(key):
+            raise ValueError("Study {} has no '{}'".format(fileName, key))
+    for config in study['configs']:
+        missing = [key for key in ('label', 'branchType', 'sig', 'bkg') if key not in config]
+        if missing:
+            raise ValueError("Config {} of study {} has no {}".format(config, fileName, missing))
+        if config['branchType'] not in ('unp', 'emu'):
+            raise ValueError("Unknown branchType: " + str(config['branchType']))
+    for key in ('l1', 'offline'):
+        if study['observables'].get(key) not in observables.observables:
+            raise ValueError("Unknown {} observable: {}".format(key, study['observables'].get(key)))
+    for name in study['plots']['distributions']:
+        if name not in observables.observables:
+            raise ValueError("Unknown observable in plots.distributions: {}".format(name))
+    if study['input']['format'] not in ('nano', 'hdf5', 'parquet'):
+        raise ValueError("Unknown input format: " + str(study['input']['format']))
+    if study['efficiency']['fit'] not in (None,) + tuple(turnons.models):
+        raise ValueError("Unknown turn-on model: " + str(study['efficiency']['fit']))
+    if study['extract']['store'] not in ('hdf5', 'columns'):
+        raise ValueError("Unknown intermediate store: " + str(study['extract']['store']))
+
+    study['extract']['cacheSize'] = None if study['extract']['cacheSize'] is None else float(study['extract']['cacheSize'])
+    plots = study['plots']
+    plots['name'] = plots['name'] or study['name']
+    plots['l1Label'] = plots['l1Label'] or "{} [GeV]".format(study['observables']['l1'])
+    plots['offlineLabel'] = plots['offlineLabel'] or "{} [GeV]".format(study['observables']['offline'])
+    plots['resLabel'] = plots['resLabel'] or "{} - {} [GeV]".format(study['observables']['l1'], study['observables']['offline'])
+
+    return study
+
+
+def _labels(study):
+    return [config['label'] for config in study['configs']]
+
+
+def _hdf5s(study, sample):
+    name = study['input'][sample + 'Name']
+    # hdf5 intermediates, or memory-mapped column stores (utils.summary) with store: columns
+    ext = ".cols" if study['extract']['store'] == 'columns' else ".hdf5"
+    return [os.path.join(study['writeDir'], name + label + ext) for label in _labels(study)]
+
+
+def _observables(study):
+    # the observables the study uses, the only ones extracted
+    names = [study['observables']['l1'], study['observables']['offline']] + list(study['plots']['distributions'])
+    return [name for i, name in enumerate(names) if name not in names[:i]]
+
+
+def _plan(study, config, fileList, sample):
+    return planning.plan(fileList, sample, _observables(study), config['branchType'] == 'emu')
+
+
+# stages, in order. Each takes the study and the outputs of the stages it depends on
+
+def globFiles(study, inputs):
+
+    # input files of every config and sample (nano files, parquet parts or the
+    # hdf5 intermediates, by input format), with their size and mtime so new,
+    # removed or rewritten files change the output
+    fmt = study['input']['format']
+    awkDir = os.path.join(study['writeDir'], "awk/")
+    files = {}
+    for sample in ('sig', 'bkg'):
+        name = study['input'][sample + 'Name']
+        if fmt == 'nano':
+            patterns = [study['input']['rootDir'] + config[sample] + study['input']['fileName'] for config in study['configs']]
+        elif fmt == 'parquet':
+            patterns = [os.path.join(storage.samplePath(awkDir, label, name), "*.parquet") for label in _labels(study)]
+        else:
+            patterns = _hdf5s(study, sample)
+        files[sample] = [sorted(glob.glob(pattern)) for pattern in patterns]
+    files['stats'] = {fileName: cache._fileStat(fileName) for sample in ('sig', 'bkg') for fileList in files[sample] for fileName in fileList}
+
+    return files
+
+
+def extract(study, inputs):
+
+    # per-event observables of every file into one hdf5 intermediate per
+    # config and sample, through the per-file cache (nano), or re-derived from the
+    # parquet store (parquet). Existing intermediates are used as they are (hdf5)
+    files = inputs['glob']
+    params = study['extract']
+    awkDir = os.path.join(study['writeDir'], "awk/")
+    cacheDir = os.path.join(study['writeDir'], "cache/")
+    offlineCut = study['input']['offlineCut']
+    os.makedirs(study['writeDir'], exist_ok=True)
+
+    for sample, offline in (('sig', True), ('bkg', False)):
+        name = study['input'][sample + 'Name']
+        for fileList, hdf5, config in zip(files[sample], _hdf5s(study, sample), study['configs']):
+            label = config['label']
+
+            if study['input']['format'] == 'nano':
+                if not fileList:
+                    print("No {} files found for {}".format(sample, label))
+                with profiling.stage('extract', label + "/" + name), summary.openStore(hdf5, 'w', params['compression']) as store:
+                    archive = None if params['lazy'] else (awkDir, label, name)
+                    names, branchList = _plan(study, config, fileList, sample)
+                    for df in cache.extractFiles(fileList, branchList, observables.makeTable, (names, offline),
+                                                 cacheDir, params['cacheSize'], params['nWorkers'], params['stepSize'], archive, params['lazy'], params['prefetch']):
+                        with profiling.stage('hdf5', label + "/" + name):
+                            summary.append(store, label, summary.encode(df))
+
+            elif study['input']['format'] == 'parquet':
+                names, branchList = _plan(study, config, [], sample)
+                columns = [tools.formatName(branch) for branch in branchList]
+                filters = [tuple(offlineCut)] if offline and offlineCut is not None else None
+                with profiling.stage('extract', label + "/" + name), summary.openStore(hdf5, 'w', params['compression']) as store:
+                    for arrays in storage.iterArrays(awkDir, label, name, columns, filters, params['chunkSize']):
+                        summary.append(store, label, summary.encode(observables.makeTable(arrays, names, offline)))
+
+    return {'sig': _hdf5s(study, 'sig'), 'bkg': _hdf5s(study, 'bkg'), 'files': _hdf5s(study, 'sig') + _hdf5s(study, 'bkg')}
+
+
+def _rateStore(study):
+    return os.path.join(study['writeDir'], "study", study['name'], "rateStore")
+
+
+def rates(study, inputs):
+
+    # background rate histograms of the L1 observable (for the plots) and the
+    # counts on the hardware steps of every L1 observable (for the thresholds),
+    # one per config, the counts in the study's rate store (utils.ratestore)
+    rateHists = []
+    store = ratestore.RateStore(_rateStore(study), study['rates']['granularity'])
+    for hdf5, label in zip(inputs['extract']['bkg'], _labels(study)):
+        rateHist = hists.RateHist(study['rates']['bins'], study['rates']['range'])
+        store.clear(label)
+        for df in tools.iterHdf(hdf5, label, study['extract']['chunkSize']):
+            rateHist.fill(df[study['observables']['l1']])
+            for name in df.columns:
+                if summary.encodings.get(name) == 'hw':
+                    store.fill(label, name, df[name])
+        rateHists.append(rateHist)
+
+    return {'hists': rateHists, 'store': store.path, 'files': [os.path.join(store.path, "index.json")]}
+
+
+def thresholds(study, inputs):
+
+    # the default config keeps the study thresholds, the others get the
+    # thresholds giving the same rates, solved exactly on the hardware steps
+    store = ratestore.RateStore(inputs['rates']['store'], study['rates']['granularity'])
+    table = store.thresholdTable(study['observables']['l1'], _labels(study), study['thresholds'])
+
+    for label, thresholdList, achieved, errors in list(zip(_labels(study), table['thresholds'], table['rates'], table['errors']))[1:]:
+        for threshold, target, rate, error in zip(thresholdList, table['targets'], achieved, errors):
+            print("{} > {:g}: {:.0f} +- {:.0f} Hz (target {:.0f} Hz)".format(label, threshold, rate, error, target))
+
+    return {'rates': table['targets'].tolist(), 'thresholds': [list(study['thresholds'])] + table['thresholds'][1:].tolist(),
+            'achieved': table['rates'].tolist(), 'errors': table['errors'].tolist()}
+
+
+def efficiencies(study, inputs):
+
+    # signal distributions, resolutions and efficiencies at the fixed rate thresholds
+    l1, offline = study['observables']['l1'], study['observables']['offline']
+    dist, res, eff = study['distribution'], study['resolution'], study['efficiency']
+    offlineHists = {name: hists.Hist(dist['bins'], dist['range']) for name in study['plots']['distributions']}
+    l1Hists, resHists, effHists = [], [], []
+
+    for i, (hdf5, label, thresholdList) in enumerate(zip(inputs['extract']['sig'], _labels(study), inputs['thresholds']['thresholds'])):
+        l1Hist = hists.Hist(dist['bins'], dist['range'])
+        resHist = hists.ResHist(res['bins'], res['range'])
+        effHist = hists.EffHist(thresholdList, eff['binwidth'], eff['xmax'])
+        for df in tools.iterHdf(hdf5, label, study['extract']['chunkSize']):
+            if i == 0:
+                for name, hist in offlineHists.items():
+                    hist.fill(df[name])
+            l1Hist.fill(df[l1])
+            resHist.fill(df[l1], df[offline])
+            effHist.fill(df[l1], df[offline])
+        l1Hists.append(l1Hist)
+        resHists.append(resHist)
+        effHists.append(effHist)
+
+    return {'offline': offlineHists, 'l1': l1Hists, 'res': resHists, 'eff': effHists}
+
+
+def turnOns(study, inputs):
+
+    # turn-on fits of every (config, threshold) efficiency curve, as a table also written to writeDir
+    model = study['efficiency']['fit']
+    if model is None:
+        return {'table': None}
+    table = turnons.fitEffHists(inputs['efficiencies']['eff'], _labels(study), model)
+    path = os.path.join(study['writeDir'], study['name'] + "_turnOns.csv")
+    table.to_csv(path, index=False)
+    print(table[['label', 'threshold', 'plateau', 'x50', 'x50Err', 'x95', 'x95Err', 'width', 'converged', 'atBound']].to_string(index=False))
+
+    return {'table': table, 'files': [path]}
+
+
+def bootstrapBands(study, inputs):
+
+    # Poisson bootstrap bands of the fixed rate thresholds, rates and efficiencies
+    # (utils.bootstrap), as a table also written to writeDir; off with 0 replicas
+    params = study['bootstrap']
+    if not params['replicas']:
+        return {'table': None, 'eff': None}
+    eff = study['efficiency']
+    table, effBands = bootstrap.fixedRateBootstrap(inputs['extract']['bkg'], inputs['extract']['sig'], _labels(study), study['observables']['l1'],
+                                                   study['observables']['offline'], study['thresholds'], params['replicas'], study['rates']['granularity'],
+                                                   eff['binwidth'], eff['xmax'], chunkSize=study['extract']['chunkSize'], seed=params['seed'], cl=params['cl'])
+    path = os.path.join(study['writeDir'], study['name'] + "_bootstrap.csv")
+    table.to_csv(path, index=False)
+    print(table.to_string(index=False))
+
+    return {'table': table, 'eff': effBands, 'files': [path]}
+
+
+def plots(study, inputs):
+
+    labels = _labels(study)
+    params = study['plots']
+    sigHists = inputs['efficiencies']
+    os.makedirs(study['plotDir'], exist_ok=True)
+
+    def path(suffix):
+        return os.path.join(study['plotDir'], params['name'] + suffix + ".pdf")
+
+    plotting.plotHists(list(sigHists['offline'].values()) + sigHists['l1'], list(sigHists['offline']) + labels, params['l1Label'], path(""), log=True)
+    plotting.plotHists(sigHists['res'], [label + " Diff" for label in labels], params['resLabel'], path("_res"), fill=True)
+    plotting.plotRates(inputs['rates']['hists'], labels, params['l1Label'], path("_rates"))
+    plotting.plotEfficiencies(sigHists['eff'], labels, params['offlineLabel'], path("_eff"), study['efficiency']['errorType'],
+                               inputs['turnOns']['table'], inputs['bootstrap']['eff'])
+
+    return {'files': [path(suffix) for suffix in ("", "_res", "_rates", "_eff")]}
+
+
+# name -> (function, upstream stages, study settings it reads, modules whose code it runs)
+stages = {
+    'glob':         (globFiles,    (),                                     ('input', 'configs'),                                  ()),
+    'extract':      (extract,      ('glob',),                              ('input', 'configs', 'observables', 'plots.distributions', 'writeDir', 'extract.stepSize', 'extract.lazy', 'extract.store', 'extract.compression'),  (observables.makeTable, cache.extractFiles, planning.plan, summary.encode, summary.append)),
+    'rates':        (rates,        ('extract',),                           ('observables.l1', 'rates'),                           (hists.RateHist, ratestore.RateStore)),
+    'thresholds':   (thresholds,   ('rates',),                             ('thresholds',),                                       (ratestore.RateStore,)),
+    'efficiencies': (efficiencies, ('extract', 'thresholds'),              ('observables', 'efficiency', 'distribution', 'resolution', 'plots.distributions'), (hists.Hist, hists.ResHist, hists.EffHist)),
+    'turnOns':      (turnOns,      ('efficiencies',),                      ('efficiency.fit',),                                   (turnons.fitEffHists,)),
+    'bootstrap':    (bootstrapBands, ('extract',),                         ('bootstrap', 'observables', 'thresholds', 'rates.granularity', 'efficiency.binwidth', 'efficiency.xmax'), (bootstrap.fixedRateBootstrap,)),
+    'plots':        (plots,        ('rates', 'thresholds', 'efficiencies', 'turnOns', 'bootstrap'), ('plots', 'plotDir', 'efficiency.errorType'), (plotting.plotHists, plotting.plotRates, plotting.plotEfficiencies)),
+}
+
+# stages always run, their outputs (not their settings) decide what follows
+volatile = ('glob',)
+
+
+def _setting(study, key):
+
+    # dotted keys pick one setting of a section
+    value = study
+    for part in key.split('.'):
+        value = value[part]
+    return value
+
+
+def _hash(obj):
+    return hashlib.sha1(json.dumps(obj, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _stageKey(study, name, upstreamKeys):
+
+    func, deps, settings, code = stages[name]
+    return _hash([name, {key: _setting(study, key) for key in settings}, [upstreamKeys[dep] for dep in deps],
+                  inspect.getsource(func), [cache._sourceHash(obj) for obj in code]])
+
+
+def _statePath(study, name):
+    return os.path.join(study['writeDir'], "study", study['name'], name + ".pkl")
+
+
+def _loadState(study, name):
+
+    path = _statePath(study, name)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def _storeState(study, name, key, output):
+
+    path = _statePath(study, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + ".tmp", 'wb') as f:
+        pickle.dump({'key': key, 'output': output}, f)
+    os.replace(path + ".tmp", path)
+
+
+def _downstream(names):
+
+    # the given stages and every stage depending on them
+    names = set(names)
+    for name, (_, deps, _, _) in stages.items():
+        if names.intersection(deps):
+            names.add(name)
+    return names
+
+
+def run(study, force=(), until=None):
+
+    """
+    Run the stages of a study in order. A stage is skipped, and its stored
+    output reused, when its settings, code and upstream stages are unchanged
+    and the files it wrote still exist, e.g. changing the thresholds reruns
+    only thresholds, efficiencies and plots. Stages in force (and those after
+    them) always run, and nothing after until is run. Returns the outputs.
+    """
+
+    forced = _downstream(force)
+    keys, outputs = {}, {}
+
+    for name, (func, deps, _, _) in stages.items():
+        inputs = {dep: outputs[dep] for dep in deps}
+        state = _loadState(study, name)
+
+        if name in volatile:
+            output = func(study, inputs)
+            keys[name] = _hash([name, output])
+            if state is None or state['key'] != keys[name]:
+                _storeState(study, name, keys[name], output)
+        else:
+            keys[name] = _stageKey(study, name, keys)
+            if name not in forced and state is not None and state['key'] == keys[name] \
+                    and all(os.path.exists(path) for path in (state['output'].get('files', []) if isinstance(state['output'], dict) else [])):
+                print("Stage {}: unchanged, skipped".format(name))
+                output = state['output']
+            else:
+                print("Stage {}: running".format(name))
+                with profiling.stage(name):
+                    output = func(study, inputs)
+                _storeState(study, name, keys[name], output)
+
+        outputs[name] = output
+        if name == until:
+            break
+
+    return outputs
@@ -0,0 +1,242 @@
+import os
+import json
+
+import numpy as np
+import pandas as pd
+
+
+# compact storage of the per-event summary tables (hdf5 intermediates, the
+# per-file cache and the column store): column name -> encoding, filled by
+# observables.register. Columns without one are stored as they are.
+#   'hw'      L1 values on the hardware steps, as the number of steps (uint16,
+#             up to 32767 GeV in 0.5 GeV steps), missing values as the top code.
+#             Values off the steps or out of range are kept as float32 instead
+#   'float32' offline values, whose precision is far below the binning
+encodings = {}
+
+hwStep = 0.5
+hwDtype = np.dtype(np.uint16)
+hwMissing = np.iinfo(np.uint16).max
+
+
+def encodeColumn(values, encoding):
+
+    values = np.asarray(values)
+    if encoding == 'float32':
+        return values.astype(np.float32, copy=False)
+
+    if encoding == 'hw':
+        if values.dtype == hwDtype:
+            return values
+        steps = values/hwStep
+        missing = np.isnan(steps)
+        valid = steps[~missing]
+        if np.any(valid != np.round(valid)) or np.any(valid < 0) or np.any(valid >= hwMissing):
+            return values.astype(np.float32)
+        return np.where(missing, hwMissing, np.nan_to_num(steps)).astype(hwDtype)
+
+    raise ValueError("Unknown encoding: " + str(encoding))
+
+
+def decodeColumn(values, encoding):
+
+    # GeV as float32 (float64 and older files are left as they are)
+    values = np.asarray(values)
+    if encoding == 'hw' and values.dtype == hwDtype:
+        decoded = values.astype(np.float32)*np.float32(hwStep)
+        decoded[values == hwMissing] = np.nan
+        return decoded
+    return values
+
+
+def encode(df):
+
+    # compact copy of a summary table, columns without an encoding unchanged
+    encoded = pd.DataFrame({name: encodeColumn(df[name], encodings[name]) if name in encodings else df[name].to_numpy() for name in df.columns},
+                           index=df.index)
+    encoded.attrs = dict(df.attrs)
+    return encoded
+
+
+def decode(df):
+
+    for name in df.columns:
+        if name in encodings:
+            df[name] = decodeColumn(df[name].to_numpy(), encodings[name])
+    return df
+
+
+def _widen(values):
+
+    # 'hw' column as float32 GeV, whether it was on the steps or not
+    return decodeColumn(np.asarray(values), 'hw').astype(np.float32, copy=False)
+
+
+def append(store, key, df):
+
+    """
+    store.append of an encoded chunk (encode()) for an HDFStore or ColumnStore.
+    A 'hw' column that fell back to float32 in this chunk or an earlier one is
+    widened to float32 in both, so the store keeps one dtype per column and
+    its dtype (table or schema) records which encoding was used.
+    """
+
+    if isinstance(store, ColumnStore):
+        stored = store.dtypes(key)
+    else:
+        stored = store.select(key, stop=0).dtypes.to_dict() if key in store else {}
+
+    df = df.copy(deep=False)
+    for name in df.columns:
+        if encodings.get(name) != 'hw':
+            continue
+        dtype = np.dtype(stored[name]) if name in stored else None
+        if df[name].dtype == np.float32 and dtype != np.float32:
+            print("{} is off the {} GeV hardware steps, stored as float32".format(name, hwStep))
+            if dtype == hwDtype:
+                _widenStored(store, key, name)
+        elif df[name].dtype == hwDtype and dtype == np.float32:
+            df[name] = _widen(df[name])
+
+    store.append(key, df, index=False)
+
+
+def _widenStored(store, key, name):
+
+    # rewrite what was stored of a column on the steps as float32, once per column
+    if isinstance(store, ColumnStore):
+        store.widen(key, name)
+        return
+    df = store.select(key)
+    df[name] = _widen(df[name])
+    store.remove(key)
+    store.append(key, df, index=False)
+
+
+def hdfOptions(compression=None):
+
+    # HDFStore options for a compression like 'blosc:zstd' or 'zlib', optionally with a level ('blosc:zstd:5')
+    if not compression:
+        return {}
+    complib, _, level = compression.rpartition(':') if compression.rsplit(':', 1)[-1].isdigit() else (compression, None, None)
+    return {'complib': complib, 'complevel': int(level) if level else 5}
+
+
+class ColumnStore:
+
+    """
+    Directory of raw little-endian column files (<path>/<key>/<column>.bin)
+    with a schema (<key>/schema.json), read back memory-mapped so a rate scan
+    only pages in the columns it uses, e.g. ~200 MB per 'hw' column for 10^8
+    events. Same append/context manager use as pd.HDFStore, the columns are
+    written as they are given (encoded with encode()):
+
+        with summary.openStore("data/zbDefault.cols", 'w') as store:
+            summary.append(store, 'Default', summary.encode(df))
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.mode = mode
+        self.schemas = {}
+        if mode == 'w':
+            if os.path.isdir(path):
+                self._clear()
+            os.makedirs(path, exist_ok=True)
+
+    def _clear(self):
+
+        # remove an earlier store at path, only the files its schemas list; anything
+        # else there (e.g. a mistyped path) is left alone and refused
+        keys = os.listdir(self.path)
+        foreign = [key for key in keys if not os.path.isfile(os.path.join(self.path, key, "schema.json"))]
+        if foreign:
+            raise ValueError("{} is not a column store (no schema for {}), not overwriting it".format(self.path, foreign))
+        for key in keys:
+            directory = os.path.join(self.path, key)
+            with open(os.path.join(directory, "schema.json")) as f:
+                columns = json.load(f)['columns']
+            for name in list(columns) + ["schema"]:
+                fileName = os.path.join(directory, name + (".json" if name == "schema" else ".bin"))
+                if os.path.exists(fileName):
+                    os.remove(fileName)
+            if not os.listdir(directory):
+                os.rmdir(directory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def append(self, key, df, index=False):
+
+        directory = os.path.join(self.path, key)
+        schema = self.schemas.get(key)
+        if schema is None:
+            os.makedirs(directory, exist_ok=True)
+            schema = self.schemas[key] = {'columns': {name: df[name].dtype.newbyteorder('<').str for name in df.columns}, 'nEvents': 0}
+            # written now as well, so a store left unclosed can still be overwritten
+            self._writeSchema(key)
+        if list(df.columns) != list(schema['columns']):
+            raise ValueError("Columns {} don't match those of {}/{}: {}".format(list(df.columns), self.path, key, list(schema['columns'])))
+
+        for name, dtype in schema['columns'].items():
+            with open(os.path.join(directory, name + ".bin"), 'ab') as f:
+                f.write(np.ascontiguousarray(df[name].to_numpy(), dtype=dtype).tobytes())
+        schema['nEvents'] += len(df)
+
+    def dtypes(self, key):
+
+        # column dtypes of key written so far through this store, {} before the first append
+        schema = self.schemas.get(key)
+        return {name: np.dtype(dtype) for name, dtype in schema['columns'].items()} if schema else {}
+
+    def widen(self, key, name, chunksize=1000000):
+
+        # rewrite a 'hw' column on the steps as float32 GeV, in chunks
+        schema = self.schemas[key]
+        fileName = os.path.join(self.path, key, name + ".bin")
+        values = np.memmap(fileName, dtype=np.dtype(schema['columns'][name]), mode='r', shape=(schema['nEvents'],)) if schema['nEvents'] else np.empty(0, dtype=hwDtype)
+        with open(fileName + ".tmp", 'wb') as f:
+            for start in range(0, len(values), chunksize):
+                f.write(np.ascontiguousarray(_widen(values[start:start + chunksize]), dtype='<f4').tobytes())
+        del values
+        os.replace(fileName + ".tmp", fileName)
+        schema['columns'][name] = np.dtype('<f4').str
+        self._writeSchema(key)
+
+    def _writeSchema(self, key):
+        with open(os.path.join(self.path, key, "schema.json"), 'w') as f:
+            json.dump(self.schemas[key], f)
+
+    def close(self):
+        for key in self.schemas:
+            self._writeSchema(key)
+        self.schemas = {}
+
+    def columns(self, key, names=None):
+
+        # memory-mapped (encoded) columns of key
+        with open(os.path.join(self.path, key, "schema.json")) as f:
+            schema = json.load(f)
+        return {name: np.memmap(os.path.join(self.path, key, name + ".bin"), dtype=np.dtype(dtype), mode='r', shape=(schema['nEvents'],))
+                if schema['nEvents'] else np.empty(0, dtype=np.dtype(dtype))
+                for name, dtype in schema['columns'].items() if names is None or name in names}
+
+
+def openStore(path, mode='r', compression=None):
+
+    # HDFStore for .hdf5/.h5 paths (compressed with compression if given), ColumnStore otherwise
+    if os.path.splitext(path)[1] in ('.hdf5', '.h5'):
+        return pd.HDFStore(path, mode=mode, **hdfOptions(compression))
+    return ColumnStore(path, mode)
+
+
+def iterColumns(path, key, chunksize=1000000, columns=None):
+
+    # decoded dataframe chunks of a ColumnStore, paged in from the memory maps
+    mapped = ColumnStore(path).columns(key, columns)
+    nEvents = len(next(iter(mapped.values()))) if mapped else 0
+    for start in range(0, nEvents, chunksize):
+        yield decode(pd.DataFrame({name: np.asarray(values[start:start + chunksize]) for name, values in mapped.items()}))
@@ -0,0 +1,157 @@
+import os
+
+import numpy as np
+import awkward as ak
+import uproot
+
+import utils.branches as branches
+
+
+# L1 branch prefixes written by default: unpacked and emulated, so both branch types work
+l1Types = ('L1', 'L1Emul')
+
+# bunch crossings of the L1 objects and sums kept in the nano files
+bxRange = (-2, 2)
+
+
+def _jagged(counts, values, dtype=np.float32):
+    return ak.unflatten(np.asarray(values, dtype=dtype), counts)
+
+
+def _quantise(pt, step=0.5):
+    # L1 hardware pt steps
+    return np.floor(pt/step)*step
+
+
+def _vectorSum(counts, pt, phi):
+
+    # per event x/y sums of a flat (counts-grouped) collection
+    event = np.repeat(np.arange(len(counts)), counts)
+    px = np.bincount(event, pt*np.cos(phi), minlength=len(counts))
+    py = np.bincount(event, pt*np.sin(phi), minlength=len(counts))
+    return px, py
+
+
+def makeEvents(nEvents, kind='sig', meanJets=6, meanMuons=2, meanPileupJets=4, seed=0):
+
+    """
+    NanoAOD-like arrays for nEvents events, as a dict of branch collections
+    for uproot's mktree ({'Jet': record array, 'PuppiMET_pt': array, ...}).
+
+    kind='sig' gives Z->mumu-like events with offline Jet_*, Muon_* and
+    PuppiMET_* and the L1 objects built from them (L1 jets are the offline
+    jets smeared and put on the 0.5 GeV hardware steps, plus pile-up jets and
+    out-of-time copies, the L1 sums are computed from the L1 jets).
+    kind='bkg' gives zero bias-like RAW-only events: softer jets and only the
+    L1 branches. Multiplicities are Poisson with the given means.
+    """
+
+    rng = np.random.default_rng(seed)
+    signal = kind == 'sig'
+    events = {}
+
+    # offline jets, steeply falling pt
+    nJets = rng.poisson(meanJets if signal else meanJets/3, nEvents)
+    total = nJets.sum()
+    jetPt = 15 + rng.pareto(3.0, total)*(40 if signal else 15)
+    jetEta = rng.uniform(-4.7, 4.7, total)
+    jetPhi = rng.uniform(-np.pi, np.pi, total)
+
+    # muons, isolated and mostly PF candidates
+    nMuons = rng.poisson(meanMuons, nEvents) if signal else np.zeros(nEvents, dtype=np.int64)
+    muPt = 20 + rng.exponential(25, nMuons.sum())
+    muPhi = rng.uniform(-np.pi, np.pi, nMuons.sum())
+
+    if signal:
+        events['Jet'] = ak.zip({'pt': _jagged(nJets, jetPt), 'eta': _jagged(nJets, jetEta), 'phi': _jagged(nJets, jetPhi)})
+        events['Muon'] = ak.zip({'pt': _jagged(nMuons, muPt), 'phi': _jagged(nMuons, muPhi),
+                                 'isPFcand': _jagged(nMuons, rng.random(nMuons.sum()) < 0.95, bool)})
+
+        # MET balances the jets and muons, with some resolution
+        jx, jy = _vectorSum(nJets, jetPt, jetPhi)
+        mx, my = _vectorSum(nMuons, muPt, muPhi)
+        metx, mety = -(jx + mx) + rng.normal(0, 10, nEvents), -(jy + my) + rng.normal(0, 10, nEvents)
+        events['PuppiMET_pt'] = np.hypot(metx, mety).astype(np.float32)
+        events['PuppiMET_phi'] = np.arctan2(mety, metx).astype(np.float32)
+
+    for l1Type in l1Types:
+
+        # in-time L1 jets from the offline ones (inside the calorimeter), plus pile-up jets
+        nPileup = rng.poisson(meanPileupJets, nEvents)
+        pt = np.concatenate([jetPt*rng.normal(1, 0.2, total), 5 + rng.exponential(10, nPileup.sum())])
+        eta = np.concatenate([jetEta + rng.normal(0, 0.05, total), rng.uniform(-5, 5, nPileup.sum())])
+        phi = np.concatenate([jetPhi + rng.normal(0, 0.05, total), rng.uniform(-np.pi, np.pi, nPileup.sum())])
+        event = np.concatenate([np.repeat(np.arange(nEvents), nJets), np.repeat(np.arange(nEvents), nPileup)])
+        bx = np.zeros(len(pt), dtype=np.int32)
+
+        # out of time copies of some of the jets
+        oot = rng.random(len(pt)) < 0.1
+        pt = np.concatenate([pt, pt[oot]*rng.uniform(0.2, 1, oot.sum())])
+        eta, phi = np.concatenate([eta, eta[oot]]), np.concatenate([phi, phi[oot]])
+        event = np.concatenate([event, event[oot]])
+        bx = np.concatenate([bx, rng.choice([-2, -1, 1, 2], oot.sum()).astype(np.int32)])
+
+        pt = _quantise(np.maximum(pt, 0))
+        phi = (phi + np.pi) % (2*np.pi) - np.pi
+        keep = (pt > 0) & (np.abs(eta) < 5)
+        order = np.lexsort((-pt[keep], event[keep]))
+        event, pt, eta, phi, bx = (a[keep][order] for a in (event, pt, eta, phi, bx))
+        counts = np.bincount(event, minlength=nEvents)
+
+        events[l1Type + 'Jet'] = ak.zip({'pt': _jagged(counts, pt), 'eta': _jagged(counts, eta), 'phi': _jagged(counts, phi),
+                                         'bx': _jagged(counts, bx, np.int32)})
+
+        # sums of every type and bunch crossing; in time ht/mht/met from the L1 jets
+        inTime = bx == 0
+        central = inTime & (np.abs(eta) < 2.4) & (pt > 30)
+        ht = np.bincount(event[central], pt[central], minlength=nEvents)
+        hx, hy = _vectorSum(np.bincount(event[central], minlength=nEvents), pt[central], phi[central])
+        ex, ey = _vectorSum(np.bincount(event[inTime], minlength=nEvents), pt[inTime], phi[inTime])
+        ett = np.bincount(event[inTime], pt[inTime], minlength=nEvents)
+
+        sumTypes = np.array(sorted(branches.sums.values()), dtype=np.int32)
+        bxs = np.arange(bxRange[0], bxRange[1] + 1, dtype=np.int32)
+        values = rng.exponential(20, (nEvents, len(bxs), len(sumTypes)))
+        known = {'ett': ett, 'htt': ht, 'mht': np.hypot(hx, hy), 'met': np.hypot(ex, ey)*0.9, 'methf': np.hypot(ex, ey),
+                 'htx': hx, 'hty': hy, 'etx': ex, 'ety': ey}
+        for name, value in known.items():
+            values[:, bxs == 0, branches.sums[name]] = value[:, None]
+
+        nSums = np.full(nEvents, len(bxs)*len(sumTypes))
+        events[l1Type + 'EtSum'] = ak.zip({'pt': _jagged(nSums, _quantise(np.abs(values)).ravel()),
+                                           'etSumType': _jagged(nSums, np.tile(sumTypes, nEvents*len(bxs)), np.int32),
+                                           'bx': _jagged(nSums, np.tile(np.repeat(bxs, len(sumTypes)), nEvents), np.int32)})
+
+    return events
+
+
+def writeNano(fileName, nEvents, kind='sig', batchSize=100000, seed=0, **options):
+
+    """
+    Write a synthetic nano file with an 'Events' TTree (nJet, Jet_pt, ...,
+    L1EmulEtSum_pt, ...), generated and written batchSize events at a time so
+    large files don't need the whole sample in memory. options go to makeEvents.
+    """
+
+    os.makedirs(os.path.dirname(os.path.abspath(fileName)), exist_ok=True)
+    with uproot.recreate(fileName) as f:
+        for i, start in enumerate(range(0, nEvents, batchSize)):
+            events = makeEvents(min(batchSize, nEvents - start), kind, seed=seed*100003 + i, **options)
+            if i == 0:
+                f.mktree('Events', {name: value.type if isinstance(value, ak.Array) else value.dtype for name, value in events.items()})
+            f['Events'].extend(events)
+
+    return fileName
+
+
+def makeSample(directory, nFiles, nEvents, kind='sig', seed=0, **options):
+
+    # nFiles files nano_<i>.root of nEvents events each, skipping files already there
+    fileNames = []
+    for i in range(nFiles):
+        fileName = os.path.join(directory, "nano_{}.root".format(i))
+        if not os.path.exists(fileName):
+            writeNano(fileName + ".tmp", nEvents, kind, seed=seed*1000 + i, **options)
+            os.replace(fileName + ".tmp", fileName)
+        fileNames.append(fileName)
+    return fileNames
@@ -1,7 +1,13 @@
+import os
 import numpy as np
 import pandas as pd
 import awkward as ak
 import utils.branches as branches
+import utils.matching as matching
+import utils.storage as storage
+import utils.prefetch as prefetching
+import utils.profiling as profiling
+import utils.summary as summary
 import uproot
 
 
@@ -11,18 +17,82 @@ def deltaR(eta1, phi1, eta2, phi2):
     deta = eta1 - eta2
     return np.sqrt(deta**2 + dphi**2)
 
-def getArrays(inputFiles, branches, nFiles=1, fname="data.parquet"):
+def getArrays(inputFiles, branches, nFiles=1, fname=None, step_size="100 MB", stream=False, prefetch=None):
+
+    # stream=True gives a generator of formatted chunks of step_size,
+    # prefetch (options of prefetch.iterTrees, e.g. {'ahead': 2}) reads the next files ahead
+    if stream:
+        return iterArrays(inputFiles, branches, nFiles, step_size, prefetch)
 
     files = [{file: 'Events'} for file in inputFiles][:nFiles]
 
     # get the data
-    data = ak.concatenate([batch for batch in uproot.iterate(files, filter_name=branches)])
-        
-    data = formatBranches(data)
+    if prefetch is not None:
+        data = ak.concatenate(list(iterArrays(inputFiles, branches, nFiles, step_size, prefetch)))
+    else:
+        data = ak.concatenate([_counted(batch, report, branches) for batch, report in uproot.iterate(files, filter_name=branches, step_size=step_size, report=True)])
+        data = indexSums(formatBranches(data))
+
+    # keep the formatted arrays as parquet if a file name is given
+    if fname:
+        storage.writeChunk(data, fname)
 
     return data
 
 
+def iterArrays(inputFiles, branches, nFiles=1, step_size="100 MB", prefetch=None):
+
+    files = [{file: 'Events'} for file in inputFiles][:nFiles]
+
+    # the baskets of the next files are fetched while this one is decoded
+    if prefetch is not None:
+        for fileName, tree in prefetching.iterTrees(inputFiles[:nFiles], branches, **prefetch):
+            yield from iterTree(tree, branches, step_size)
+        return
+
+    # format each batch as it is read so only one chunk is held in memory
+    for batch, report in uproot.iterate(files, filter_name=branches, step_size=step_size, report=True):
+        yield indexSums(formatBranches(_counted(batch, report, branches)))
+
+
+def iterTree(tree, branches, step_size="100 MB"):
+
+    # formatted chunks of an already open tree
+    profiling.count(files=1)
+    for batch, report in tree.iterate(filter_name=branches, step_size=step_size, report=True):
+        profiling.count(events=len(batch), bytes=profiling.basketBytes(tree, branches, report.tree_entry_start, report.tree_entry_stop))
+        yield indexSums(formatBranches(batch))
+
+
+def _counted(batch, report, branches):
+
+    # events, bytes and files read, for the open profiling stages
+    profiling.count(events=len(batch), bytes=profiling.basketBytes(report.tree, branches, report.tree_entry_start, report.tree_entry_stop),
+                    files=int(report.tree_entry_start == 0))
+    return batch
+
+
+def iterHdf(fileName, key, chunksize=1000000):
+
+    # read a stored dataframe back in chunks (table format) or in one go (fixed format),
+    # decoded from the compact summary columns; directories are memory-mapped column stores
+    if os.path.isdir(fileName):
+        for chunk in summary.iterColumns(fileName, key, chunksize):
+            profiling.count(events=len(chunk))
+            yield chunk
+        return
+
+    with pd.HDFStore(fileName, mode='r') as store:
+        if store.get_storer(key).is_table:
+            for chunk in store.select(key, chunksize=chunksize):
+                profiling.count(events=len(chunk))
+                yield summary.decode(chunk)
+        else:
+            df = store[key]
+            profiling.count(events=len(df))
+            yield summary.decode(df)
+
+
 def getL1Types(useEmu=False, useMP=False):
     
     l1Type = 'L1Emul' if useEmu else 'L1' 
@@ -43,35 +113,65 @@ def getBranches(inputs=[], useEmu=False, useMP=False):
 
     return all_branches
 
+def formatName(branch):
+
+    # remove the prefixes to the branch names for tidyness
+    if branch.startswith("Jet_"):
+        branch = branch.replace("Jet_", "recoJet_")
+    if "L1" in branch:
+        branch = branch.replace("L1", "").replace("MP", "").replace("Emul", "")
+    return branch
+
+
+def rawName(name, useEmu=False, useMP=False):
+
+    # nano branch of a formatted name, the inverse of formatName for one L1 type
+    l1Type, l1SumType = getL1Types(useEmu, useMP)
+    if name.startswith("recoJet_"):
+        return name.replace("recoJet_", "Jet_")
+    collection = name.split("_")[0]
+    if collection == 'EtSum':
+        return l1SumType + name
+    if collection in branches.l1Objects:
+        return l1Type + name
+    return name
+
+
+def renameMap(fields):
+
+    # formatted name of every field, refusing two fields that would end up with the same name
+    names = {field: formatName(field) for field in fields}
+    if len(set(names.values())) < len(names):
+        clashes = {}
+        for field, name in names.items():
+            clashes.setdefault(name, []).append(field)
+        raise ValueError("Branches with the same formatted name: " + str([group for group in clashes.values() if len(group) > 1]))
+    return names
+
+
 def formatBranches(data):
     
-    # remove the prefixes to the branch names for tidyness
-    for branch in ak.fields(data):
-        if branch.startswith("Jet_"):
-            data[branch.replace("Jet_", "recoJet_")] = data[branch]
-            del data[branch]
-
-    for branch in ak.fields(data):
-        if "L1" in branch:
-            data[branch.replace("L1", "").replace("MP", "").replace("Emul", "")] = data[branch]
-            del data[branch]
-            
-    return data
+    # remove the prefixes to the branch names for tidyness, renaming the fields
+    # of the record in one go: the columns themselves aren't touched or copied
+    names = renameMap(ak.fields(data))
+    layout = ak.to_layout(data)
+    if isinstance(layout, ak.contents.RecordArray):
+        layout = ak.contents.RecordArray(layout.contents, [names[field] for field in layout.fields], length=layout.length, parameters=layout.parameters)
+        return ak.Array(layout, behavior=data.behavior, attrs=data.attrs)
+
+    return ak.zip({names[field]: data[field] for field in ak.fields(data)}, depth_limit=1)
 
 
 def getL1EmulHT(data):
     
-    JET = data[branches.puppiJetBranches]
-    etSum = ak.sum(JET['Jet_pt'], axis=1)
+    # only the pt is needed, so lazy events read just that branch
+    etSum = ak.sum(data['Jet_pt'], axis=1)
     
     return etSum
 
 def getL1EmulJet1(data):
     
-    JET = data[branches.puppiJetBranches]
-    JET['leadingPt'] = ak.max(JET['Jet_pt'], axis=1)
-
-    return JET['leadingPt']
+    return ak.max(data['Jet_pt'], axis=1)
     
 def getPUPPIJET(data):
     DR_MAX = 0.4  # Maximum delta R between L1T and offline jets for matching
@@ -86,50 +186,187 @@ def getPUPPIJET(data):
     puppiJET['recoJet_ht'] = ak.sum(puppiJET['recoJet_pt'], axis=1)
     puppiJET['leadingPt'] = ak.max(puppiJET['recoJet_pt'], axis=1)
 
-    leading_puppi_idx = ak.argmax(puppiJET["recoJet_pt"], axis=1)
-    leading_jet_eta = puppiJET['recoJet_eta'][leading_puppi_idx]
-    leading_jet_phi = puppiJET['recoJet_phi'][leading_puppi_idx]
-    leading_jet_pt = puppiJET['recoJet_pt'][leading_puppi_idx]
-
-    matched_l1_jet = []
-    for i in range(len(leading_jet_eta)):
-        matched_jet = None
-        for j in range(len(l1jet['Jet_pt'][i])):
-            dR = deltaR(leading_jet_eta[i], leading_jet_phi[i], l1jet['Jet_eta'][i][j], l1jet['Jet_phi'][i][j])
-            if ak.any(dR < DR_MAX) and ak.any(leading_jet_pt[i] > minpT):
-                matched_jet = l1jet['Jet_pt'][i][j]
-                break
-        matched_l1_jet.append(matched_jet)
+    # first L1 jet within DR_MAX of the leading offline jet
+    matched = matching.matchObjects(matching.getObjects(puppiJET, 'recoJet'), matching.getObjects(l1jet, 'Jet'),
+                                    mode='leading', drMax=DR_MAX, refMinPt=minpT)
+    matched_l1_jet = matched['pt']
 
     puppiJET = ak.with_field(puppiJET, matched_l1_jet, "matched_l1_jet")
     return puppiJET
 
 
 
-def getPUPPIMET(data):
-    
-    # get the offline puppi MET
-    puppiMET = data[branches.puppiMETBranches]
-    puppiMET = ak.with_field(puppiMET, puppiMET['PuppiMET_pt']*np.cos(puppiMET['PuppiMET_phi']), "PuppiMET_ptx")
-    puppiMET = ak.with_field(puppiMET, puppiMET['PuppiMET_pt']*np.sin(puppiMET['PuppiMET_phi']), "PuppiMET_pty")
+def _offsets(array):
 
-    # get the offline muons
-    muons = data[branches.muonBranches]
-    muons = muons[muons["Muon_isPFcand"] == 1]
-    del muons["Muon_isPFcand"]
-    muons = ak.with_field(muons, muons['Muon_pt']*np.cos(muons['Muon_phi']), "Muon_ptx")
-    muons = ak.with_field(muons, muons['Muon_pt']*np.sin(muons['Muon_phi']), "Muon_pty")
+    # list offsets of a jagged column, starting at 0
+    offsets = np.zeros(len(array) + 1, dtype=np.int64)
+    np.cumsum(ak.to_numpy(ak.num(array, axis=1)), out=offsets[1:])
+    return offsets
 
-    # make the offline puppi MET no mu
-    puppiMET_noMu = ak.copy(puppiMET)
-    puppiMET_noMu['PuppiMET_ptx'] = puppiMET['PuppiMET_ptx'] + np.sum(muons['Muon_ptx'], axis=1)
-    puppiMET_noMu['PuppiMET_pty'] = puppiMET['PuppiMET_pty'] + np.sum(muons['Muon_pty'], axis=1)
-    puppiMET_noMu['PuppiMET_pt'] = np.sqrt(puppiMET_noMu['PuppiMET_ptx']**2 + puppiMET_noMu['PuppiMET_pty']**2)
-    
-    del puppiMET['PuppiMET_phi'], puppiMET['PuppiMET_ptx'], puppiMET['PuppiMET_pty']
-    del puppiMET_noMu['PuppiMET_phi'], puppiMET_noMu['PuppiMET_ptx'], puppiMET_noMu['PuppiMET_pty']
-    
-    return puppiMET, puppiMET_noMu
+
+def _perEvent(values, offsets):
+
+    # per event sums of flat values, as differences of the running (float64) sum at the list offsets
+    total = np.zeros(len(values) + 1)
+    np.cumsum(values, dtype=np.float64, out=total[1:])
+    return np.diff(total[offsets])
+
+
+# muons taken out of the MET for PuppiMETNoMu and the recoil, as (branch, op, value)
+# cuts on the muon branches (which must be read, see branches.muonBranches)
+muonCuts = [('Muon_isPFcand', '==', 1)]
+
+_ops = {'==': np.equal, '!=': np.not_equal, '>': np.greater, '>=': np.greater_equal, '<': np.less, '<=': np.less_equal}
+
+
+def getMETs(data, muonCuts=muonCuts, recoil=False):
+
+    """
+    PuppiMET and PuppiMETNoMu (the selected muons added back) as flat float64
+    arrays, from one pass over the flat muon content: the muon px/py are
+    summed per event at the list offsets instead of building records. With
+    recoil=True also the hadronic recoil u = -(MET + muons) along (RecoilPara)
+    and across (RecoilPerp) the selected muon system, and its pt
+    (MuonSystemPt); NaN without a selected muon.
+    """
+
+    metPt = ak.to_numpy(data['PuppiMET_pt'])
+    metPhi = ak.to_numpy(data['PuppiMET_phi'])
+
+    # flat muon content, unselected muons weighted by zero, in the input precision
+    muonPt = data['Muon_pt']
+    offsets = _offsets(muonPt)
+    weight = ak.to_numpy(ak.flatten(muonPt))
+    for branch, op, value in muonCuts:
+        weight = np.where(_ops[op](ak.to_numpy(ak.flatten(data[branch])), value), weight, 0)
+    phi = ak.to_numpy(ak.flatten(data['Muon_phi']))
+
+    muonX = _perEvent(weight*np.cos(phi), offsets)
+    muonY = _perEvent(weight*np.sin(phi), offsets)
+    noMuX = muonX + metPt*np.cos(metPhi)
+    noMuY = muonY + metPt*np.sin(metPhi)
+    mets = {'PuppiMET': metPt.astype(np.float64), 'PuppiMETNoMu': np.hypot(noMuX, noMuY)}
+
+    if recoil:
+        qT = np.hypot(muonX, muonY)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mets['RecoilPara'] = np.where(qT > 0, -(noMuX*muonX + noMuY*muonY)/qT, np.nan)
+            mets['RecoilPerp'] = np.where(qT > 0, (noMuY*muonX - noMuX*muonY)/qT, np.nan)
+        mets['MuonSystemPt'] = np.where(qT > 0, qT, np.nan)
+
+    return mets
+
+
+# quantities of the jet sum variants: scalar and vector pt sums, number of
+# jets and pt of the n-th leading jet
+jetQuantities = ('ht', 'mht', 'njets', 'jet')
+
+
+def jetReads(collection, variants):
+
+    # branches of a jet collection ('Jet', 'recoJet') the variants need
+    reads = [collection + '_pt']
+    if any(variant.get('etaMax') is not None for variant in variants):
+        reads.append(collection + '_eta')
+    if any(variant['quantity'] == 'mht' for variant in variants):
+        reads.append(collection + '_phi')
+    if any(variant.get('bx') is not None for variant in variants):
+        reads.append(collection + '_bx')
+    return reads
+
+
+def getJetSums(data, collection, variants):
+
+    """
+    Jet sum variants of one jet collection ('Jet' for the L1 jets, 'recoJet'
+    for the offline ones) from a single pass over its flat content, e.g.
+
+        getJetSums(data, 'recoJet', [{'name': 'HT30er2p4', 'quantity': 'ht', 'ptMin': 30, 'etaMax': 2.4},
+                                     {'name': 'Jet2', 'quantity': 'jet', 'n': 2}])
+
+    Jets pass a variant with pt > ptMin, |eta| < etaMax and the given bx (each
+    optional). Each distinct selection is one mask over the flat jets, and each
+    variant then a per event sum of it (ht, mht, njets) or a lookup of the
+    n-th selected jet in the pt ordered jets (jet), so a variant costs a few
+    flat operations rather than a pass over the collection. Returns a
+    dataframe with a float64 column per variant (int64 for njets), 0 for the
+    sums of events without jets and NaN for missing n-th jets.
+    """
+
+    pt = data[collection + '_pt']
+    offsets = _offsets(pt)
+    nEvents = len(offsets) - 1
+    flat = {'pt': ak.to_numpy(ak.flatten(pt))}
+
+    # jets by decreasing pt within each event for the n-th jets (nano already
+    # orders them, then nothing moves); the sums don't depend on the order
+    order = slice(None)
+    if any(variant['quantity'] == 'jet' for variant in variants):
+        rising = np.diff(flat['pt']) > 0
+        boundaries = offsets[1:-1] - 1
+        rising[boundaries[(boundaries >= 0) & (boundaries < len(rising))]] = False
+        if rising.any():
+            order = ak.to_numpy(ak.flatten(ak.argsort(pt, axis=1, ascending=False))) + np.repeat(offsets[:-1], np.diff(offsets))
+            flat['pt'] = flat['pt'][order]
+
+    def column(var):
+        if var not in flat:
+            flat[var] = ak.to_numpy(ak.flatten(data[collection + '_' + var]))[order]
+        return flat[var]
+
+    def selection(variant):
+        key = (variant.get('ptMin'), variant.get('etaMax'), variant.get('bx'))
+        if key not in selections:
+            mask = np.ones(len(flat['pt']), dtype=bool)
+            if key[0] is not None:
+                mask &= flat['pt'] > key[0]
+            if key[1] is not None:
+                mask &= np.abs(column('eta')) < key[1]
+            if key[2] is not None:
+                mask &= column('bx') == key[2]
+            selections[key] = mask
+        return selections[key]
+
+    selections = {}
+    columns = {}
+    for variant in variants:
+        quantity = variant['quantity']
+        mask = selection(variant)
+
+        if quantity == 'ht':
+            columns[variant['name']] = _perEvent(np.where(mask, flat['pt'], 0), offsets)
+
+        elif quantity == 'mht':
+            if 'px' not in flat:
+                phi = column('phi')
+                flat['px'], flat['py'] = flat['pt']*np.cos(phi), flat['pt']*np.sin(phi)
+            columns[variant['name']] = np.hypot(_perEvent(np.where(mask, flat['px'], 0), offsets),
+                                                _perEvent(np.where(mask, flat['py'], 0), offsets))
+
+        elif quantity == 'njets':
+            columns[variant['name']] = _perEvent(mask, offsets).astype(np.int64)
+
+        elif quantity == 'jet':
+            # the n-th selected jet of an event is where the running count of its selected jets reaches n
+            counts = np.zeros(len(mask) + 1, dtype=np.int32)
+            np.cumsum(mask, out=counts[1:])
+            index = np.searchsorted(counts, counts[offsets[:-1]] + variant.get('n', 1), side='left') - 1
+            found = index < offsets[1:]
+            value = np.full(nEvents, np.nan)
+            value[found] = flat['pt'][index[found]]
+            columns[variant['name']] = value
+
+        else:
+            raise ValueError("Unknown jet sum quantity {} of {}, use one of {}".format(quantity, variant['name'], jetQuantities))
+
+    return pd.DataFrame(columns)
+
+
+def getPUPPIMET(data):
+
+    # PuppiMET_pt records of the puppi MET and puppi MET no mu, see getMETs
+    mets = getMETs(data)
+    return ak.zip({'PuppiMET_pt': mets['PuppiMET']}), ak.zip({'PuppiMET_pt': mets['PuppiMETNoMu']})
 
 def apply_pt_cut(data, puppiMET_noMu, cut_value = -1):
     return data[puppiMET_noMu['PuppiMET_pt'] > cut_value], puppiMET_noMu[puppiMET_noMu['PuppiMET_pt'] > cut_value]
@@ -154,7 +391,7 @@ def flatten(data, puppiMET_noMu, types=[]):
         puppiMET_noMu = puppiMET_noMu[rand_arr[puppiMET_noMu['PuppiMET_pt'] > 0]*(a-puppiMET_noMu['PuppiMET_pt']**b/cutoff**b) < c]
     
     if 'l1' in types:
-        l1MET = ak.flatten(getSum(data, 'methf')['EtSum_pt'])
+        l1MET = getSumPt(data, 'methf')
         rand_arr = np.random.rand(len(l1MET))
         data = data[rand_arr[l1MET > 0]*(a-l1MET**b/cutoff**b) < c]
         puppiMET_noMu = puppiMET_noMu[rand_arr[l1MET > 0]*(a-l1MET**b/cutoff**b) < c]
@@ -162,20 +399,47 @@ def flatten(data, puppiMET_noMu, types=[]):
     return data, puppiMET_noMu
     
 
+def indexSums(data):
+
+    # one-time flattening of the jagged EtSum collection into a regular
+    # (event x etSumType) table of the bx = 0 values, NaN where a sum is missing,
+    # so any sum is then a column access
+    if not set(branches.sumBranches) <= set(ak.fields(data)):
+        return data
+
+    bx0 = data['EtSum_bx'] == 0
+    pts = data['EtSum_pt'][bx0]
+    types = ak.to_numpy(ak.flatten(data['EtSum_etSumType'][bx0]))
+    values = ak.to_numpy(ak.flatten(pts))
+
+    nTypes = max(max(branches.sums.values()), types.max(initial=0)) + 1
+    table = np.full((len(data), nTypes), np.nan, dtype=np.result_type(values.dtype, np.float32))
+    table[np.repeat(np.arange(len(data)), ak.to_numpy(ak.num(pts, axis=1))), types] = values
+
+    return ak.with_field(data, table, branches.sumTableBranch)
+
+
+def getSumTable(data):
+
+    # data.fields so lazy events (utils.lazy) build the table on demand
+    if branches.sumTableBranch not in data.fields:
+        data = indexSums(data)
+    return data[branches.sumTableBranch]
+
+
+def getSumPt(data, sumType):
+
+    # flat bx = 0 value of one sum type per event, NaN if missing
+    return getSumTable(data)[:, branches.sums[sumType]]
+
+
 def getCollections(data, inputSums, inputs=[]):
 
     collections = {}
 
-    # get the sums
-    l1Sums = data[branches.sumBranches]
-    l1Sums = l1Sums[l1Sums['EtSum_bx'] == 0]
-    del l1Sums['EtSum_bx']
-
     # make the sum collections
     for esum in inputSums:
-        sumCol = l1Sums[l1Sums['EtSum_etSumType'] == branches.sums[esum]]
-        del sumCol['EtSum_etSumType']
-        collections[esum] = sumCol
+        collections[esum] = getSum(data, esum)
         
     # make the object collecions
     for input in inputs:
@@ -188,40 +452,47 @@ def getCollections(data, inputSums, inputs=[]):
 
 def getSum(data, sumType):
     
-    # get the sums
-    l1Sums = data[branches.sumBranches]
-    l1Sums = l1Sums[l1Sums['EtSum_bx'] == 0]
-    del l1Sums['EtSum_bx']
-
-    etSum = l1Sums[l1Sums['EtSum_etSumType'] == branches.sums[sumType]]
-    del etSum['EtSum_etSumType']
+    # bx = 0 sum of this type from the sum table, as a (0 or 1 long) list per event
+    etSum = getSumPt(data, sumType)
+    etSum = ak.singletons(ak.mask(etSum, ~np.isnan(etSum)))
     
-    return etSum
+    return ak.zip({'EtSum_pt': etSum}, depth_limit=1)
+
+
+def toNumpy(array):
+
+    # flat awkward values as a numpy column (no python objects), with the dtypes
+    # pandas would give: float64 with NaN for missing values, int64 for ints
+    values = ak.to_numpy(array, allow_missing=True)
+    if np.ma.isMaskedArray(values):
+        values = values.astype(np.float64).filled(np.nan)
+    if values.dtype.kind in 'iu':
+        return values.astype(np.int64, copy=False)
+    if values.dtype.kind == 'f':
+        return values.astype(np.float64, copy=False)
+    return values
 
 
 def makeDataframe(collections, fileName=None, nObj=0, keepStruct=False):
     
-    object_dfs = []
+    columns = {}
     for coll in collections:
         if coll in ['Jet', 'EG', 'Tau']:
-            objects = pd.DataFrame(ak.to_list(ak.fill_none(ak.pad_none(ak.sort(collections[coll], ascending=False), nObj, clip=True), 0)))
+            objects = ak.fill_none(ak.pad_none(ak.sort(collections[coll], ascending=False), nObj, clip=True), 0)
+            nCols = nObj
         else:
-            objects = pd.DataFrame(ak.to_list(collections[coll]))
-        object_labels= ["{}_{}".format(coll, i) for i in range(len(objects.values.tolist()[0][0]))]
-        for column in objects.columns:
-            object = pd.DataFrame(objects.pop(column).values.tolist())
-            object.columns = pd.MultiIndex.from_product([object_labels, [column.split("_")[1]]])
-            object_dfs.append(object)
-
-    df = pd.concat(object_dfs, axis=1)
-
-    new_cols = pd.MultiIndex.from_tuples(sorted(list(df.columns)))
-    for col in new_cols:
-        df[col] = df.pop(col)
-
-    if keepStruct:
-        df
-    else:
+            objects = collections[coll]
+            nCols = len(objects[ak.fields(objects)[0]][0])
+        # one regular (event x nCols) block per variable, split into columns
+        for field in ak.fields(objects):
+            block = toNumpy(ak.flatten(ak.pad_none(objects[field], nCols, clip=True), axis=None)).reshape(-1, nCols)
+            for i in range(nCols):
+                columns[("{}_{}".format(coll, i), field.split("_")[1])] = block[:, i]
+
+    df = pd.DataFrame({col: columns[col] for col in sorted(columns)})
+    df.columns = pd.MultiIndex.from_tuples(df.columns)
+
+    if not keepStruct:
         df.columns = ["{}_{}".format(col[0], col[1]) for col in df.columns]
 
     if fileName:
@@ -232,7 +503,10 @@ def makeDataframe(collections, fileName=None, nObj=0, keepStruct=False):
 
 def arrayToDataframe(array, label, fileName):
 
-    df = pd.DataFrame(ak.to_list(array))
+    if ak.fields(array):
+        df = pd.DataFrame({field: toNumpy(array[field]) for field in ak.fields(array)})
+    else:
+        df = pd.DataFrame(toNumpy(array))
     if fileName:
         df.to_hdf(fileName, label, mode='a')
     
@@ -2,6 +2,7 @@ import numpy as np
 import pandas as pd
 import awkward as ak
 import utils.branches as branches
+import utils.matching as matching
 import uproot
 import vector
 
@@ -91,20 +92,10 @@ def getPUPPIJET(data):
     puppiJET['recoJet_ht'] = ak.sum(puppiJET['recoJet_pt'], axis=1)
     puppiJET['leadingPt'] = ak.max(puppiJET['recoJet_pt'], axis=1)
 
-    leading_puppi_idx = ak.argmax(puppiJET["recoJet_pt"], axis=1)
-    leading_jet_eta = puppiJET['recoJet_eta'][leading_puppi_idx]
-    leading_jet_phi = puppiJET['recoJet_phi'][leading_puppi_idx]
-    leading_jet_pt = puppiJET['recoJet_pt'][leading_puppi_idx]
-
-    matched_l1_jet = []
-    for i in range(len(leading_jet_eta)):
-        matched_jet = None
-        for j in range(len(l1jet['Jet_pt'][i])):
-            dR = deltaR(leading_jet_eta[i], leading_jet_phi[i], l1jet['Jet_eta'][i][j], l1jet['Jet_phi'][i][j])
-            if ak.any(dR < DR_MAX) and ak.any(leading_jet_pt[i] > minpT):
-                matched_jet = l1jet['Jet_pt'][i][j]
-                break
-        matched_l1_jet.append(matched_jet)
+    # first L1 jet within DR_MAX of the leading offline jet
+    matched = matching.matchObjects(matching.getObjects(puppiJET, 'recoJet'), matching.getObjects(l1jet, 'Jet'),
+                                    mode='leading', drMax=DR_MAX, refMinPt=minpT)
+    matched_l1_jet = matched['pt']
 
     puppiJET = ak.with_field(puppiJET, matched_l1_jet, "matched_l1_jet")
     return puppiJET
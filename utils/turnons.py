@@ -0,0 +1,210 @@
+import numpy as np
+import pandas as pd
+from scipy.special import erf, erfinv
+
+
+# turn-on models, eff(x) for parameters (plateau, mu, width) per curve:
+#   'erf'       plateau/2 * (1 + erf((x - mu)/(sqrt(2)*width))), mu the half plateau point
+#   'gompertz'  plateau * exp(-exp(-(x - mu)/width)), asymmetric, mu the plateau/e point
+# each as (efficiencies and their (curve x bin x parameter) derivatives, offline value where eff = q)
+
+def _erf(x, p):
+    plateau, mu, width = p[:, :1], p[:, 1:2], p[:, 2:]
+    z = (x - mu)/(np.sqrt(2)*width)
+    rise = (1 + erf(z))/2
+    slope = plateau*np.exp(-z**2)/np.sqrt(np.pi)
+    return plateau*rise, np.stack([rise, -slope/(np.sqrt(2)*width), -slope*z/width], axis=-1)
+
+
+def _erfPoint(q, p):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(p[:, 0] > q, p[:, 1] + np.sqrt(2)*p[:, 2]*erfinv(2*q/p[:, 0] - 1), np.nan)
+
+
+def _gompertz(x, p):
+    plateau, mu, width = p[:, :1], p[:, 1:2], p[:, 2:]
+    u = np.exp(np.clip(-(x - mu)/width, -50, 50))
+    rise = np.exp(-u)
+    return plateau*rise, np.stack([rise, -plateau*rise*u/width, -plateau*rise*u*(x - mu)/width**2], axis=-1)
+
+
+def _gompertzPoint(q, p):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(p[:, 0] > q, p[:, 1] - p[:, 2]*np.log(-np.log(q/p[:, 0])), np.nan)
+
+
+models = {'erf': (_erf, _erfPoint), 'gompertz': (_gompertz, _gompertzPoint)}
+
+# limits the plateau is kept within during the fit
+plateauBounds = (1e-3, 1.)
+
+
+def atBound(p):
+    # curves whose fitted plateau sits on one of its limits
+    return np.isclose(p[:, 0], plateauBounds[0], rtol=0, atol=1e-9) | np.isclose(p[:, 0], plateauBounds[1], rtol=0, atol=1e-9)
+
+
+def _start(x, effs, weights):
+
+    # plateau from the last filled bins, mu where the curve first reaches half of it,
+    # width from the rise to 90% of it
+    filled = weights > 0
+    last = np.where(filled, np.arange(len(x)), -1).max(axis=1)
+    tail = filled & (np.arange(len(x)) >= (last - 2)[:, None])
+    plateau = np.clip(np.nansum(np.where(tail, effs, 0), axis=1)/np.maximum(tail.sum(axis=1), 1), 0.05, 1.)
+
+    def crossing(fraction):
+        above = filled & (np.nan_to_num(effs) >= fraction*plateau[:, None])
+        return np.where(above.any(axis=1), x[np.argmax(above, axis=1)], x[-1])
+
+    mu = crossing(0.5)
+    width = np.maximum((crossing(0.9) - mu)/1.28, x[1] - x[0] if len(x) > 1 else 1.)
+    return np.stack([plateau, mu, width], axis=1)
+
+
+def _chi2(model, x, p, effs, weights):
+    return np.sum(weights*(model(x, p)[0] - np.nan_to_num(effs))**2, axis=1)
+
+
+def fit(x, nums, denom, model='erf', start=None, maxIter=1000, tolerance=1e-8):
+
+    """
+    Binomially weighted least squares fits of one model to many efficiency
+    curves at once: nums (curve x bin) passing counts over denom (bin, or curve
+    x bin) events at the offline bin centres x. All curves take their
+    Levenberg-Marquardt steps together, as (curve x 3 x 3) solves, each with its
+    own damping, so hundreds of curves cost about as much as one. start
+    (curve x 3) gives starting parameters, e.g. the fits of a neighbouring
+    threshold or config; they're estimated from the curves otherwise.
+
+    Returns the (curve x 3) parameters (plateau, mu, width), their (curve x 3 x 3)
+    covariance, the chi2, the degrees of freedom and whether each fit converged.
+    The plateau is kept within plateauBounds; for curves ending on a bound
+    (atBound) it is held fixed there, so its row of the covariance is zero and
+    the errors of mu and width are those at that plateau.
+    """
+
+    func = models[model][0]
+    x = np.asarray(x, dtype=np.float64)
+    k = np.atleast_2d(np.asarray(nums, dtype=np.float64))
+    n = np.broadcast_to(np.asarray(denom, dtype=np.float64), k.shape)
+
+    # efficiencies with their bayes variance, empty bins left out
+    with np.errstate(divide='ignore', invalid='ignore'):
+        effs = k/n
+    variance = ((k + 1)*(k + 2))/((n + 2)*(n + 3)) - ((k + 1)/(n + 2))**2
+    weights = np.where(n > 0, 1/variance, 0.)
+
+    p = _start(x, effs, weights) if start is None else np.array(start, dtype=np.float64)
+    ndf = (weights > 0).sum(axis=1) - 3
+    usable = (ndf > 0) & np.all(np.isfinite(p), axis=1)
+    p[~usable] = _start(x, effs, weights)[~usable]
+
+    chi2 = _chi2(func, x, p, effs, weights)
+    damping = np.full(len(p), 1e-3)
+    converged = ~usable
+    identity = np.eye(3)
+    for _ in range(maxIter):
+        # only the curves still moving take a step
+        active = np.flatnonzero(~converged)
+        if not len(active):
+            break
+        pa, ya, wa = p[active], np.nan_to_num(effs[active]), weights[active]
+        f, jac = func(x, pa)
+        wJac = jac*wa[..., None]
+        alpha = np.einsum('cbi,cbj->cij', wJac, jac)
+        beta = np.einsum('cbi,cb->ci', wJac, ya - f)
+
+        # Marquardt damping of the diagonal, the tiny ridge keeps flat directions solvable
+        curvature = alpha + (damping[active, None, None]*np.diagonal(alpha, axis1=1, axis2=2)[:, :, None] + 1e-12)*identity
+        trial = pa + np.linalg.solve(curvature, beta[..., None])[..., 0]
+        trial[:, 0] = np.clip(trial[:, 0], *plateauBounds)
+        trial[:, 2] = np.maximum(trial[:, 2], 1e-3*(abs(x[-1] - x[0]) or 1.))
+
+        trialChi2 = _chi2(func, x, trial, effs[active], wa)
+        better = trialChi2 <= chi2[active]
+        converged[active] = better & (chi2[active] - trialChi2 <= tolerance*np.maximum(chi2[active], 1.))
+        p[active[better]] = trial[better]
+        chi2[active[better]] = trialChi2[better]
+        damping[active] = np.clip(np.where(better, damping[active]/3, damping[active]*4), 1e-9, 1e9)
+
+    f, jac = func(x, p)
+    wJac = jac*weights[..., None]
+    covariance = np.linalg.pinv(np.einsum('cbi,cbj->cij', wJac, jac))
+
+    # the unconstrained covariance doesn't hold with the plateau on a bound: fix it there
+    fixed = atBound(p)
+    if fixed.any():
+        covariance[fixed] = 0.
+        covariance[np.ix_(fixed, [1, 2], [1, 2])] = np.linalg.pinv(np.einsum('cbi,cbj->cij', wJac[fixed][..., 1:], jac[fixed][..., 1:]))
+
+    p[~usable], covariance[~usable], chi2[~usable] = np.nan, np.nan, np.nan
+    return p, covariance, chi2, ndf, converged & usable
+
+
+def points(p, covariance, q, model='erf'):
+
+    # offline value where the fitted efficiency reaches q (NaN below the plateau)
+    # and its uncertainty, propagated with the numerical gradient, stepped per curve
+    point = models[model][1]
+    values = point(q, p)
+    gradient = np.empty(p.shape)
+    for i in range(3):
+        step = 1e-6*np.maximum(np.nan_to_num(np.abs(p[:, i]), nan=1.), 1e-3)
+        shift = np.zeros(p.shape)
+        shift[:, i] = step
+        gradient[:, i] = (point(q, p + shift) - point(q, p - shift))/(2*step)
+    return values, np.sqrt(np.einsum('ci,cij,cj->c', gradient, covariance, gradient))
+
+
+def fitEffHists(effHists, labels, model='erf', refit=True):
+
+    """
+    Turn-on fits of every (label, threshold) curve of a list of EffHists, one
+    row each: the plateau, 50% and 95% points (absolute efficiency, NaN when
+    the plateau is below) and the width, with their uncertainties, plus chi2,
+    ndf, convergence and whether the plateau ended on its bound (its error
+    is then 0 and the others are at the fixed plateau). Curves that don't
+    converge from their own starting values are fitted again from the fit of
+    the previous threshold of the same label, shifted by the threshold
+    difference, and keep the better fit, e.g.
+
+        table = turnons.fitEffHists(effHists, l1Labels, 'erf')
+        table.to_csv(writeDir + "MET_turnOns.csv", index=False)
+    """
+
+    rows = [(label, threshold) for effHist, label in zip(effHists, labels) for threshold in effHist.thresholds]
+    if not rows:
+        return pd.DataFrame(columns=['label', 'threshold', 'model'])
+    x = (effHists[0].edges[:-1] + effHists[0].edges[1:])/2
+    nums = np.concatenate([effHist.nums for effHist in effHists])
+    denom = np.concatenate([np.broadcast_to(effHist.denom, effHist.nums.shape) for effHist in effHists])
+
+    p, covariance, chi2, ndf, converged = fit(x, nums, denom, model)
+
+    if refit and not converged.all():
+        # warm start from the neighbouring (lower) threshold of the same label
+        previous = np.array([i - 1 if i > 0 and rows[i - 1][0] == rows[i][0] else -1 for i in range(len(rows))])
+        again = np.flatnonzero(~converged & (previous >= 0) & converged[np.maximum(previous, 0)])
+        if len(again):
+            start = p[previous[again]].copy()
+            start[:, 1] += np.array([rows[i][1] - rows[j][1] for i, j in zip(again, previous[again])])
+            p2, covariance2, chi22, _, converged2 = fit(x, nums[again], denom[again], model, start)
+            better = converged2 & ~(chi22 > chi2[again])
+            p[again[better]], covariance[again[better]] = p2[better], covariance2[better]
+            chi2[again[better]], converged[again[better]] = chi22[better], True
+
+    x50, x50Err = points(p, covariance, 0.5, model)
+    x95, x95Err = points(p, covariance, 0.95, model)
+    errors = np.sqrt(np.diagonal(covariance, axis1=1, axis2=2))
+
+    return pd.DataFrame({'label': [row[0] for row in rows], 'threshold': [row[1] for row in rows], 'model': model,
+                         'plateau': p[:, 0], 'plateauErr': errors[:, 0], 'x50': x50, 'x50Err': x50Err,
+                         'x95': x95, 'x95Err': x95Err, 'width': p[:, 2], 'widthErr': errors[:, 2],
+                         'mu': p[:, 1], 'chi2': chi2, 'ndf': ndf, 'converged': converged, 'atBound': atBound(p)})
+
+
+def curve(row, x):
+
+    # fitted efficiency of a fitEffHists row at x, for plotting
+    return models[row['model']][0](np.asarray(x, dtype=np.float64), np.array([[row['plateau'], row['mu'], row['width']]]))[0][0]